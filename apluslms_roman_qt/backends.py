@@ -0,0 +1,465 @@
+"""
+Backends, which run the build steps.
+
+A backend creates an execution of a step with create(), which is given
+the index of the step, the step and the course directory. The execution
+has the part of the QProcess interface the BuildRunner uses: the signals
+readyReadStandardOutput, finished and errorOccurred and the methods
+readAllStandardOutput(), processId(), state(), errorString(),
+waitForFinished(), stop(grace_ms) and kill(). run() starts it, command is
+the command line shown in the log and container_id the id of the docker
+container, when it is known.
+
+DockerBackend runs the steps with docker run and can record their output.
+ReplayBackend replays the recorded outputs, timings and exit codes faster
+than real time, so the build can be run without docker. With speed 0,
+the outputs are replayed as fast as the log can read them.
+"""
+import json
+import os
+import re
+import shutil
+import signal
+import tempfile
+import uuid
+from functools import partial
+
+from PyQt5.QtCore import (
+    QCoreApplication,
+    QElapsedTimer,
+    QObject,
+    QProcess,
+    QSettings,
+    QTimer,
+    pyqtSignal,
+)
+
+from .resources import group_pids, proc_available
+
+
+# runs the program in a new session, so it leads a new process group
+SETSID = shutil.which('setsid') if hasattr(os, 'killpg') else None
+
+
+def signal_group(pgid, sig) -> bool:
+    """Send the signal to the process group, return False if it is gone"""
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def group_alive(pgid) -> bool:
+    """Return True, if a process of the group is still running"""
+    if proc_available():
+        return bool(group_pids(pgid))
+    return signal_group(pgid, 0)
+
+
+def fixture_name(num, step):
+    # steps may share an image, so the index keeps the names apart
+    return '%02d-%s.json' % (num, re.sub(r'[^\w.-]+', '_', step.name))
+
+
+def write_fixture(path, chunks, exit_code=0, duration=None):
+    """Write a replay fixture of [(seconds from the start, bytes)] chunks"""
+    if duration is None:
+        duration = chunks[-1][0] if chunks else 0.0
+    data = {
+        'exit_code': exit_code,
+        'duration': round(duration, 3),
+        'chunks': [[round(t, 3), chunk.decode('utf-8', 'surrogateescape')]
+                   for t, chunk in chunks],
+    }
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    with open(path, 'w', encoding='utf-8') as f:
+        json.dump(data, f)
+
+
+class StepProcess(QProcess):
+    """QProcess, which runs the program as the leader of a process group.
+
+    stop() sends SIGTERM to the group and SIGKILL after grace_ms, so the
+    children of the program are stopped too. When the leader exits, the
+    rest of the group is killed at once. A docker client doesn't pass
+    SIGKILL to its container, so a named container is killed with docker
+    kill. Without setsid, only the program itself is signalled.
+    """
+
+    def __init__(self, parent=None, container=None, cidfile=None):
+        super().__init__(parent)
+        self.command = []
+        self.container = container
+        self.cidfile = cidfile
+        self._container_id = None
+        self._group = None
+        self._record = None
+        self._kill_timer = timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.timeout.connect(self.kill)
+        self.finished.connect(self._on_finished)
+
+    @property
+    def container_id(self):
+        # docker writes the file, when the container has been created
+        if self._container_id is None and self.cidfile:
+            try:
+                with open(self.cidfile) as f:
+                    self._container_id = f.read().strip() or None
+            except OSError:
+                pass
+        return self._container_id
+
+    def record_to(self, path):
+        """Write the output as a replay fixture to path, when finished"""
+        self._record = (path, QElapsedTimer(), [])
+
+    def run(self):
+        program, *args = self.command
+        if self._record:
+            self._record[1].start()
+        self.start_in_group(program, args)
+
+    def start_in_group(self, program, args):
+        if SETSID:
+            self.start(SETSID, [program] + list(args))
+        else:
+            self.start(program, args)
+
+    def readAllStandardOutput(self):
+        data = super().readAllStandardOutput()
+        if self._record and data:
+            _, clock, chunks = self._record
+            chunks.append((clock.elapsed() / 1000, bytes(data)))
+        return data
+
+    def stop(self, grace_ms):
+        """Terminate the group and kill it after grace_ms, doesn't block"""
+        if self.state() == QProcess.NotRunning or self._kill_timer.isActive():
+            return
+        self.closeWriteChannel()
+        if SETSID:
+            self._group = pid = int(self.processId())
+            signal_group(pid, signal.SIGTERM)
+        else:
+            self.terminate()
+        self._kill_timer.start(grace_ms)
+
+    def kill(self):
+        self._kill_timer.stop()
+        if self.container and self.state() != QProcess.NotRunning:
+            QProcess.startDetached('docker', ['kill', self.container])
+        if self._group:
+            signal_group(self._group, signal.SIGKILL)
+        super().kill()
+
+    def _on_finished(self, code, status):
+        self._kill_timer.stop()
+        if self._group:
+            # children, which ignored SIGTERM
+            signal_group(self._group, signal.SIGKILL)
+            self._group = None
+        if self.cidfile:
+            try:
+                os.remove(self.cidfile)
+            except OSError:
+                pass
+        if self._record and status == QProcess.NormalExit:
+            path, clock, chunks = self._record
+            chunks.append((clock.elapsed() / 1000, bytes(super().readAllStandardOutput())))
+            try:
+                write_fixture(path, chunks, code, clock.elapsed() / 1000)
+            except OSError:
+                pass
+            self._record = None
+
+
+class DockerBackend:
+    """Runs the steps in docker containers.
+
+    With record_dir set, the output of each finished step is written
+    there as a fixture for the ReplayBackend.
+    """
+
+    def __init__(self, record_dir=None):
+        self.record_dir = record_dir
+
+    def create(self, num, step, course_dir, parent=None):
+        container = 'roman-%s' % (uuid.uuid4().hex[:12],)
+        cidfile = os.path.join(tempfile.gettempdir(), container + '.cid')
+        process = StepProcess(parent, container, cidfile)
+        process.setProcessChannelMode(QProcess.MergedChannels)
+        process.setWorkingDirectory(course_dir)
+        process.command = step.arguments(course_dir, container, cidfile)
+        if self.record_dir:
+            process.record_to(os.path.join(self.record_dir, fixture_name(num, step)))
+        return process
+
+
+class ReplayProcess(QObject):
+    """Replays a fixture of a step speed times faster than it was run.
+
+    With speed 0, the timings are ignored and at most PIPE_BYTES of output
+    is given per round of the event loop, like a full pipe would.
+    """
+    PIPE_BYTES = 65536
+
+    readyReadStandardOutput = pyqtSignal()
+    finished = pyqtSignal(int, int) # exit code, exit status
+    errorOccurred = pyqtSignal(int) # error
+
+    def __init__(self, path, speed, parent=None):
+        super().__init__(parent)
+        self.path = path
+        self.speed = speed
+        self.command = ['replay', path]
+        self.container_id = None
+        self._chunks = []
+        self._index = 0
+        self._end = 0.0
+        self._exit_code = 0
+        self._output = bytearray()
+        self._running = False
+        self._error = ""
+        self._clock = QElapsedTimer()
+        self._timer = timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.timeout.connect(self._replay)
+
+    def run(self):
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                data = json.load(f)
+            scale = 1000 / self.speed if self.speed else 0
+            self._chunks = [(t * scale, text.encode('utf-8', 'surrogateescape'))
+                            for t, text in data['chunks']]
+            self._end = data.get('duration', 0.0) * scale
+            self._exit_code = data.get('exit_code', 0)
+        except (OSError, ValueError, KeyError, TypeError) as error:
+            self._error = "Invalid replay fixture %s: %s" % (self.path, error)
+            QTimer.singleShot(0, partial(self.errorOccurred.emit, QProcess.FailedToStart))
+            return
+        self._running = True
+        self._clock.start()
+        self._replay()
+
+    def _replay(self):
+        if not self._running:
+            return
+        now = self._clock.elapsed()
+        chunks = self._chunks
+        index = self._index
+        size = 0
+        while index < len(chunks) and chunks[index][0] <= now:
+            if not self.speed and size >= self.PIPE_BYTES:
+                break
+            self._output += chunks[index][1]
+            size += len(chunks[index][1])
+            index += 1
+        if index > self._index:
+            self._index = index
+            self.readyReadStandardOutput.emit()
+        if index < len(chunks):
+            self._timer.start(max(0, int(chunks[index][0] - now)))
+        elif now < self._end:
+            self._timer.start(max(0, int(self._end - now)))
+        else:
+            self._running = False
+            self.finished.emit(self._exit_code, QProcess.NormalExit)
+
+    def readAllStandardOutput(self):
+        data = bytes(self._output)
+        self._output.clear()
+        return data
+
+    def processId(self):
+        return 0
+
+    def state(self):
+        return QProcess.Running if self._running else QProcess.NotRunning
+
+    def errorString(self):
+        return self._error
+
+    def waitForFinished(self, msecs=30000):
+        return not self._running
+
+    def stop(self, grace_ms):
+        self.kill()
+
+    def kill(self):
+        if self._running:
+            self._running = False
+            self._timer.stop()
+            QTimer.singleShot(0, partial(self.finished.emit, -1, QProcess.CrashExit))
+
+
+class ReplayBackend:
+    """Replays fixtures named by the steps from a directory"""
+    SPEED = 100.0
+
+    def __init__(self, fixture_dir, speed=SPEED):
+        self.fixture_dir = fixture_dir
+        self.speed = speed
+
+    def create(self, num, step, course_dir, parent=None):
+        path = os.path.join(self.fixture_dir, fixture_name(num, step))
+        return ReplayProcess(path, self.speed, parent)
+
+
+def backend_from_settings():
+    """Return the backend selected by the settings build/replay_dir,
+    build/replay_speed and build/record_dir"""
+    settings = QSettings()
+    replay_dir = settings.value('build/replay_dir', '', type=str)
+    if replay_dir:
+        return ReplayBackend(replay_dir,
+                             settings.value('build/replay_speed', ReplayBackend.SPEED, type=float))
+    return DockerBackend(settings.value('build/record_dir', '', type=str) or None)
+
+
+def benchmark(fixture_dir=None, speed=0, lines=20000):
+    """Print how fast the compile page ingests the output of replayed steps.
+
+    Without fixture_dir, four steps of a minute and the given number of
+    Sphinx like lines are generated, two of them running in parallel. With
+    speed 0, the outputs are replayed as fast as the logs read them, so
+    the time is the time of ingesting them. Progress lines are not
+    collapsed, so every line is written to a log.
+    """
+    import sys
+    from time import perf_counter
+    from PyQt5.QtWidgets import QApplication
+    from .pages.compile import CompilePage
+    from .runner import BuildStep
+
+    app = QApplication.instance() or QApplication(sys.argv)
+    with tempfile.TemporaryDirectory() as tmp:
+        steps = [BuildStep.from_row(['replay/step', '', '', '', depends])
+                 for depends in ('', 'none', '1', '2 3')]
+        if fixture_dir is None:
+            fixture_dir = tmp
+            for num, step in enumerate(steps):
+                chunks = []
+                for i in range(lines):
+                    t = 60.0 * i / lines
+                    line = "reading sources... [%3d%%] module%02d/chapter%d\n" % (
+                        100 * i // lines, i % 40, i)
+                    if i % 500 == 0:
+                        line += "/src/module/chapter%d.rst:12: WARNING: Unknown target\n" % (i,)
+                    chunks.append((t, line.encode()))
+                write_fixture(os.path.join(fixture_dir, fixture_name(num, step)), chunks, 0, 60.0)
+
+        page = CompilePage(backend=ReplayBackend(fixture_dir, speed), collapse_progress=False)
+        page.set_steps(steps)
+        page.resize(900, 600)
+        page.show()
+        workers = []
+        running = set()
+        start_log_worker = page.start_log_worker
+        result = {}
+
+        def done():
+            # the logs have all lines, when the workers and the writes are done
+            if 'success' not in result or running:
+                return
+            app.processEvents()
+            for log in page.logs:
+                while getattr(log, '_pending', None):
+                    log.flush()
+            result['time'] = perf_counter() - start
+            app.exit(0)
+
+        def worker_finished(worker):
+            running.discard(worker)
+            done()
+
+        def start_counted(index):
+            worker = start_log_worker(index)
+            workers.append(worker)
+            running.add(worker)
+            worker.finished.connect(partial(worker_finished, worker))
+            return worker
+        page.start_log_worker = start_counted
+
+        def completed(success):
+            result['success'] = success
+            done()
+        page.tabs.process_completed.connect(completed)
+        start = perf_counter()
+        page.tabs.start()
+        app.exec_()
+        elapsed = result['time']
+        received = sum(worker.bytes_read for worker in workers)
+        parsed = sum(worker.lines_parsed for worker in workers)
+        skipped = sum(worker.lines_skipped for worker in workers)
+        shown = sum(log.line_count for log in page.logs)
+        print("replayed %d steps at speed %s in %.2f s (%s)" % (
+            len(steps), speed or "unthrottled", elapsed,
+            "success" if result['success'] else "failure"))
+        print("ingested %.1f MiB, %.1f MiB/s, %d lines, %.0f lines/s, "
+              "%d lines skipped, %d lines in the logs" % (
+                  received / 2**20, received / 2**20 / elapsed, parsed, parsed / elapsed,
+                  skipped, shown))
+
+
+def benchmark_stop(grace_ms=500, children=4):
+    """Print how long stopping takes, when the steps ignore SIGTERM.
+
+    A shell starts children, which all ignore SIGTERM. stop() has to
+    return at once and the whole group has to be gone soon after the
+    grace period.
+    """
+    import sys
+    from time import perf_counter, sleep
+
+    app = QCoreApplication.instance() or QCoreApplication(sys.argv)
+    script = "trap '' TERM; for i in $(seq %d); do sleep 60 & done; wait" % (children,)
+    process = StepProcess()
+    process.start_in_group('sh', ['-c', script])
+    if not process.waitForStarted(2000):
+        print("failed to start: %s" % (process.errorString(),))
+        return False
+    pid = int(process.processId())
+    times = {}
+
+    def stop():
+        start = perf_counter()
+        process.stop(grace_ms)
+        times['stop'] = perf_counter() - start
+        times['start'] = start
+    def finished(*args):
+        times['finished'] = perf_counter() - times['start']
+        app.exit(0)
+    process.finished.connect(finished)
+    QTimer.singleShot(200, stop)
+    QTimer.singleShot(grace_ms + 5000, lambda: app.exit(1))
+    app.exec_()
+
+    group_left = False
+    if SETSID:
+        # killed processes are listed until their parent has reaped them
+        deadline = perf_counter() + 1.0
+        while group_alive(pid) and perf_counter() < deadline:
+            sleep(0.05)
+        group_left = group_alive(pid)
+    ok = 'finished' in times and times['finished'] < (grace_ms + 1000) / 1000 and not group_left
+    print("stop() returned in %.2f ms, finished in %.0f ms with grace %d ms, group %s: %s" % (
+        times['stop'] * 1000, times.get('finished', float('nan')) * 1000, grace_ms,
+        "left" if group_left else "gone", "ok" if ok else "FAILED"))
+    return ok
+
+
+if __name__ == '__main__':
+    import sys
+    if '--bench-stop' in sys.argv:
+        sys.exit(0 if benchmark_stop() else 1)
+    speed = 0
+    for arg in sys.argv[1:]:
+        if arg.startswith('--speed='):
+            speed = float(arg.partition('=')[2])
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    benchmark(*args[:1], speed=speed)
@@ -0,0 +1,416 @@
+"""
+Cache of build step results keyed by a hash of the step inputs.
+
+The key of a step is a hash of the course sources, the step fields and
+the keys of the steps it depends on. Sources are hashed by a TreeHasher,
+which rehashes only changed files. When a step succeeds, the files it
+wrote to the build directory are copied to the cache. A later run with
+the same key restores those files instead of running the step.
+"""
+import hashlib
+import json
+import multiprocessing
+import re
+import os
+import shutil
+import time
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from fnmatch import fnmatchcase
+from tempfile import NamedTemporaryFile
+from threading import Lock
+
+
+BUILD_DIR = '_build'
+CACHE_DIR = os.path.join(BUILD_DIR, 'cache')
+LOGS_DIR = os.path.join(BUILD_DIR, 'logs')
+HASH_BLOCK = 1 << 20
+
+
+def _write_json(path, data):
+    directory = os.path.dirname(path)
+    os.makedirs(directory, exist_ok=True)
+    with NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False) as f:
+        json.dump(data, f)
+    os.replace(f.name, path)
+
+
+def file_digest(path) -> str:
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(HASH_BLOCK), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def scan_sources(course_dir):
+    """Return sorted list of (relative path, (size, mtime, inode)) of sources.
+
+    The build directory and hidden files and directories are skipped.
+    """
+    result = []
+    stack = ['']
+    while stack:
+        rel_dir = stack.pop()
+        try:
+            entries = list(os.scandir(os.path.join(course_dir, rel_dir)))
+        except OSError:
+            continue
+        for entry in entries:
+            name = entry.name
+            if name.startswith('.') or (not rel_dir and name == BUILD_DIR):
+                continue
+            path = os.path.join(rel_dir, name)
+            try:
+                if entry.is_dir():
+                    stack.append(path)
+                elif entry.is_file():
+                    st = entry.stat()
+                    result.append((path, (st.st_size, st.st_mtime_ns, st.st_ino)))
+            except OSError:
+                continue
+    result.sort()
+    return result
+
+
+def input_patterns(text):
+    """Return the glob patterns in a comma or space separated list"""
+    return [w for w in re.split(r'[,\s]+', text.strip()) if w]
+
+
+def matches_inputs(path, patterns) -> bool:
+    """Return True, if the relative path matches a pattern.
+
+    A pattern without a slash is matched against the file name, a pattern
+    ending with a slash matches everything in the directory and no
+    patterns match all paths.
+    """
+    if not patterns:
+        return True
+    path = path.replace(os.sep, '/')
+    name = path.rpartition('/')[2]
+    for pattern in patterns:
+        if pattern.endswith('/'):
+            if path.startswith(pattern):
+                return True
+        elif fnmatchcase(path if '/' in pattern else name, pattern):
+            return True
+    return False
+
+
+def subset_digest(digests, patterns) -> str:
+    """Return hash of the sources in {path: digest}, which match patterns"""
+    tree = hashlib.sha256()
+    for path in sorted(digests):
+        if matches_inputs(path, patterns):
+            tree.update(path.encode('utf-8', 'surrogateescape') + b'\0')
+            tree.update((digests[path] or '').encode() + b'\n')
+    return tree.hexdigest()
+
+
+def _hash_files(paths):
+    """Return digests of the files, None for a file, which can't be read"""
+    result = []
+    for path in paths:
+        try:
+            result.append(file_digest(path))
+        except OSError:
+            result.append(None)
+    return result
+
+
+class TreeHasher:
+    """Digest of the course sources, which rehashes only changed files.
+
+    Digests are kept by path with the size, modification time and inode of
+    the file in <course>/_build/cache/stat.json. When more than
+    POOL_MIN_FILES files have changed, they are hashed in a process pool
+    with a worker per core. Files modified within RACY_NS of the scan are
+    not kept, as a change in the same clock tick would not change the stat.
+    After digest(), digests has the digest of each source by path.
+    """
+    CHUNK_FILES = 256
+    POOL_MIN_FILES = 512
+    RACY_NS = 2 * 10**9
+
+    def __init__(self, course_dir, workers=None):
+        self.course_dir = course_dir
+        self.workers = workers or os.cpu_count() or 1
+        self._path = os.path.join(course_dir, CACHE_DIR, 'stat.json')
+        self._executor = None
+        self.digests = {}
+
+    def _load(self):
+        try:
+            with open(self._path, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _pool(self):
+        if self._executor is None:
+            # the application has threads, so don't fork it
+            self._executor = ProcessPoolExecutor(
+                self.workers, mp_context=multiprocessing.get_context('spawn'))
+        return self._executor
+
+    def _hash_chunks(self, chunks, cancelled):
+        """Yield (chunk, digests) in the order chunks are done"""
+        if len(chunks) > 1 and self.workers > 1 and \
+                sum(map(len, chunks)) > self.POOL_MIN_FILES:
+            pool = self._pool()
+            futures = {pool.submit(_hash_files, chunk): chunk for chunk in chunks}
+            try:
+                for future in as_completed(futures):
+                    if cancelled and cancelled():
+                        return
+                    yield futures[future], future.result()
+            finally:
+                for future in futures:
+                    future.cancel()
+        else:
+            for chunk in chunks:
+                if cancelled and cancelled():
+                    return
+                yield chunk, _hash_files(chunk)
+
+    def digest(self, progress=None, cancelled=None):
+        """Return hash of the paths and contents of the course sources.
+
+        progress(done, total) is called as changed files are hashed and
+        None is returned, as soon as cancelled() returns True.
+        """
+        started = time.time_ns()
+        files = scan_sources(self.course_dir)
+        cached = self._load()
+        digests = {}
+        changed = []
+        for path, stat in files:
+            entry = cached.get(path)
+            if entry is not None and tuple(entry[:3]) == stat:
+                digests[path] = entry[3]
+            else:
+                changed.append(path)
+
+        total = len(changed)
+        if progress:
+            progress(0, total)
+        size = max(1, min(self.CHUNK_FILES, -(-total // self.workers)))
+        join = os.path.join
+        chunks = [[join(self.course_dir, path) for path in changed[i:i + size]]
+                  for i in range(0, total, size)]
+        prefix = len(join(self.course_dir, ''))
+        done = 0
+        for chunk, result in self._hash_chunks(chunks, cancelled):
+            for path, digest in zip(chunk, result):
+                digests[path[prefix:]] = digest
+            done += len(chunk)
+            if progress:
+                progress(done, total)
+        if done < total:
+            return None
+
+        stats = {}
+        racy = started - self.RACY_NS
+        for path, stat in files:
+            digest = digests[path]
+            if digest is not None and stat[1] < racy:
+                stats[path] = list(stat) + [digest]
+        if stats != cached:
+            _write_json(self._path, stats)
+        self.digests = digests
+        return subset_digest(digests, ())
+
+    def close(self):
+        if self._executor is not None:
+            self._executor.shutdown(wait=False)
+            self._executor = None
+
+
+def step_key(step, sources: str, dependency_keys=()) -> str:
+    """Return the cache key of a BuildStep.
+
+    Image is hashed as written, so a moved tag like latest is not noticed.
+    """
+    data = [sources, step.image, step.command, step.mount, step.environment,
+            step.outputs, sorted(dependency_keys)]
+    return hashlib.sha256(json.dumps(data).encode()).hexdigest()
+
+
+class BuildCache:
+    """Step results of a course in <course>/_build/cache.
+
+    index.json maps keys to the outputs of the step: path to digest, size
+    and modification time, and to the paths the step deleted. File
+    contents are kept once by digest in the objects directory. Only
+    MAX_ENTRIES latest keys are kept. Steps may be stored from threads, one
+    at a time, while outputs are restored.
+    """
+    MAX_ENTRIES = 200
+
+    def __init__(self, course_dir):
+        self.course_dir = course_dir
+        self.path = os.path.join(course_dir, CACHE_DIR)
+        self._objects = os.path.join(self.path, 'objects')
+        self._index_path = os.path.join(self.path, 'index.json')
+        self._lock = Lock()
+        try:
+            with open(self._index_path, encoding='utf-8') as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            self._index = {}
+
+    def __contains__(self, key):
+        return key in self._index
+
+    def snapshot(self):
+        """Return {path: (size, mtime)} of files in the build directory"""
+        build_dir = os.path.join(self.course_dir, BUILD_DIR)
+        result = {}
+        for root, dirs, files in os.walk(build_dir):
+            rel_root = os.path.relpath(root, self.course_dir)
+            if rel_root == BUILD_DIR:
+                skip = {os.path.basename(CACHE_DIR), os.path.basename(LOGS_DIR)}
+                dirs[:] = [d for d in dirs if d not in skip]
+            for name in files:
+                path = os.path.join(rel_root, name)
+                try:
+                    st = os.stat(os.path.join(self.course_dir, path))
+                except OSError:
+                    continue
+                result[path] = (st.st_size, st.st_mtime_ns)
+        return result
+
+    def store(self, key, step_name, before, patterns=()) -> dict:
+        """Save files changed since the snapshot before as the outputs of key.
+
+        Files removed since the snapshot are saved as deleted outputs. With
+        patterns, only the paths matching them are outputs of the step. The
+        snapshot after the step is returned.
+        """
+        with self._lock:
+            return self._store(key, step_name, before, patterns)
+
+    def _store(self, key, step_name, before, patterns):
+        after = self.snapshot()
+        outputs = {}
+        for path, stat in after.items():
+            if before.get(path) == stat or not matches_inputs(path, patterns):
+                continue
+            source = os.path.join(self.course_dir, path)
+            digest = file_digest(source)
+            target = os.path.join(self._objects, digest[:2], digest)
+            if not os.path.exists(target):
+                os.makedirs(os.path.dirname(target), exist_ok=True)
+                shutil.copy2(source, target)
+            outputs[path] = [digest, stat[0], stat[1]]
+        deleted = sorted(path for path in before
+                         if path not in after and matches_inputs(path, patterns))
+        self._index.pop(key, None)
+        self._index[key] = {'step': step_name, 'outputs': outputs, 'deleted': deleted}
+        self._prune()
+        self._save()
+        return after
+
+    def restore(self, key, files=None) -> bool:
+        """Restore outputs of key, return False when key is not cached.
+
+        The snapshot files is updated with the restored outputs.
+        """
+        with self._lock:
+            entry = self._index.get(key)
+        if entry is None:
+            return False
+        outputs = entry['outputs']
+        for path, (digest, size, mtime) in outputs.items():
+            target = os.path.join(self.course_dir, path)
+            if files is not None:
+                files[path] = (size, mtime)
+            try:
+                st = os.stat(target)
+                if st.st_size == size and st.st_mtime_ns == mtime:
+                    continue
+            except OSError:
+                pass
+            source = os.path.join(self._objects, digest[:2], digest)
+            if not os.path.exists(source):
+                # the cache is broken, run the step again
+                with self._lock:
+                    self._index.pop(key, None)
+                    self._save()
+                return False
+            os.makedirs(os.path.dirname(target), exist_ok=True)
+            shutil.copy2(source, target)
+            os.utime(target, ns=(mtime, mtime))
+        for path in entry.get('deleted', ()):
+            if files is not None:
+                files.pop(path, None)
+            try:
+                os.remove(os.path.join(self.course_dir, path))
+            except FileNotFoundError:
+                pass
+        return True
+
+    def _prune(self):
+        index = self._index
+        if len(index) <= self.MAX_ENTRIES:
+            return
+        for key in list(index)[:len(index) - self.MAX_ENTRIES]:
+            del index[key]
+        used = {digest for entry in index.values() for digest, _, _ in entry['outputs'].values()}
+        for root, _, files in os.walk(self._objects):
+            for name in files:
+                if name not in used:
+                    os.remove(os.path.join(root, name))
+
+    def _save(self):
+        _write_json(self._index_path, self._index)
+
+
+def benchmark(count=50000, workers=None):
+    """Print times to hash a synthetic tree of count files.
+
+    The tree is hashed cold, again without changes and after touching one
+    percent of the files.
+    """
+    import random
+    from tempfile import TemporaryDirectory
+    from time import perf_counter
+
+    random.seed(1)
+    with TemporaryDirectory() as course_dir:
+        for i in range(count):
+            directory = os.path.join(course_dir, 'module%02d' % (i % 50), 'part%d' % (i % 7))
+            os.makedirs(directory, exist_ok=True)
+            ext = ('rst', 'yaml', 'png')[i % 3]
+            with open(os.path.join(directory, 'file%d.%s' % (i, ext)), 'wb') as f:
+                f.write(os.urandom(random.randrange(200, 8000)))
+        files = [os.path.join(course_dir, path) for path, _ in scan_sources(course_dir)]
+        # files older than the racy limit are cached
+        old = time.time() - 10
+        for path in files:
+            os.utime(path, (old, old))
+
+        def measure(name, hasher):
+            start = perf_counter()
+            digest = hasher.digest()
+            print("%-16s %8.3f s  %s" % (name, perf_counter() - start, digest[:12]))
+
+        hasher = TreeHasher(course_dir, workers)
+        measure("cold", hasher)
+        measure("unchanged", hasher)
+        for path in random.sample(files, count // 100):
+            with open(path, 'ab') as f:
+                f.write(b'edit')
+            os.utime(path, (old + 1, old + 1))
+        measure("1% edited", hasher)
+        hasher.close()
+
+        os.remove(os.path.join(course_dir, CACHE_DIR, 'stat.json'))
+        hasher = TreeHasher(course_dir, 1)
+        measure("cold, 1 process", hasher)
+        hasher.close()
+
+
+if __name__ == '__main__':
+    import sys
+    benchmark(*map(int, sys.argv[1:2]))
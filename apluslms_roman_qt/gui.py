@@ -1,4 +1,5 @@
 #!/usr/bin/env python
+import os
 
 from PyQt5.QtCore import (
     QFile,
@@ -29,6 +30,7 @@ from PyQt5.QtWidgets import (
     QLabel,
     QStackedWidget,
     QLineEdit,
+    QShortcut,
 )
 
 from . import (
@@ -40,6 +42,7 @@ from . import (
 )
 #from .widgets.verticaltabs import VerticalTabsWidget
 from .widgets.fancytabbar import FancyTabWidget
+from .widgets.paintprofile import PaintProfilerPanel
 from .pages import (
     WelcomePage,
     ConfigPage,
@@ -336,18 +339,42 @@ class MainWindow(QMainWindow):
                     "Configure active course")
 
         self.compile_page = compile_page = CompilePage()
-        compile_page.set_tabs(4)
-        tabs.addTab(compile_page,
+        compile_page.set_steps(config_page.steps_tab.get_steps())
+        compile_index = tabs.addTab(compile_page,
                     icon(QStyle.SP_ComputerIcon),
                     "Compile",
                     "Compile and validate active course")
 
+        # take the edited build steps in use, when the page is opened
+        def update_steps(index):
+            if index == compile_index and not compile_page.runner.is_running:
+                steps = config_page.steps_tab.get_steps()
+                if steps != compile_page.steps:
+                    compile_page.set_steps(steps)
+        tabs.currentAboutToShow.connect(update_steps)
+
+        compile_page.statusChanged.connect(self.statusBar().showMessage)
         compile_page.tabs.process_started.connect(lambda: tabs.setTabsEnabled(False))
         compile_page.tabs.process_completed.connect(tabs.setTabsEnabled)
         compile_page.tabs.process_stopped.connect(tabs.setTabsEnabled)
 
         tabs.setBarVisible(False)
-        welcome_page.courseSelected.connect(tabs.setBarVisible)
+
+        def select_course(path):
+            compile_page.set_course_dir(path)
+            self.setWindowTitle(os.path.basename(path))
+            tabs.setBarVisible(True)
+        welcome_page.courseSelected.connect(select_course)
+
+        # paint times of the custom widgets, see widgets.paintprofile
+        self._paint_profile = None
+        QShortcut(QKeySequence("Ctrl+Shift+P"), self, self.show_paint_profile)
+
+    def show_paint_profile(self):
+        if self._paint_profile is None:
+            self._paint_profile = PaintProfilerPanel(self)
+        self._paint_profile.show()
+        self._paint_profile.raise_()
 
 from PyQt5.QtCore import QTimer
 import random
@@ -397,6 +424,10 @@ def main():
     #    log = main.compile_page.add_step(step)
     #    generators.append(TestData(log))
     main.show()
+    if '--asyncio' in sys.argv:
+        # coroutines run in the GUI thread, see qtasyncio
+        from .qtasyncio import run_application
+        sys.exit(run_application(app))
     sys.exit(app.exec_())
 
 if __name__ == '__main__':
@@ -0,0 +1,117 @@
+"""
+Durations of the earlier runs of the build steps.
+
+For each step the history keeps the durations of the last successful
+runs and the times, when the percent markers of Sphinx were printed in
+the latest run. A running step is estimated from its latest marker, so
+the estimate follows a build, which is faster or slower than usual.
+"""
+import json
+import os
+import re
+from tempfile import NamedTemporaryFile
+
+
+# e.g. "reading sources... [ 14%] module01/chapter02"
+PERCENT_RE = re.compile(r'(?P<phase>[a-z][a-z ]*)\.\.\. \[\s*(?P<percent>\d+)%\]')
+
+
+def match_marker(text):
+    """Return the marker of a progress line, e.g. 'reading sources 14', or None"""
+    match = PERCENT_RE.match(text)
+    if match is None:
+        return None
+    return '%s %s' % (match.group('phase'), match.group('percent'))
+
+
+class RunHistory:
+    """Durations and progress markers of steps by a key in a JSON file"""
+    MAX_RUNS = 10
+
+    def __init__(self, path):
+        self.path = path
+        try:
+            with open(path, encoding='utf-8') as f:
+                self._steps = json.load(f)
+        except (OSError, ValueError):
+            self._steps = {}
+
+    def durations(self, key):
+        return self._steps.get(key, {}).get('durations', [])
+
+    def expected(self, key):
+        """Return the median duration of the step or None"""
+        durations = sorted(self.durations(key))
+        if not durations:
+            return None
+        return durations[len(durations) // 2]
+
+    def record(self, key, duration, markers):
+        """Add a successful run with {marker: seconds from the start}"""
+        step = self._steps.setdefault(key, {})
+        durations = step.setdefault('durations', [])
+        durations.append(round(duration, 2))
+        del durations[:-self.MAX_RUNS]
+        if markers:
+            step['markers'] = {marker: round(t, 2) for marker, t in markers.items()}
+            step['markers_duration'] = round(duration, 2)
+
+    def remaining(self, key, elapsed, marker=None):
+        """Return estimated seconds left for a running step or None.
+
+        marker is the latest (marker, seconds from the start) of the run.
+        """
+        step = self._steps.get(key)
+        if step is None:
+            return None
+        if marker is not None:
+            markers = step.get('markers', {})
+            seen = markers.get(marker[0])
+            if seen:
+                # scale the rest of the last run by the speed of this run
+                rest = step['markers_duration'] - seen
+                return max(0.0, rest * marker[1] / seen - (elapsed - marker[1]))
+        expected = self.expected(key)
+        if expected is None:
+            return None
+        return max(0.0, expected - elapsed)
+
+    def save(self):
+        directory = os.path.dirname(self.path)
+        try:
+            os.makedirs(directory, exist_ok=True)
+            with NamedTemporaryFile('w', encoding='utf-8', dir=directory, delete=False) as f:
+                json.dump(self._steps, f)
+            os.replace(f.name, self.path)
+        except OSError:
+            pass
+
+
+def remaining_total(dependencies, remaining):
+    """Return seconds until all steps are done, steps running in parallel.
+
+    remaining has the seconds left for each unfinished step, None when
+    unknown, and dependencies the steps each step waits for. Returns None,
+    if an unfinished step has no estimate.
+    """
+    done_at = {}
+
+    def finish(step):
+        if step not in done_at:
+            done_at[step] = 0.0
+            if step in remaining:
+                own = remaining[step]
+                if own is None:
+                    done_at[step] = None
+                    return None
+                waits = [finish(other) for other in dependencies[step]]
+                if None in waits:
+                    done_at[step] = None
+                    return None
+                done_at[step] = max(waits, default=0.0) + own
+        return done_at[step]
+
+    ends = [finish(step) for step in remaining]
+    if None in ends:
+        return None
+    return max(ends, default=0.0)
@@ -1,8 +1,12 @@
+import os
+import re
+
 from PyQt5.QtCore import (
     Qt,
     pyqtSignal,
 )
 from PyQt5.QtGui import (
+    QKeySequence,
     QStandardItemModel,
     QStandardItem,
 )
@@ -18,8 +22,16 @@ from PyQt5.QtWidgets import (
     QVBoxLayout,
     QPushButton,
     QFrame,
+    QShortcut,
+    QSplitter,
 )
 
+from ..runner import BuildRunner
+from ..watcher import CourseWatcher
+from ..widgets.findbar import FindBar
+from ..widgets.ingest import LogIngestWorker
+from ..widgets.logview import LogView
+from ..widgets.problems import ProblemsPanel
 from ..widgets.processtabs import ProcessTabBar
 from ..widgets.textlog import TextLogWidget
 
@@ -42,14 +54,40 @@ class CompletedPage(QWidget):
 
 
 class CompilePage(QWidget):
-    def __init__(self, parent=None):
+    statusChanged = pyqtSignal(str) # message, empty to clear
+
+    def __init__(self, parent=None, virtual_logs=False, backend=None, collapse_progress=True):
         super().__init__(parent)
+        self.virtual_logs = virtual_logs
+        self.collapse_progress = collapse_progress
+        self.logs = []
+        self.steps = []
+        # steps are run in the course directory and their logs are
+        # written to log_dir, see logstore.run_log_dir
+        self.course_dir = None
+        self.log_dir = None
+        self.watcher = None
 
         self.tabs = tabs = ProcessTabBar()
         self.stack = stack = QStackedWidget()
 
         tabs.tab_selected.connect(stack.setCurrentIndex)
 
+        self.find_bar = find_bar = FindBar()
+        find_bar.hide()
+        find_bar.search_changed.connect(self._search_changed)
+        find_bar.find_requested.connect(self.find)
+        QShortcut(QKeySequence(QKeySequence.Find), self, find_bar.activate)
+
+        # warnings and errors are matched from the lines the logs index
+        self.problems = problems = ProblemsPanel()
+        problems.problem_activated.connect(self.show_problem)
+        splitter = QSplitter(Qt.Horizontal)
+        splitter.addWidget(stack)
+        splitter.addWidget(problems)
+        splitter.setStretchFactor(0, 3)
+        splitter.setStretchFactor(1, 1)
+
         frame = QFrame()
         frame.setAttribute(Qt.WA_MacShowFocusRect, 0)
         frame.setFrameStyle(QFrame.Sunken | QFrame.Panel)
@@ -58,18 +96,150 @@ class CompilePage(QWidget):
         frame_layout.setSpacing(0)
         frame_layout.setContentsMargins(0, 0, 0, 0)
         frame_layout.addWidget(tabs)
-        frame_layout.addWidget(stack)
+        frame_layout.addWidget(splitter)
+        frame_layout.addWidget(find_bar)
         frame.setLayout(frame_layout)
 
+        # rebuild, when the sources change
+        self.watch_button = watch_button = QPushButton("Watch")
+        watch_button.setCheckable(True)
+        watch_button.setToolTip("Build again, when the course sources change")
+        watch_button.toggled.connect(self.set_watching)
+        controls = QHBoxLayout()
+        controls.addStretch(1)
+        controls.addWidget(watch_button)
+
         layout = QVBoxLayout()
+        layout.addLayout(controls)
         layout.addWidget(frame)
         self.setLayout(layout)
 
-    def set_tabs(self, num):
-        self.tabs.set_tab_count(num)
+        self.runner = BuildRunner(self, self, backend)
+
+    def set_steps(self, steps):
+        """Set the BuildSteps, which are run by the runner"""
+        self.steps = list(steps)
+        self.set_tabs(len(self.steps), [step.name for step in self.steps])
+
+    def set_course_dir(self, path):
+        """Set the directory, where the steps are run"""
+        self.course_dir = path
+        self.log_dir = None
+        if self.watch_button.isChecked():
+            self.set_watching(True)
+
+    def set_watching(self, enabled):
+        """Run the changed steps again, when the course sources change.
+
+        Nothing is watched, until the course directory is set.
+        """
+        if self.watcher is not None:
+            self.watcher.close()
+            self.watcher.deleteLater()
+            self.watcher = None
+        if enabled and self.course_dir:
+            self.watcher = watcher = CourseWatcher(self.course_dir, self)
+            watcher.changed.connect(self.runner.rebuild)
+            if watcher.is_polling:
+                self.watch_button.setToolTip("Too many directories to watch, "
+                                             "the sources are scanned every few seconds")
+
+    def set_tabs(self, num, names=None):
+        self.tabs.set_tab_count(num, names)
+        log_class = LogView if self.virtual_logs else TextLogWidget
+        stack = self.stack
+        while stack.count():
+            w = stack.widget(0)
+            stack.removeWidget(w)
+            w.deleteLater()
+        self.logs = []
+        self.problems.clear()
+        self.problems.set_step_names(names or ())
         for i in range(num):
-            w = TextLogWidget()
+            w = log_class(collapse_progress=self.collapse_progress)
             w.setSize(80, 20)
             self.stack.addWidget(w)
+            self.logs.append(w)
+            self.problems.attach(i, w)
             w.write("log %d" % (i,))
         self.stack.addWidget(CompletedPage())
+
+    def log_path(self, index):
+        if self.log_dir is None:
+            return None
+        return os.path.join(self.log_dir, 'step%02d.log' % (index,))
+
+    def start_log_worker(self, index):
+        """Return a started worker, which parses raw output for the step log.
+
+        With log_dir set, the output is written to a file, which the log maps
+        right away and reloads, as the worker flushes it.
+        """
+        log = self.logs[index]
+        path = self.log_path(index)
+        worker = LogIngestWorker(self, path=path)
+        if path:
+            log.open_log(path)
+            worker.follow(log)
+            worker.finished.connect(log.reload)
+        else:
+            worker.attach(log)
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+        return worker
+
+    def show_problem(self, step, line, length):
+        """Show the log line of a problem, the line is known by the panel"""
+        if 0 <= step < len(self.logs):
+            self.tabs.select_tab(step)
+            self.logs[step].show_match(line, 0, length)
+
+    def search(self, pattern, regex=False):
+        """Return list of SearchResults for all step logs.
+
+        Raises re.error on an invalid regex.
+        """
+        return [log.search(pattern, regex=regex) for log in self.logs]
+
+    def _current_log(self):
+        index = self.stack.currentIndex()
+        return index if 0 <= index < len(self.logs) else 0
+
+    def _search_changed(self, text, regex):
+        # start again from the top of the view
+        if self.logs:
+            self.logs[self._current_log()].clearSelection()
+        self.find(text, regex=regex)
+
+    def find(self, text, backward=False, regex=False):
+        """Select the next match in the current step log.
+
+        Continues from the following (or preceding) steps and wraps
+        around, when the current log has no more matches.
+        """
+        if not text or not self.logs:
+            self.find_bar.set_status("")
+            return False
+        try:
+            results = self.search(text, regex=regex)
+        except re.error as error:
+            self.find_bar.set_status("Invalid regex: %s" % (error,))
+            return False
+        total = sum(len(result) for result in results)
+        if not total:
+            self.find_bar.set_status("No matches")
+            return False
+        current = self._current_log()
+        found = self.logs[current].find(text, backward=backward, regex=regex)
+        step = 1 if not backward else -1
+        index = current
+        while not found:
+            index = (index + step) % len(self.logs)
+            result = results[index]
+            if result:
+                self.tabs.select_tab(index)
+                self.logs[index].show_match(*result[-1 if backward else 0])
+                found = True
+        self.find_bar.set_status("%d in this step, %d in all steps" % (
+            len(results[index]), total))
+        return True
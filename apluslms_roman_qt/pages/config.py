@@ -20,6 +20,7 @@ from PyQt5.QtWidgets import (
     QTabWidget,
 )
 
+from ..runner import BuildStep
 from ..widgets.editablesteps import EditableStepsWidget
 
 
@@ -137,6 +138,9 @@ class StepItem:
         COMMAND = 1
         MOUNT = 2
         ENVIRONMENT = 3
+        DEPENDS = 4
+        INPUTS = 5
+        OUTPUTS = 6
 
     @classmethod
     def new_row(cls, image):
@@ -148,7 +152,7 @@ class StepItem:
 class StepsTab(QWidget):
     def __init__(self, parent=None):
         super().__init__(parent)
-        self.model = model = QStandardItemModel(0, 4, self)
+        self.model = model = QStandardItemModel(0, len(StepItem.Cols), self)
         self.step_map = {}
         self._create_steps_list()
         self._create_form_groupbox()
@@ -188,6 +192,27 @@ class StepsTab(QWidget):
         environmentEdit = QLineEdit()
         environmentLabel.setBuddy(environmentEdit)
 
+        dependsLabel = QLabel("Depends on:")
+        dependsEdit = QLineEdit()
+        dependsEdit.setPlaceholderText("previous step")
+        dependsEdit.setToolTip("Images or numbers of the steps to wait for, "
+                               "'none' to start with the build")
+        dependsLabel.setBuddy(dependsEdit)
+
+        inputsLabel = QLabel("Inputs:")
+        inputsEdit = QLineEdit()
+        inputsEdit.setPlaceholderText("all sources")
+        inputsEdit.setToolTip("Glob patterns of the sources the step reads, e.g. '*.rst images/'. "
+                              "Changes to other files don't run the step again")
+        inputsLabel.setBuddy(inputsEdit)
+
+        outputsLabel = QLabel("Outputs:")
+        outputsEdit = QLineEdit()
+        outputsEdit.setPlaceholderText("not known")
+        outputsEdit.setToolTip("Glob patterns of the files the step writes, e.g. '_build/html/'. "
+                               "Needed to cache the step, when it runs with other steps")
+        outputsLabel.setBuddy(outputsEdit)
+
         self.mapper = mapper = QDataWidgetMapper(self)
         mapper.setSubmitPolicy(QDataWidgetMapper.AutoSubmit)
         mapper.setModel(self.model)
@@ -195,6 +220,9 @@ class StepsTab(QWidget):
         mapper.addMapping(commandEdit, StepItem.Cols.COMMAND.value)
         mapper.addMapping(mountEdit, StepItem.Cols.MOUNT.value)
         mapper.addMapping(environmentEdit, StepItem.Cols.ENVIRONMENT.value)
+        mapper.addMapping(dependsEdit, StepItem.Cols.DEPENDS.value)
+        mapper.addMapping(inputsEdit, StepItem.Cols.INPUTS.value)
+        mapper.addMapping(outputsEdit, StepItem.Cols.OUTPUTS.value)
 
         self.groupbox = config = QGroupBox("Edit step parameters")
         config.setCheckable(True)
@@ -208,6 +236,12 @@ class StepsTab(QWidget):
         config_layout.addWidget(mountEdit, 2, 1)
         config_layout.addWidget(environmentLabel, 3, 0)
         config_layout.addWidget(environmentEdit, 3, 1)
+        config_layout.addWidget(dependsLabel, 4, 0)
+        config_layout.addWidget(dependsEdit, 4, 1)
+        config_layout.addWidget(inputsLabel, 5, 0)
+        config_layout.addWidget(inputsEdit, 5, 1)
+        config_layout.addWidget(outputsLabel, 6, 0)
+        config_layout.addWidget(outputsEdit, 6, 1)
         config.setLayout(config_layout)
 
         self.all_fields = [
@@ -215,6 +249,9 @@ class StepsTab(QWidget):
             commandEdit,
             mountEdit,
             environmentEdit,
+            dependsEdit,
+            inputsEdit,
+            outputsEdit,
         ]
 
     def set_config(self, config):
@@ -233,6 +270,10 @@ class StepsTab(QWidget):
 
         return data
 
+    def get_steps(self):
+        """Return BuildSteps in the order of the steps list"""
+        return [BuildStep.from_row(row) for row in self.get_data()]
+
     def _on_step_select(self, id_):
         print("step selected", repr(id_))
         if id_ >= 0:
@@ -264,7 +305,8 @@ class ConfigPage(QWidget):
         tabs = QTabWidget()
         tabs.addTab(GeneralTab(), "Generic")
         tabs.addTab(ServicesTab(), "Services")
-        tabs.addTab(StepsTab(), "Build steps")
+        self.steps_tab = StepsTab()
+        tabs.addTab(self.steps_tab, "Build steps")
 
         layout = QVBoxLayout()
         layout.addWidget(tabs)
@@ -5,14 +5,23 @@ from PyQt5.QtWidgets import*
 
 
 class WelcomePage(QWidget):
-    courseSelected = pyqtSignal()
+    courseSelected = pyqtSignal(str) # course directory
 
     def __init__(self, parent=None):
         super().__init__(parent)
         layout = QVBoxLayout()
         layout.addWidget(QLabel("Welcome to roman!"))
         open = QPushButton("open")
-        open.clicked.connect(self.courseSelected)
+        open.clicked.connect(self.select_course)
         layout.addWidget(open)
         layout.addWidget(QLabel("Select console frome left"))
         self.setLayout(layout)
+
+    def select_course(self):
+        """Ask for the course directory, the last one is remembered"""
+        settings = QSettings()
+        path = QFileDialog.getExistingDirectory(
+            self, "Open course", settings.value('course/directory', '', type=str))
+        if path:
+            settings.setValue('course/directory', path)
+            self.courseSelected.emit(path)
@@ -0,0 +1,241 @@
+"""
+Asyncio event loop running on the Qt event loop.
+
+QtEventLoop is a selector event loop, which never blocks in select.
+Registered file descriptors get QSocketNotifiers and the loop iterates,
+when a notifier fires, a callback is scheduled or the next timer is due.
+Between the iterations Qt handles its events as usual, so coroutines and
+widgets share the GUI thread without polling.
+
+The application has to be created before the loop. Child processes need
+the selector loop of Unix.
+"""
+import asyncio
+import selectors
+import sys
+import threading
+from math import ceil
+
+from PyQt5.QtCore import (
+    QCoreApplication,
+    QSocketNotifier,
+    QTimer,
+)
+
+
+class _NotifierSelector(selectors.BaseSelector):
+    """Selector, which wakes the loop with QSocketNotifiers.
+
+    select() only polls the underlying selector, waiting is left to Qt.
+    """
+
+    def __init__(self, wakeup):
+        self._selector = selectors.DefaultSelector()
+        self._notifiers = {}
+        self._wakeup = wakeup
+
+    def register(self, fileobj, events, data=None):
+        key = self._selector.register(fileobj, events, data)
+        notifiers = []
+        for event, kind in ((selectors.EVENT_READ, QSocketNotifier.Read),
+                            (selectors.EVENT_WRITE, QSocketNotifier.Write)):
+            if events & event:
+                notifier = QSocketNotifier(key.fd, kind)
+                notifier.activated.connect(self._wakeup)
+                notifiers.append(notifier)
+        self._notifiers[key.fd] = notifiers
+        return key
+
+    def unregister(self, fileobj):
+        key = self._selector.unregister(fileobj)
+        for notifier in self._notifiers.pop(key.fd, ()):
+            notifier.setEnabled(False)
+            notifier.deleteLater()
+        return key
+
+    def select(self, timeout=None):
+        return self._selector.select(0)
+
+    def get_map(self):
+        return self._selector.get_map()
+
+    def close(self):
+        for notifiers in self._notifiers.values():
+            for notifier in notifiers:
+                notifier.setEnabled(False)
+                notifier.deleteLater()
+        self._notifiers.clear()
+        self._selector.close()
+
+
+class QtEventLoop(asyncio.SelectorEventLoop):
+    """Asyncio event loop, which runs in the event loop of the application.
+
+    run_forever() runs the application until stop() is called or the
+    application quits, e.g. when the last window is closed.
+    """
+
+    def __init__(self, app=None):
+        self._app = app or QCoreApplication.instance()
+        self._timer = timer = QTimer()
+        timer.setSingleShot(True)
+        timer.timeout.connect(self._iterate)
+        super().__init__(_NotifierSelector(self._wake))
+
+    def _wake(self, *args):
+        # iterate as soon as Qt returns to the event loop
+        if self.is_running():
+            self._timer.start(0)
+
+    def call_soon(self, callback, *args, **kwargs):
+        handle = super().call_soon(callback, *args, **kwargs)
+        self._wake()
+        return handle
+
+    def call_at(self, when, callback, *args, **kwargs):
+        handle = super().call_at(when, callback, *args, **kwargs)
+        self._wake()
+        return handle
+
+    def stop(self):
+        super().stop()
+        self._wake()
+
+    def _iterate(self):
+        if not self.is_running():
+            return
+        self._run_once()
+        if self._stopping:
+            self._app.exit(0)
+        elif self._ready:
+            self._timer.start(0)
+        elif self._scheduled:
+            delay = self._scheduled[0].when() - self.time()
+            self._timer.start(max(0, ceil(delay * 1000)))
+
+    def run_forever(self):
+        if self.is_running():
+            raise RuntimeError('This event loop is already running')
+        if self.is_closed():
+            raise RuntimeError('Event loop is closed')
+        old_hooks = sys.get_asyncgen_hooks()
+        sys.set_asyncgen_hooks(firstiter=self._asyncgen_firstiter_hook,
+                               finalizer=self._asyncgen_finalizer_hook)
+        self._thread_id = threading.get_ident()
+        asyncio.events._set_running_loop(self)
+        try:
+            self._timer.start(0)
+            self._app.exec_()
+        finally:
+            self._stopping = False
+            self._timer.stop()
+            self._thread_id = None
+            asyncio.events._set_running_loop(None)
+            sys.set_asyncgen_hooks(*old_hooks)
+
+    def close(self):
+        self._timer.stop()
+        super().close()
+
+
+def run_application(app) -> int:
+    """Run the application with a QtEventLoop as the asyncio event loop"""
+    loop = QtEventLoop(app)
+    asyncio.set_event_loop(loop)
+    try:
+        loop.run_forever()
+    finally:
+        loop.close()
+        asyncio.set_event_loop(None)
+    return 0
+
+
+def benchmark(messages=2000):
+    """Print latency from a socket write to the handler in the GUI thread.
+
+    QtEventLoop reads the socket in a coroutine. The thread mode reads it
+    in a thread, which sends the data to the GUI thread with a queued
+    signal, like the log ingest worker.
+    """
+    import socket
+    from time import perf_counter, sleep
+    from PyQt5.QtCore import QThread, pyqtSignal
+    from PyQt5.QtWidgets import QApplication
+
+    app = QApplication.instance() or QApplication(sys.argv)
+
+    def writer(sock):
+        for _ in range(messages):
+            sock.sendall(b'%.9f\n' % (perf_counter(),))
+            sleep(0.0005)
+        sock.sendall(b'end\n')
+
+    def report(name, latencies):
+        latencies.sort()
+        print("%-10s mean %.1f us, p50 %.1f us, p95 %.1f us, p99 %.1f us" % (
+            name,
+            sum(latencies) / len(latencies) * 1e6,
+            latencies[len(latencies) // 2] * 1e6,
+            latencies[int(len(latencies) * 0.95)] * 1e6,
+            latencies[int(len(latencies) * 0.99)] * 1e6,
+        ))
+
+    # asyncio on Qt
+    latencies = []
+    async def read(sock):
+        reader, _ = await asyncio.open_connection(sock=sock)
+        while True:
+            line = await reader.readline()
+            if line == b'end\n' or not line:
+                break
+            latencies.append(perf_counter() - float(line))
+        asyncio.get_event_loop().stop()
+    a, b = socket.socketpair()
+    loop = QtEventLoop(app)
+    asyncio.set_event_loop(loop)
+    loop.create_task(read(a))
+    thread = threading.Thread(target=writer, args=(b,))
+    thread.start()
+    loop.run_forever()
+    thread.join()
+    loop.close()
+    asyncio.set_event_loop(None)
+    b.close()
+    report("asyncio", latencies)
+
+    # reader thread and a queued signal
+    class Reader(QThread):
+        line_read = pyqtSignal(bytes)
+
+        def __init__(self, sock):
+            super().__init__()
+            self.sock = sock
+
+        def run(self):
+            for line in self.sock.makefile('rb'):
+                self.line_read.emit(line)
+                if line == b'end\n':
+                    break
+
+    latencies = []
+    def received(line):
+        if line == b'end\n':
+            app.exit(0)
+        else:
+            latencies.append(perf_counter() - float(line))
+    a, b = socket.socketpair()
+    reader = Reader(a)
+    reader.line_read.connect(received)
+    reader.start()
+    thread = threading.Thread(target=writer, args=(b,))
+    thread.start()
+    app.exec_()
+    thread.join()
+    reader.wait()
+    a.close()
+    b.close()
+    report("thread", latencies)
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -0,0 +1,186 @@
+"""
+Resource usage of the build steps sampled from /proc.
+
+A step is the process tree of its command. The processes of a docker
+container are not children of the docker client, so they are found by
+the container id in /proc/<pid>/cgroup. Processes, which start and exit
+between two samples, are not seen.
+"""
+import os
+from collections import deque
+
+
+PROC = '/proc'
+CLK_TCK = os.sysconf('SC_CLK_TCK') if hasattr(os, 'sysconf') else 100
+PAGE_SIZE = os.sysconf('SC_PAGE_SIZE') if hasattr(os, 'sysconf') else 4096
+
+
+def proc_available() -> bool:
+    return os.path.isfile(os.path.join(PROC, 'self', 'stat'))
+
+
+def read_stat(pid):
+    """Return (parent pid, cpu seconds, rss bytes) of the process or None"""
+    try:
+        with open(os.path.join(PROC, str(pid), 'stat'), 'rb') as f:
+            data = f.read()
+    except OSError:
+        return None
+    # the command in parentheses may contain spaces
+    fields = data[data.rfind(b')') + 2:].split()
+    if fields[0] == b'Z':
+        return None
+    return (int(fields[1]),
+            (int(fields[11]) + int(fields[12])) / CLK_TCK,
+            int(fields[21]) * PAGE_SIZE)
+
+
+def read_io(pid):
+    """Return (read bytes, written bytes) of the process, zeros if unknown"""
+    read = written = 0
+    try:
+        with open(os.path.join(PROC, str(pid), 'io'), 'rb') as f:
+            for line in f:
+                if line.startswith(b'read_bytes:'):
+                    read = int(line.split()[1])
+                elif line.startswith(b'write_bytes:'):
+                    written = int(line.split()[1])
+    except (OSError, ValueError):
+        pass
+    return read, written
+
+
+def all_pids():
+    try:
+        return [int(name) for name in os.listdir(PROC) if name.isdigit()]
+    except OSError:
+        return []
+
+
+def group_pids(pgid):
+    """Return pids of the process group, which have not exited"""
+    result = []
+    for pid in all_pids():
+        try:
+            with open(os.path.join(PROC, str(pid), 'stat'), 'rb') as f:
+                data = f.read()
+        except OSError:
+            continue
+        fields = data[data.rfind(b')') + 2:].split()
+        # zombies are gone, but not yet reaped by their parent
+        if fields[0] != b'Z' and int(fields[2]) == pgid:
+            result.append(pid)
+    return result
+
+
+def container_pids(container_id, pids=None):
+    """Return pids, which are in the cgroup of the docker container"""
+    id_ = container_id.encode()
+    result = []
+    for pid in all_pids() if pids is None else pids:
+        try:
+            with open(os.path.join(PROC, str(pid), 'cgroup'), 'rb') as f:
+                if id_ in f.read():
+                    result.append(pid)
+        except OSError:
+            continue
+    return result
+
+
+class StepUsage:
+    """Usage of a step: cpu seconds, current and peak rss and i/o bytes.
+
+    Cpu and i/o of exited processes are kept as they were last seen.
+    samples has the cpu use of the latest samples, 1.0 for a full core.
+    """
+    SAMPLES = 60
+
+    def __init__(self):
+        self.cpu = 0.0
+        self.rss = 0
+        self.peak_rss = 0
+        self.read_bytes = 0
+        self.write_bytes = 0
+        self.samples = deque(maxlen=self.SAMPLES)
+        self._processes = {}
+
+    def update(self, processes, interval):
+        """Add a sample of {pid: (cpu, rss, read, written)}"""
+        seen = self._processes
+        seen.update(processes)
+        cpu = sum(p[0] for p in seen.values())
+        if interval > 0:
+            self.samples.append(max(0.0, cpu - self.cpu) / interval)
+        self.cpu = cpu
+        self.rss = sum(p[1] for p in processes.values())
+        self.peak_rss = max(self.peak_rss, self.rss)
+        self.read_bytes = sum(p[2] for p in seen.values())
+        self.write_bytes = sum(p[3] for p in seen.values())
+
+    def to_dict(self):
+        return {
+            'cpu': round(self.cpu, 2),
+            'peak_rss': self.peak_rss,
+            'read_bytes': self.read_bytes,
+            'write_bytes': self.write_bytes,
+            'samples': [round(s, 3) for s in self.samples],
+        }
+
+    def summary(self):
+        return "CPU %.1f s, peak RSS %s, read %s, written %s" % (
+            self.cpu, format_bytes(self.peak_rss),
+            format_bytes(self.read_bytes), format_bytes(self.write_bytes))
+
+
+def format_bytes(value):
+    for unit in ('B', 'KiB', 'MiB', 'GiB'):
+        if value < 1024 or unit == 'GiB':
+            return ("%d %s" if unit == 'B' else "%.1f %s") % (value, unit)
+        value /= 1024
+
+
+class ResourceSampler:
+    """Samples the process trees of steps from /proc.
+
+    sample() takes {step: (root pids, container id)} and updates usage,
+    which maps steps to StepUsages. /proc is read once per sample for all
+    steps.
+    """
+
+    def __init__(self):
+        self.usage = {}
+        self._containers = {}
+
+    def sample(self, roots, interval):
+        pids = all_pids()
+        stats = {}
+        children = {}
+        for pid in pids:
+            stat = read_stat(pid)
+            if stat is not None:
+                stats[pid] = stat
+                children.setdefault(stat[0], []).append(pid)
+        for step, (step_roots, container) in roots.items():
+            step_roots = list(step_roots)
+            if container:
+                # processes in a container don't change their cgroup
+                known = self._containers.get(container)
+                if not known or not any(pid in stats for pid in known):
+                    known = self._containers[container] = container_pids(container, stats)
+                step_roots.extend(known)
+            tree = set()
+            pending = [pid for pid in step_roots if pid in stats]
+            while pending:
+                pid = pending.pop()
+                if pid not in tree:
+                    tree.add(pid)
+                    pending.extend(children.get(pid, ()))
+            processes = {pid: stats[pid][1:] + read_io(pid) for pid in tree}
+            usage = self.usage.get(step)
+            if usage is None:
+                usage = self.usage[step] = StepUsage()
+            usage.update(processes, interval)
+
+    def reset(self):
+        self.usage.clear()
+        self._containers.clear()
@@ -0,0 +1,544 @@
+"""
+Runs the build steps of a course as child processes.
+
+The steps are driven by the signals of the ProcessTabBar on the
+CompilePage: starting the process starts the steps without dependencies,
+a successful step starts the steps waiting for it and stopping the
+process terminates the running steps with their children. Steps are
+run by a backend, see backends. Output is read without blocking and
+parsed by a LogIngestWorker. Steps found in the BuildCache are not
+run, their outputs are restored instead.
+"""
+import hashlib
+import json
+import os
+import shlex
+from collections import namedtuple
+from functools import partial
+from time import perf_counter
+
+from PyQt5.QtCore import (
+    QCoreApplication,
+    QDeadlineTimer,
+    QObject,
+    QProcess,
+    QSettings,
+    QStandardPaths,
+    QThread,
+    QTimer,
+    pyqtSignal,
+)
+
+from .backends import backend_from_settings
+from .buildcache import (
+    BuildCache,
+    TreeHasher,
+    input_patterns,
+    matches_inputs,
+    step_key,
+    subset_digest,
+)
+from .history import RunHistory, match_marker, remaining_total
+from .resources import ResourceSampler, proc_available
+from .scheduler import StepScheduler, step_dependencies
+from .widgets.logstore import run_log_dir
+
+
+class BuildStep(namedtuple('BuildStep', 'image command mount environment depends inputs outputs')):
+    """Build step as configured on the Build steps tab"""
+    DEFAULT_MOUNT = '/compile'
+
+    @classmethod
+    def from_row(cls, row):
+        """Return step for a row of the field values in the order of _fields"""
+        row = [value or '' for value in row] + [''] * (len(cls._fields) - len(row))
+        return cls(*row[:len(cls._fields)])
+
+    @property
+    def name(self):
+        return self.image
+
+    @property
+    def input_patterns(self):
+        """Glob patterns of the sources the step reads, empty for all"""
+        return input_patterns(self.inputs)
+
+    @property
+    def output_patterns(self):
+        """Glob patterns of the files the step writes, empty when not known"""
+        return input_patterns(self.outputs)
+
+    def arguments(self, course_dir, container=None, cidfile=None):
+        """Return the command line, which runs the step in a container"""
+        mount = self.mount or self.DEFAULT_MOUNT
+        args = ['docker', 'run', '--rm', '-v', '%s:%s' % (course_dir, mount), '-w', mount]
+        if container:
+            args.extend(('--name', container))
+        if cidfile:
+            args.extend(('--cidfile', cidfile))
+        for variable in shlex.split(self.environment):
+            args.extend(('-e', variable))
+        args.append(self.image)
+        args.extend(shlex.split(self.command))
+        return args
+
+
+def history_path(course_dir):
+    """Return path of the run history of the course in the application data"""
+    name = hashlib.sha1(os.path.abspath(course_dir).encode()).hexdigest()[:16]
+    base = QStandardPaths.writableLocation(QStandardPaths.AppDataLocation)
+    return os.path.join(base, 'history', name + '.json')
+
+
+class SourceHashWorker(QThread):
+    """Computes the source digest of a TreeHasher in a thread.
+
+    With a cache, a snapshot of the build directory is taken too and kept
+    in files.
+    """
+    progress = pyqtSignal(int, int) # hashed files, changed files
+    hashed = pyqtSignal(str) # digest
+    failed = pyqtSignal(str) # error message
+
+    def __init__(self, hasher, parent=None, cache=None):
+        super().__init__(parent)
+        self.hasher = hasher
+        self.cache = cache
+        self.files = None
+
+    def run(self):
+        try:
+            digest = self.hasher.digest(self.progress.emit, self.isInterruptionRequested)
+            if digest is not None and self.cache is not None:
+                self.files = self.cache.snapshot()
+        except OSError as error:
+            self.failed.emit(str(error))
+            return
+        if digest is not None:
+            self.hashed.emit(digest)
+
+
+class CacheStoreWorker(QThread):
+    """Stores the outputs of a step in a BuildCache in a thread"""
+    stored = pyqtSignal(dict) # files in the build directory after the step
+    failed = pyqtSignal(str) # error message
+
+    def __init__(self, cache, key, step_name, before, patterns=(), parent=None):
+        super().__init__(parent)
+        self.cache = cache
+        self.key = key
+        self.step_name = step_name
+        self.before = before
+        self.patterns = patterns
+
+    def run(self):
+        try:
+            files = self.cache.store(self.key, self.step_name, self.before, self.patterns)
+        except OSError as error:
+            self.failed.emit(str(error))
+            return
+        self.stored.emit(files)
+
+
+class BuildRunner(QObject):
+    """Runs the steps of a CompilePage in the order of their dependencies.
+
+    At most max_workers steps run at the same time, the limit is read from
+    the setting build/max_workers. Exit code zero completes the step with
+    success, anything else or a process, which fails to start, with
+    failure. Steps depending on a failed step are not run and the process
+    completes, when no step is running.
+
+    When the course directory is known, a step is run only if its cache
+    key is not found in the BuildCache, and the outputs of a successful
+    step are stored there by a CacheStoreWorker. The outputs are the files
+    the step changed or deleted in the build directory, which match its
+    output patterns. A step without output patterns is stored only, when
+    no other step ran or was restored at the same time, as the changes of
+    the build directory can't be told apart otherwise. The sources are
+    hashed in a SourceHashWorker before any step is started.
+
+    Resource use of the running steps is sampled every SAMPLE_MS from
+    /proc, shown on the tabs and written to resources.json in the log
+    directory of the run. Durations of successful steps are kept in a
+    RunHistory, which gives the estimates shown on the tabs.
+    """
+    KILL_TIMEOUT = 5000
+    SHUTDOWN_TIMEOUT = 2000
+    SAMPLE_MS = 1000
+    ETA_MS = 500
+    MAX_WORKERS = 2
+
+    def __init__(self, page, parent=None, backend=None):
+        super().__init__(parent)
+        self.page = page
+        self.backend = backend or backend_from_settings()
+        self.max_workers = QSettings().value('build/max_workers', self.MAX_WORKERS, type=int)
+        self._scheduler = None
+        self._processes = {}
+        self._stopping = False
+        self._cache = None
+        self._sources = None
+        self._hasher = None
+        self._hash_worker = None
+        self._store_workers = {}
+        self._build_files = None
+        self._overlapped = set()
+        self._hash_percent = 0
+        self._dependencies = []
+        self._restart = False
+        self._keys = {}
+        self._snapshots = {}
+        self._sampler = ResourceSampler()
+        self._sample_timer = timer = QTimer(self)
+        timer.setInterval(self.SAMPLE_MS)
+        timer.timeout.connect(self._sample)
+        self._sampled = 0.0
+        self._history = None
+        self._started = {}
+        self._markers = {}
+        self._last_marker = {}
+        self._line_slots = {}
+        self._eta_timer = timer = QTimer(self)
+        timer.setInterval(self.ETA_MS)
+        timer.timeout.connect(self._update_eta)
+
+        tabs = page.tabs
+        tabs.process_started.connect(self._on_process_started)
+        tabs.process_stopped.connect(self._on_process_stopped)
+        tabs.step_started.connect(self._on_step_started)
+        tabs.step_completed.connect(self._on_step_completed)
+        tabs.process_completed.connect(self._on_process_completed)
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.shutdown)
+
+    @property
+    def is_running(self):
+        return bool(self._processes)
+
+    def rebuild(self, paths):
+        """Build again, if a step reads one of the changed source paths.
+
+        A running build is stopped first. Steps, which don't read the
+        changed paths, are restored from the cache.
+        """
+        steps = self.page.steps
+        if not any(matches_inputs(path, step.input_patterns)
+                   for step in steps for path in paths):
+            return
+        tabs = self.page.tabs
+        self._restart = True
+        if tabs.is_running:
+            tabs.stop()
+        self._restart_when_stopped()
+
+    def _restart_when_stopped(self):
+        # the old processes have to finish before the steps run again
+        if self._restart and not self._processes and not self._store_workers:
+            self._restart = False
+            QTimer.singleShot(0, self.page.tabs.start)
+
+    def _on_process_started(self):
+        page = self.page
+        self._stopping = False
+        if page.course_dir:
+            page.log_dir = run_log_dir(page.course_dir)
+        self._keys.clear()
+        self._snapshots.clear()
+        self._build_files = None
+        self._overlapped.clear()
+        self._sampler.reset()
+        self._history = RunHistory(history_path(page.course_dir or os.getcwd()))
+        self._started.clear()
+        self._markers.clear()
+        self._last_marker.clear()
+        self._eta_timer.start()
+        try:
+            dependencies = step_dependencies(page.steps)
+            self._scheduler = StepScheduler(dependencies, self.max_workers)
+        except ValueError as error:
+            if page.logs:
+                page.logs[0].write(str(error), page.logs[0].PALETTE.RED)
+            self._scheduler = None
+            page.tabs.complete()
+            return
+        self._dependencies = dependencies
+        self._cache = self._sources = None
+        if not page.course_dir:
+            self._start(self._scheduler.start())
+            return
+        if self._hasher is None or self._hasher.course_dir != page.course_dir:
+            if self._hasher is not None:
+                self._hasher.close()
+            self._hasher = TreeHasher(page.course_dir)
+        self._cache = BuildCache(page.course_dir)
+        self._hash_percent = -1
+        self._hash_worker = worker = SourceHashWorker(self._hasher, self, self._cache)
+        worker.progress.connect(self._on_hash_progress)
+        worker.hashed.connect(partial(self._on_hashed, worker))
+        worker.failed.connect(partial(self._on_hash_failed, worker))
+        worker.finished.connect(worker.deleteLater)
+        worker.start()
+
+    def _on_hash_progress(self, done, total):
+        percent = 100 * done // total if total else 100
+        if percent >= self._hash_percent + 10 or done == total:
+            self._hash_percent = percent
+            self.page.statusChanged.emit("Hashing sources: %d of %d changed files" % (done, total))
+
+    def _on_hashed(self, worker, digest):
+        if worker is not self._hash_worker:
+            return
+        self._hash_worker = None
+        self._sources = digest
+        self._build_files = worker.files
+        self.page.statusChanged.emit("")
+        self._start(self._scheduler.start())
+
+    def _on_hash_failed(self, worker, error):
+        if worker is not self._hash_worker:
+            return
+        self._hash_worker = None
+        self._cache = None
+        self.page.statusChanged.emit(
+            "Failed to hash sources, not using the build cache: %s" % (error,))
+        self._start(self._scheduler.start())
+
+    def _start(self, steps):
+        scheduler = self._scheduler
+        tabs = self.page.tabs
+        for num in steps:
+            if self._restore(num):
+                tabs.complete_step(num, True)
+            else:
+                tabs.start_step(num)
+        # a step, which fails to start, may have completed the process
+        if self._scheduler is scheduler and scheduler.is_finished:
+            self._scheduler = None
+            tabs.complete()
+
+    def _restore(self, num):
+        """Return True, if outputs of the step were restored from the cache"""
+        if self._cache is None:
+            return False
+        step = self.page.steps[num]
+        patterns = step.input_patterns
+        sources = subset_digest(self._hasher.digests, patterns) if patterns else self._sources
+        key = step_key(step, sources, (self._keys[other] for other in self._dependencies[num]))
+        self._keys[num] = key
+        try:
+            if not self._cache.restore(key, self._build_files):
+                return False
+        except OSError:
+            return False
+        # the restored files are in the changes of the running steps
+        self._overlapped.update(self._processes)
+        log = self.page.logs[num]
+        log.write("Up to date, outputs restored from the build cache", log.PALETTE.BLUE)
+        return True
+
+    def _on_step_started(self, num):
+        page = self.page
+        step = page.steps[num]
+        if self._cache is not None:
+            self._snapshots[num] = dict(self._build_files)
+        if self._processes:
+            self._overlapped.update(self._processes)
+            self._overlapped.add(num)
+        worker = page.start_log_worker(num)
+        self._started[num] = perf_counter()
+        self._markers[num] = {}
+        self._line_slots[num] = slot = partial(self._on_lines, num)
+        page.logs[num].lines_indexed.connect(slot)
+        process = self.backend.create(num, step, page.course_dir or os.getcwd(), self)
+        process.readyReadStandardOutput.connect(partial(self._read, process, worker))
+        process.finished.connect(partial(self._on_finished, num))
+        process.errorOccurred.connect(partial(self._on_error, num))
+        self._processes[num] = (process, worker)
+        worker.feed(("$ %s\n" % (' '.join(map(shlex.quote, process.command)),)).encode())
+        process.run()
+        if proc_available() and not self._sample_timer.isActive():
+            self._sampled = perf_counter()
+            self._sample_timer.start()
+
+    def _sample(self):
+        if not self._processes:
+            self._sample_timer.stop()
+            return
+        roots = {}
+        for num, (process, _) in self._processes.items():
+            pid = int(process.processId())
+            roots[num] = ([pid] if pid else [], process.container_id)
+        now = perf_counter()
+        self._sampler.sample(roots, now - self._sampled)
+        self._sampled = now
+        tabs = self.page.tabs
+        for num in roots:
+            usage = self._sampler.usage[num]
+            tabs.set_step_usage(num, usage.samples, usage.summary())
+
+    def _on_lines(self, num, start, texts):
+        # times of the Sphinx progress markers
+        markers = self._markers[num]
+        for text in texts:
+            marker = match_marker(text)
+            if marker is not None and marker not in markers:
+                markers[marker] = elapsed = perf_counter() - self._started[num]
+                self._last_marker[num] = (marker, elapsed)
+
+    def _history_key(self, num):
+        step = self.page.steps[num]
+        return '%s %s' % (step.image, step.command)
+
+    def _update_eta(self):
+        scheduler = self._scheduler
+        if scheduler is None or self._history is None:
+            return
+        history = self._history
+        now = perf_counter()
+        tabs = self.page.tabs
+        remaining = {}
+        blocked = set(scheduler.failed)
+        for num, depends in enumerate(self._dependencies):
+            if num in scheduler.succeeded or num in scheduler.failed:
+                continue
+            # steps waiting for a failed step never run
+            if depends & blocked:
+                blocked.add(num)
+                continue
+            key = self._history_key(num)
+            if num in self._processes:
+                elapsed = now - self._started[num]
+                left = history.remaining(key, elapsed, self._last_marker.get(num))
+                if left is not None:
+                    tabs.set_step_progress(num, elapsed / (elapsed + left) if left else 1.0)
+                remaining[num] = left
+            else:
+                remaining[num] = history.expected(key)
+        tabs.set_remaining(remaining_total(self._dependencies, remaining))
+
+    def _on_process_completed(self, *args):
+        self._eta_timer.stop()
+        self.page.tabs.set_remaining(None)
+        if self._history is not None:
+            self._history.save()
+        self._save_usage()
+
+    def _save_usage(self):
+        usage = self._sampler.usage
+        log_dir = self.page.log_dir
+        if not usage or not log_dir:
+            return
+        steps = self.page.steps
+        data = {str(num): dict(usage[num].to_dict(), step=steps[num].name)
+                for num in sorted(usage) if num < len(steps)}
+        try:
+            os.makedirs(log_dir, exist_ok=True)
+            with open(os.path.join(log_dir, 'resources.json'), 'w', encoding='utf-8') as f:
+                json.dump(data, f, indent=1)
+        except OSError:
+            pass
+
+    def _read(self, process, worker):
+        data = process.readAllStandardOutput()
+        if data:
+            worker.feed(bytes(data))
+
+    def _finish(self, num, success):
+        process, worker = self._processes.pop(num)
+        slot = self._line_slots.pop(num, None)
+        if slot is not None:
+            self.page.logs[num].lines_indexed.disconnect(slot)
+        self.page.tabs.set_step_progress(num, None)
+        if success and not self._stopping and self._history is not None:
+            self._history.record(self._history_key(num), perf_counter() - self._started[num],
+                                 self._markers.get(num))
+        self._read(process, worker)
+        worker.close()
+        process.deleteLater()
+        before = self._snapshots.pop(num, None)
+        overlapped = num in self._overlapped
+        self._overlapped.discard(num)
+        if success and before is not None and self._cache is not None and not self._stopping:
+            step = self.page.steps[num]
+            patterns = step.output_patterns
+            if patterns or not overlapped:
+                # the step completes, when its outputs are stored
+                self._store_workers[num] = worker = CacheStoreWorker(
+                    self._cache, self._keys[num], step.name, before, patterns, self)
+                worker.stored.connect(partial(self._on_stored, num))
+                worker.failed.connect(partial(self._on_store_failed, num))
+                worker.finished.connect(worker.deleteLater)
+                worker.start()
+                return
+            log = self.page.logs[num]
+            log.write("Outputs not stored in the build cache, the step ran with other steps "
+                      "and has no output patterns", log.PALETTE.BLUE)
+        self._complete_step(num, success)
+
+    def _complete_step(self, num, success):
+        if not self._stopping:
+            self.page.tabs.complete_step(num, success)
+        else:
+            self._restart_when_stopped()
+
+    def _on_stored(self, num, files):
+        del self._store_workers[num]
+        if self._build_files is not None:
+            self._build_files = files
+        self._complete_step(num, True)
+
+    def _on_store_failed(self, num, error):
+        # the build directory is not known anymore, so stop using the cache
+        del self._store_workers[num]
+        self._cache = self._build_files = None
+        log = self.page.logs[num]
+        log.write("Failed to store outputs in the build cache: %s" % (error,),
+                  log.PALETTE.RED)
+        self._complete_step(num, True)
+
+    def _on_finished(self, num, code, status):
+        if num in self._processes:
+            self._finish(num, status == QProcess.NormalExit and code == 0)
+
+    def _on_error(self, num, error):
+        # finished is not emitted, when the process did not start
+        if error == QProcess.FailedToStart and num in self._processes:
+            process, worker = self._processes[num]
+            worker.feed(("Failed to start: %s\n" % (process.errorString(),)).encode())
+            self._finish(num, False)
+
+    def _on_step_completed(self, num, success):
+        if self._stopping or self._scheduler is None:
+            return
+        self._start(self._scheduler.complete(num, success))
+
+    def _on_process_stopped(self):
+        self._stopping = True
+        if self._hash_worker is not None:
+            self._hash_worker.requestInterruption()
+            self._hash_worker = None
+            self.page.statusChanged.emit("")
+        if self._scheduler is not None:
+            self._scheduler.cancel()
+        for process, _ in self._processes.values():
+            process.stop(self.KILL_TIMEOUT)
+
+    def shutdown(self):
+        """Kill the running steps and wait at most SHUTDOWN_TIMEOUT for them"""
+        self._stopping = True
+        if self._hash_worker is not None:
+            self._hash_worker.requestInterruption()
+            self._hash_worker = None
+        if self._hasher is not None:
+            self._hasher.close()
+        processes = [process for process, _ in self._processes.values()]
+        for process in processes:
+            process.kill()
+        deadline = QDeadlineTimer(self.SHUTDOWN_TIMEOUT)
+        for process in processes:
+            process.waitForFinished(max(0, deadline.remainingTime()))
+        for worker in self._store_workers.values():
+            worker.wait(max(0, deadline.remainingTime()))
+
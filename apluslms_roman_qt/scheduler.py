@@ -0,0 +1,115 @@
+"""
+Scheduling of build steps, which depend on each other.
+
+Steps form a graph, where a step waits for the steps it depends on. Steps
+without unfinished dependencies are run at the same time up to a limit.
+"""
+import re
+
+
+NO_DEPENDENCIES = 'none'
+
+
+def step_dependencies(steps):
+    """Return list of sets of step indexes, which each step depends on.
+
+    The depends field of a step lists names or 1-based numbers of other
+    steps. An empty field means the previous step, so the steps run in
+    order by default, and 'none' means no dependencies. Raises ValueError
+    on an unknown step.
+    """
+    names = {}
+    for i, step in enumerate(steps):
+        names.setdefault(step.name, i)
+    result = []
+    for i, step in enumerate(steps):
+        words = [w for w in re.split(r'[,\s]+', step.depends.strip()) if w]
+        if not words:
+            result.append({i - 1} if i > 0 else set())
+            continue
+        depends = set()
+        for word in words:
+            if word.lower() == NO_DEPENDENCIES:
+                continue
+            if word.isdigit() and 1 <= int(word) <= len(steps):
+                depends.add(int(word) - 1)
+            elif word in names:
+                depends.add(names[word])
+            else:
+                raise ValueError("Step %d depends on an unknown step %r" % (i + 1, word))
+        result.append(depends)
+    return result
+
+
+class StepScheduler:
+    """Tells which steps to start, when steps complete.
+
+    A step is ready, when all its dependencies have completed with
+    success. Steps depending on a failed step, directly or through other
+    steps, are never started. Raises ValueError, if the dependencies
+    have a cycle.
+    """
+
+    def __init__(self, dependencies, max_workers=1):
+        self.dependencies = [set(d) for d in dependencies]
+        self.max_workers = max(1, max_workers)
+        self.running = set()
+        self.succeeded = set()
+        self.failed = set()
+        self._dependents = [set() for _ in self.dependencies]
+        for step, depends in enumerate(self.dependencies):
+            for other in depends:
+                self._dependents[other].add(step)
+        self._waiting = {step: len(depends) for step, depends in enumerate(self.dependencies)}
+        self._ready = [step for step, count in self._waiting.items() if not count]
+        self._check_cycles()
+
+    def _check_cycles(self):
+        counts = dict(self._waiting)
+        ready = list(self._ready)
+        seen = 0
+        while ready:
+            step = ready.pop()
+            seen += 1
+            for other in self._dependents[step]:
+                counts[other] -= 1
+                if not counts[other]:
+                    ready.append(other)
+        if seen < len(self.dependencies):
+            raise ValueError("Build steps have cyclic dependencies")
+
+    @property
+    def is_finished(self):
+        return not self.running and not self._ready
+
+    @property
+    def success(self):
+        return len(self.succeeded) == len(self.dependencies)
+
+    def start(self):
+        """Return steps to start now, they are marked as running"""
+        ready = self._ready
+        ready.sort(reverse=True)
+        started = []
+        while ready and len(self.running) < self.max_workers:
+            step = ready.pop()
+            self.running.add(step)
+            started.append(step)
+        return started
+
+    def complete(self, step, success=True):
+        """Mark the running step done and return steps to start now"""
+        self.running.discard(step)
+        if success:
+            self.succeeded.add(step)
+            for other in self._dependents[step]:
+                self._waiting[other] -= 1
+                if not self._waiting[other]:
+                    self._ready.append(other)
+        else:
+            self.failed.add(step)
+        return self.start()
+
+    def cancel(self):
+        """Forget the ready steps, running steps are still completed"""
+        self._ready.clear()
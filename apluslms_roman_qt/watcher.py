@@ -0,0 +1,229 @@
+"""
+Watching the course sources for changes.
+
+Directories are watched instead of files, so a course with thousands of
+files needs only a watch per directory. A directory watch doesn't see a
+file written in place, so the known files are also checked with stat.
+When the system runs out of watches, the sources are polled instead.
+"""
+import os
+from threading import Event
+
+from PyQt5.QtCore import (
+    QCoreApplication,
+    QFileSystemWatcher,
+    QObject,
+    QThread,
+    QTimer,
+    Qt,
+    pyqtSignal,
+)
+
+from .buildcache import BUILD_DIR, scan_sources
+
+
+def _list_dir(course_dir, rel_dir):
+    """Return ({file name: stat}, [subdirectory paths]) of a source directory"""
+    files = {}
+    dirs = []
+    try:
+        entries = list(os.scandir(os.path.join(course_dir, rel_dir)))
+    except OSError:
+        return files, dirs
+    for entry in entries:
+        name = entry.name
+        if name.startswith('.') or (not rel_dir and name == BUILD_DIR):
+            continue
+        try:
+            if entry.is_dir():
+                dirs.append(os.path.join(rel_dir, name))
+            elif entry.is_file():
+                st = entry.stat()
+                files[name] = (st.st_size, st.st_mtime_ns, st.st_ino)
+        except OSError:
+            continue
+    return files, dirs
+
+
+class StatWorker(QThread):
+    """Checks the stats of the known files every interval_ms in a thread.
+
+    dirs is {directory: {file name: stat}}, it is replaced, not modified,
+    by the GUI thread. modified is emitted with the directories, which
+    have a file with a changed stat.
+    """
+    modified = pyqtSignal(list) # directories
+
+    def __init__(self, course_dir, interval_ms, parent=None):
+        super().__init__(parent)
+        self.course_dir = course_dir
+        self.interval = interval_ms / 1000
+        self.dirs = {}
+        self._wake = Event()
+
+    def stop(self):
+        self.requestInterruption()
+        self._wake.set()
+        self.wait()
+
+    def run(self):
+        join = os.path.join
+        stat = os.stat
+        while not self.isInterruptionRequested():
+            self._wake.wait(self.interval)
+            modified = []
+            for rel_dir, files in self.dirs.items():
+                if self.isInterruptionRequested():
+                    return
+                directory = join(self.course_dir, rel_dir)
+                for name, old in files.items():
+                    try:
+                        st = stat(join(directory, name))
+                    except OSError:
+                        st = None
+                    if st is None or (st.st_size, st.st_mtime_ns, st.st_ino) != old:
+                        modified.append(rel_dir)
+                        break
+            if modified:
+                self.modified.emit(modified)
+
+
+class CourseWatcher(QObject):
+    """Emits changed with the relative paths of changed source files.
+
+    Changes are collected until none has come for DEBOUNCE_MS, so a burst
+    of saves from an editor gives a single signal. A QFileSystemWatcher
+    watches every source directory and the files of a changed directory
+    are compared to their previous stats. Files modified without changing
+    their directory are found by a StatWorker, which checks the stats of
+    the known files every STAT_MS. If a directory can't be watched, e.g. the inotify watch
+    limit is reached, the watcher falls back to scanning all sources every
+    POLL_MS.
+    """
+    changed = pyqtSignal(list) # paths
+    DEBOUNCE_MS = 400
+    STAT_MS = 1000
+    POLL_MS = 2000
+
+    def __init__(self, course_dir, parent=None):
+        super().__init__(parent)
+        self.course_dir = course_dir
+        self._dirs = {}
+        self._dirty = set()
+        self._changed = set()
+        self._sources = None
+        self._watcher = QFileSystemWatcher(self)
+        self._watcher.directoryChanged.connect(self._on_directory_changed)
+        self._debounce = QTimer(self)
+        self._debounce.setSingleShot(True)
+        self._debounce.setInterval(self.DEBOUNCE_MS)
+        self._debounce.timeout.connect(self._emit)
+        self._poll = QTimer(self)
+        self._poll.setInterval(self.POLL_MS)
+        self._poll.timeout.connect(self._scan_all)
+        self._stat = StatWorker(course_dir, self.STAT_MS, self)
+        self._stat.modified.connect(self._on_files_modified, Qt.QueuedConnection)
+        if self._add_dir(''):
+            self._stat.dirs = dict(self._dirs)
+            self._stat.start()
+        else:
+            self._start_polling()
+        app = QCoreApplication.instance()
+        if app is not None:
+            app.aboutToQuit.connect(self.close)
+
+    @property
+    def is_polling(self):
+        return self._poll.isActive()
+
+    def _add_dir(self, rel_dir, report=False):
+        """Watch the directory and its subdirectories.
+
+        Files of a new directory are reported as changed, when report is
+        set. Returns False, if a directory could not be watched.
+        """
+        pending = [rel_dir]
+        while pending:
+            rel_dir = pending.pop()
+            if not self._watcher.addPath(os.path.join(self.course_dir, rel_dir)):
+                return False
+            files, dirs = _list_dir(self.course_dir, rel_dir)
+            self._dirs[rel_dir] = files
+            if report:
+                self._changed.update(os.path.join(rel_dir, name) for name in files)
+            pending.extend(dirs)
+        return True
+
+    def _remove_dir(self, rel_dir):
+        prefix = os.path.join(rel_dir, '')
+        for path in [d for d in self._dirs if d == rel_dir or d.startswith(prefix)]:
+            files = self._dirs.pop(path)
+            self._changed.update(os.path.join(path, name) for name in files)
+            self._watcher.removePath(os.path.join(self.course_dir, path))
+
+    def _on_directory_changed(self, path):
+        rel_dir = os.path.relpath(path, self.course_dir)
+        self._dirty.add('' if rel_dir == '.' else rel_dir)
+        self._debounce.start()
+
+    def _on_files_modified(self, dirs):
+        # files written in place don't change their directory
+        self._dirty.update(dirs)
+        self._debounce.start()
+
+    def _emit(self):
+        if self._dirty:
+            dirty, self._dirty = self._dirty, set()
+            for rel_dir in sorted(dirty):
+                if rel_dir in self._dirs and not self._rescan_dir(rel_dir):
+                    self._start_polling()
+                    break
+            if self._stat.isRunning():
+                self._stat.dirs = dict(self._dirs)
+        if self._changed:
+            changed, self._changed = sorted(self._changed), set()
+            self.changed.emit(changed)
+
+    def _rescan_dir(self, rel_dir):
+        if not os.path.isdir(os.path.join(self.course_dir, rel_dir)):
+            self._remove_dir(rel_dir)
+            return True
+        old = self._dirs[rel_dir]
+        files, dirs = _list_dir(self.course_dir, rel_dir)
+        self._dirs[rel_dir] = files
+        for name in old.keys() | files.keys():
+            if old.get(name) != files.get(name):
+                self._changed.add(os.path.join(rel_dir, name))
+        for path in dirs:
+            if path not in self._dirs and not self._add_dir(path, report=True):
+                return False
+        return True
+
+    def _start_polling(self):
+        if self._stat.isRunning():
+            self._stat.stop()
+        paths = self._watcher.directories()
+        if paths:
+            self._watcher.removePaths(paths)
+        self._dirs.clear()
+        self._sources = dict(scan_sources(self.course_dir))
+        self._poll.start()
+
+    def _scan_all(self):
+        sources = dict(scan_sources(self.course_dir))
+        old = self._sources
+        self._sources = sources
+        for path in old.keys() | sources.keys():
+            if old.get(path) != sources.get(path):
+                self._changed.add(path)
+        if self._changed:
+            self._debounce.start()
+
+    def close(self):
+        self._poll.stop()
+        if self._stat.isRunning():
+            self._stat.stop()
+        self._debounce.stop()
+        paths = self._watcher.directories()
+        if paths:
+            self._watcher.removePaths(paths)
@@ -5,22 +5,171 @@ from PyQt5.QtCore import (
     pyqtSignal,
     pyqtSlot,
     QObject,
-    QVariant,
     QSize,
     QRect,
     QPoint,
-    QVariantAnimation,
+    QElapsedTimer,
+    QEvent,
+    QTimer,
 )
 from PyQt5.QtGui import (
     QPainter,
     QIcon,
+    QRegion,
 )
 from PyQt5.QtWidgets import (
     QWidget,
 )
 
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
 
-class Animation(QVariantAnimation):
+try:
+    from .paintprofile import profiled
+except ImportError:
+    from paintprofile import profiled
+
+
+class AnimationClock(QObject):
+    """Process wide timer, which drives all running Animations.
+
+    The clock ticks at FPS, while an animation is running. Each animation
+    emits tick, when its own frame changes, and update requests made
+    during a tick are merged to a single update of each widget.
+
+    Animations of hidden widgets, e.g. on another page or in a minimized or
+    unexposed window, are not advanced. When none is shown, the timer stops
+    until a show, hide, expose or window state event of an animated widget.
+    Frames are computed from the start time, so animations resume in phase.
+    """
+    FPS = 30
+    WAKE_EVENTS = (QEvent.Show, QEvent.Hide, QEvent.Expose, QEvent.WindowStateChange)
+    _instance = None
+
+    @classmethod
+    def instance(cls):
+        if cls._instance is None:
+            cls._instance = cls()
+        return cls._instance
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self._animations = []
+        self._pending = {}
+        self._watched = {} # id: watched widget or window
+        self._suspended = False
+        self._elapsed = QElapsedTimer()
+        self._elapsed.start()
+        self._timer = timer = QTimer(self)
+        timer.setTimerType(Qt.PreciseTimer)
+        timer.setInterval(round(1000 / self.FPS))
+        timer.timeout.connect(self._tick)
+
+    def now(self) -> int:
+        return self._elapsed.elapsed()
+
+    @property
+    def is_suspended(self):
+        return self._suspended
+
+    @staticmethod
+    def is_shown(widget) -> bool:
+        """Return True, if some part of the widget can be seen"""
+        if widget is None:
+            return True
+        if sip.isdeleted(widget) or not widget.isVisible():
+            return False
+        window = widget.window()
+        if window.isMinimized():
+            return False
+        handle = window.windowHandle()
+        if handle is not None and not handle.isExposed():
+            return False
+        return not widget.visibleRegion().isEmpty()
+
+    def subscribe(self, animation):
+        if animation not in self._animations:
+            self._animations.append(animation)
+            self._watch(animation.widget)
+            self._resume()
+
+    def unsubscribe(self, animation):
+        try:
+            self._animations.remove(animation)
+        except ValueError:
+            return
+        if not self._animations:
+            self._timer.stop()
+            self._suspended = False
+
+    def _watch(self, widget):
+        if widget is None:
+            return
+        window = widget.window()
+        for obj in (widget, window, window.windowHandle()):
+            if obj is not None and id(obj) not in self._watched:
+                self._watched[id(obj)] = obj
+                obj.installEventFilter(self)
+                obj.destroyed.connect(self._unwatch)
+
+    @pyqtSlot(QObject)
+    def _unwatch(self, obj):
+        self._watched.pop(id(obj), None)
+
+    def eventFilter(self, obj, event):
+        if self._suspended and event.type() in self.WAKE_EVENTS:
+            # the visibility is updated after the event is delivered
+            QTimer.singleShot(0, self._resume)
+        return False
+
+    @pyqtSlot()
+    def _resume(self):
+        if self._animations and not self._timer.isActive():
+            self._suspended = False
+            self._timer.start()
+            self._tick()
+
+    def request_update(self, widget, rect):
+        """Update the area of the widget after the animations of the tick"""
+        region = self._pending.get(widget)
+        if region is None:
+            region = self._pending[widget] = QRegion()
+        region += rect
+        if not self._timer.isActive():
+            self._flush()
+
+    def _flush(self):
+        pending, self._pending = self._pending, {}
+        for widget, region in pending.items():
+            if not sip.isdeleted(widget):
+                widget.update(region)
+
+    def _tick(self):
+        now = self.now()
+        shown = {}
+        for animation in list(self._animations):
+            if sip.isdeleted(animation):
+                self.unsubscribe(animation)
+                continue
+            widget = animation.widget
+            key = id(widget)
+            if key not in shown:
+                shown[key] = self.is_shown(widget)
+                if widget is not None and not sip.isdeleted(widget):
+                    # the native window is created, when it is shown first
+                    self._watch(widget)
+            if shown[key]:
+                animation._advance(now)
+        self._flush()
+        if self._animations and not any(shown.values()):
+            self._timer.stop()
+            self._suspended = True
+
+
+class Animation(QObject):
+    """Looping value from 0.0 to 1.0 in fps steps, driven by AnimationClock"""
     tick = pyqtSignal(float)
 
     def __init__(self,
@@ -30,30 +179,46 @@ class Animation(QVariantAnimation):
         super().__init__(parent)
 
         self.value = 0.0
-        self._frames = frames = int(fps * (duration / 1000.0))
-        self._animator = animator = QVariantAnimation(self)
-        animator.setStartValue(0)
-        animator.setEndValue(frames)
-        animator.setDuration(duration)
-        animator.valueChanged.connect(self._animation_tick)
-
-    @pyqtSlot(QVariant)
-    def _animation_tick(self, animator_value: int):
-        self.value = value = animator_value / self._frames
-        self.tick.emit(value)
+        self.duration = duration
+        self._frames = max(1, int(fps * (duration / 1000.0)))
+        self._frame = 0
+        self._started = 0
+        self._running = False
+
+    @property
+    def is_running(self):
+        return self._running
+
+    @property
+    def frame(self) -> int:
+        return self._frame
+
+    @property
+    def widget(self):
+        """The widget showing the animation or None, if not known"""
+        parent = self.parent()
+        return parent if isinstance(parent, QWidget) else None
+
+    def _advance(self, now: int):
+        frame = (now - self._started) * self._frames // self.duration % self._frames
+        if frame != self._frame:
+            self._frame = frame
+            self.value = value = frame / self._frames
+            self.tick.emit(value)
 
     @pyqtSlot()
     def start(self):
-        animator = self._animator
-        animator.stop()
-        animator.setLoopCount(-1)
-        animator.start()
+        clock = AnimationClock.instance()
+        self._started = clock.now()
+        self._frame = 0
+        self._running = True
+        clock.subscribe(self)
 
     @pyqtSlot()
     def stop(self):
-        animator = self._animator
-        animator.setLoopCount(0)
-        self._animation_tick(animator.currentValue())
+        self._running = False
+        AnimationClock.instance().unsubscribe(self)
+        self.tick.emit(self.value)
 
 
 class AnimationRenderer(Animation):
@@ -73,16 +238,21 @@ class AnimationRenderer(Animation):
     def _update_animation(self):
         rect = self._targetRect
         if rect:
-            self._target.update(rect)
+            AnimationClock.instance().request_update(self._target, rect)
         # skip update request, if we have not been painted ever
         #else:
         #    self._target.update()
 
+    @property
+    def widget(self):
+        return self._target if isinstance(self._target, QWidget) else None
+
     def paint(self, painter: QPainter, rect: QRect):
         # store render region in target coordinates for update request
         self._targetRect = painter.transform().mapRect(rect)
 
 
+@profiled('paint')
 class LoadingDots(AnimationRenderer):
     def __init__(self,
                  target: QObject,
@@ -104,7 +274,7 @@ class LoadingDots(AnimationRenderer):
         dot_space = min(size.width()/self._dots, size.height()) # self._max_dot_r
         max_dot_r = dot_space/2 * 0.75
         min_dot_r = max_dot_r * 0.6
-        state = self._animator.currentValue() / self._frames
+        state = self.frame / self._frames
         len = self._dots*2-1
 
         painter.translate(-(size.width()/2-dot_space/2), 0)
@@ -136,11 +306,11 @@ class RotatingIcon(AnimationRenderer):
     def paint(self, painter: QPainter, rect: QRect):
         super().paint(painter, rect)
         # edge length of a box rotated 45 degrees and within box with edge of 1
-        edge = min(rect.width(), rect.height()) * 0.7
+        edge = int(min(rect.width(), rect.height()) * 0.7)
         icon_area = QRect(0, 0, edge, edge)
         painter.save()
         painter.translate(rect.center())
-        rotation = self._animator.currentValue() * 360 / self._frames
+        rotation = self.frame * 360 / self._frames
         painter.rotate(rotation)
         painter.translate(-icon_area.center())
         self.icon.paint(painter, icon_area)
@@ -156,15 +326,17 @@ if __name__ == "__main__":
             super().__init__(parent)
 
             self.setFixedSize(128, 128)
+            self.paints = 0
             self.l = LoadingDots(self)
             self.l.start()
 
         def paintEvent(self, event):
+            self.paints += 1
             p = QPainter(self)
             self.l.paint(p, QRect(0, 0, self.width(), self.height()))
 
         def mousePressEvent(self, event):
-            if self.l._animator.loopCount() == -1:
+            if self.l.is_running:
                 self.l.stop()
             else:
                 self.l.start()
@@ -174,10 +346,12 @@ if __name__ == "__main__":
             super().__init__(parent)
 
             self.setFixedSize(128, 128)
+            self.paints = 0
             self.i = RotatingIcon(self, fps=30, icon=self.style().standardIcon(QStyle.SP_BrowserReload))
             self.i.start()
 
         def paintEvent(self, event):
+            self.paints += 1
             p = QPainter(self)
             self.i.paint(p, QRect(0, 0, self.width(), self.height()))
 
@@ -187,9 +361,43 @@ if __name__ == "__main__":
     view.setWindowTitle("Test for LoadingDots")
 
     layout = QVBoxLayout()
-    layout.addWidget(Dots(view))
-    layout.addWidget(Icon(view))
+    dots = Dots(view)
+    icon = Icon(view)
+    layout.addWidget(dots)
+    layout.addWidget(icon)
     view.setLayout(layout)
 
     view.show()
-    sys.exit(app.exec_())
+    if '--check-hidden' not in sys.argv:
+        sys.exit(app.exec_())
+
+    # --check-hidden counts paint events, while the demo is hidden, minimized
+    # and its animated widgets are hidden, and exits with 1, if any were
+    # painted or the clock kept running. Without a display, run it with
+    # QT_QPA_PLATFORM=offscreen python3 -m apluslms_roman_qt.widgets.animations --check-hidden
+    def run(ms):
+        QTimer.singleShot(ms, app.quit)
+        app.exec_()
+        counts = (dots.paints, icon.paints)
+        dots.paints = icon.paints = 0
+        return counts
+
+    clock = AnimationClock.instance()
+    failed = False
+    for name, hide in (("hidden", view.hide),
+                       ("minimized", view.showMinimized),
+                       ("child hidden", lambda: (dots.hide(), icon.hide()))):
+        run(500)
+        hide()
+        run(50) # paints queued before hiding
+        paints = run(1000)
+        suspended = clock.is_suspended
+        dots.show()
+        icon.show()
+        view.showNormal()
+        resumed = run(500)
+        ok = paints == (0, 0) and suspended and min(resumed) >= 4
+        failed = failed or not ok
+        print("%-13s paints while hidden %s, clock suspended %s, paints after %s: %s" % (
+            name, paints, suspended, resumed, "ok" if ok else "FAILED"))
+    sys.exit(1 if failed else 0)
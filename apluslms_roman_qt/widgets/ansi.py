@@ -0,0 +1,268 @@
+"""
+Incremental parser for terminal output with ANSI escape sequences.
+
+Select Graphic Rendition (SGR) sequences are turned into style codes,
+which index a shared StyleTable. All other escape sequences are dropped.
+"""
+import re
+from codecs import getincrementaldecoder
+from collections import namedtuple
+from threading import Lock
+
+
+Style = namedtuple('Style', 'fg bg bold italic underline inverse')
+Style.__new__.__defaults__ = (None, None, False, False, False, False)
+DEFAULT_STYLE = Style()
+
+
+def _xterm_colors():
+    colors = [
+        '#000000', '#cd0000', '#00cd00', '#cdcd00',
+        '#0000ee', '#cd00cd', '#00cdcd', '#e5e5e5',
+        '#7f7f7f', '#ff0000', '#00ff00', '#ffff00',
+        '#5c5cff', '#ff00ff', '#00ffff', '#ffffff',
+    ]
+    steps = (0, 95, 135, 175, 215, 255)
+    colors.extend('#%02x%02x%02x' % (steps[r], steps[g], steps[b])
+                  for r in range(6) for g in range(6) for b in range(6))
+    colors.extend('#%02x%02x%02x' % ((8 + i * 10,) * 3) for i in range(24))
+    return colors
+
+XTERM_COLORS = _xterm_colors()
+
+
+class StyleTable:
+    """Interns styles to small integer codes. Code 0 is the default style.
+
+    Codes are added by the parsers in the worker threads, so adding is
+    locked. A code is published only after its style is in the table.
+    """
+
+    def __init__(self):
+        self.styles = [DEFAULT_STYLE]
+        self._codes = {DEFAULT_STYLE: 0}
+        self._lock = Lock()
+
+    def __len__(self):
+        return len(self.styles)
+
+    def __getitem__(self, code: int) -> Style:
+        return self.styles[code]
+
+    def code(self, style: Style) -> int:
+        code = self._codes.get(style)
+        if code is None:
+            with self._lock:
+                code = self._codes.get(style)
+                if code is None:
+                    code = len(self.styles)
+                    self.styles.append(style)
+                    self._codes[style] = code
+        return code
+
+STYLES = StyleTable()
+
+
+def _extended_color(params, i):
+    # 38;5;n or 38;2;r;g;b, returns color and index of the last used param
+    try:
+        if params[i + 1] == 5:
+            return XTERM_COLORS[params[i + 2]], i + 2
+        if params[i + 1] == 2:
+            return '#%02x%02x%02x' % tuple(params[i + 2:i + 5]), i + 4
+    except (IndexError, TypeError):
+        pass
+    return None, len(params)
+
+
+def apply_sgr(style: Style, params: str) -> Style:
+    """Return style after SGR sequence with parameters params"""
+    values = [int(p) if p.isdigit() else 0 for p in re.split('[;:]', params)]
+    fg, bg, bold, italic, underline, inverse = style
+    i = 0
+    while i < len(values):
+        p = values[i]
+        if p == 0:
+            fg, bg, bold, italic, underline, inverse = DEFAULT_STYLE
+        elif p == 1:
+            bold = True
+        elif p == 3:
+            italic = True
+        elif p == 4:
+            underline = True
+        elif p == 7:
+            inverse = True
+        elif p == 22:
+            bold = False
+        elif p == 23:
+            italic = False
+        elif p == 24:
+            underline = False
+        elif p == 27:
+            inverse = False
+        elif 30 <= p <= 37:
+            fg = XTERM_COLORS[p - 30]
+        elif p == 38:
+            fg, i = _extended_color(values, i)
+        elif p == 39:
+            fg = None
+        elif 40 <= p <= 47:
+            bg = XTERM_COLORS[p - 40]
+        elif p == 48:
+            bg, i = _extended_color(values, i)
+        elif p == 49:
+            bg = None
+        elif 90 <= p <= 97:
+            fg = XTERM_COLORS[p - 90 + 8]
+        elif 100 <= p <= 107:
+            bg = XTERM_COLORS[p - 100 + 8]
+        i += 1
+    return Style(fg, bg, bold, italic, underline, inverse)
+
+
+# SGR sequences, split() returns text and parameters interleaved
+SGR_RE = re.compile(r'\x1b\[([0-9;:]*)m')
+# other CSI sequences, OSC strings and two character escapes
+ESCAPE_RE = re.compile(r'\x1b(?:\[[0-9;:<=>?]*[ -/]*[@-~]|\][^\x07\x1b]*(?:\x07|\x1b\\)?|[ -/]*[0-~])?')
+
+
+class AnsiParser:
+    """Incremental parser for text with ANSI escape sequences.
+
+    feed() takes chunks of bytes or text and returns the completed lines as
+    (text, runs, transient) tuples, where runs is a tuple of (column, code)
+    tuples. The incomplete last line, including a split escape sequence or
+    a split multibyte character, is kept until the next chunk.
+
+    A line ended with a carriage return is transient, as the next line is
+    drawn over it in a terminal.
+    """
+    MAX_LINE = 65536
+
+    def __init__(self, styles: StyleTable = None, encoding: str = 'utf-8'):
+        self.styles = styles if styles is not None else STYLES
+        self.code = 0
+        self._decoder = getincrementaldecoder(encoding)('replace')
+        self._rest = ''
+        self._sgr_cache = {}
+
+    def feed(self, data) -> list:
+        if isinstance(data, bytes):
+            data = self._decoder.decode(data)
+        if self._rest:
+            data = self._rest + data
+        lines = data.split('\n')
+        rest = lines.pop()
+        if len(rest) > self.MAX_LINE:
+            lines.append(rest)
+            rest = ''
+        result = self._parse_lines(lines)
+        if '\r' in rest:
+            # carriage return updates of the incomplete line are complete,
+            # but a trailing \r may still be a part of \r\n
+            cr = rest.endswith('\r')
+            head, sep, rest = (rest[:-1] if cr else rest).rpartition('\r')
+            if cr:
+                rest += '\r'
+            if sep:
+                result.extend(self._parse_segments(head.split('\r'), True))
+        self._rest = rest
+        return result
+
+    def flush(self) -> list:
+        """Return the incomplete last line, if there is one"""
+        rest = self._rest + self._decoder.decode(b'', True)
+        self._rest = ''
+        return self._parse_lines([rest]) if rest else []
+
+    def parse_line(self, line: str, code: int = 0):
+        """Return (text, runs) of a complete line starting with the style code"""
+        self.code = code
+        return self._parse_line(line)
+
+    def _parse_lines(self, lines):
+        result = []
+        append = result.append
+        parse_line = self._parse_line
+        plain = ((0, self.code),)
+        for line in lines:
+            if '\r' in line:
+                if line.endswith('\r'):
+                    line = line[:-1]
+                if '\r' in line:
+                    result.extend(self._parse_segments(line.split('\r'), False))
+                    plain = ((0, self.code),)
+                    continue
+            if '\x1b' in line:
+                append(parse_line(line) + (False,))
+                plain = ((0, self.code),)
+            else:
+                append((line, plain, False))
+        return result
+
+    def _parse_segments(self, segments, transient):
+        # all but the last segment were ended with a carriage return
+        last = len(segments) - 1
+        result = []
+        for i, segment in enumerate(segments):
+            text, runs = self._parse_line(segment)
+            if i < last:
+                if text:
+                    result.append((text, runs, True))
+            else:
+                result.append((text, runs, transient))
+        return result
+
+    def _parse_line(self, line):
+        pieces = SGR_RE.split(line)
+        parts = []
+        runs = []
+        col = 0
+        code = self.code
+        sgr = self._sgr
+        for i, text in enumerate(pieces):
+            if i % 2:
+                code = sgr(code, text)
+                continue
+            if '\x1b' in text:
+                text = ESCAPE_RE.sub('', text)
+            if text:
+                if not runs or runs[-1][1] != code:
+                    runs.append((col, code))
+                parts.append(text)
+                col += len(text)
+        self.code = code
+        return ''.join(parts), tuple(runs) or ((0, code),)
+
+    def _sgr(self, code, params):
+        key = (code, params)
+        new = self._sgr_cache.get(key)
+        if new is None:
+            styles = self.styles
+            new = styles.code(apply_sgr(styles[code], params))
+            self._sgr_cache[key] = new
+        return new
+
+
+def benchmark(size=50 * 1024 * 1024, chunk=65536):
+    """Print parser throughput for synthetic build output"""
+    from time import perf_counter
+    sample = (
+        "reading sources... [ 42%] module01/chapter02\n"
+        "\x1b[01mbuilding [html]\x1b[39;49;00m: targets for 21 source files\n"
+        "/course/module01/chapter02.rst:123: \x1b[91mWARNING: undefined label\x1b[39;49;00m\n"
+        "copying static files... \x1b[32mdone\x1b[39;49;00m\n"
+    ).encode('utf-8')
+    data = sample * (size // len(sample))
+    parser = AnsiParser()
+    lines = 0
+    start = perf_counter()
+    for i in range(0, len(data), chunk):
+        lines += len(parser.feed(data[i:i + chunk]))
+    elapsed = perf_counter() - start
+    print("%d MB, %d lines in %.2fs: %.1f MB/s" % (
+        len(data) / 2**20, lines, elapsed, len(data) / 2**20 / elapsed))
+
+
+if __name__ == '__main__':
+    benchmark()
@@ -64,6 +64,18 @@ from PyQt5.QtWidgets import (
     QStatusBar,
 )
 
+try:
+    from PyQt5 import sip
+except ImportError:
+    import sip
+
+try:
+    from .animations import AnimationClock
+    from .paintprofile import profiled
+except ImportError:
+    from animations import AnimationClock
+    from paintprofile import profiled
+
 def limit_to_255(value: float) -> int:
     return 255 if value > 255 else 0 if value < 0 else int(value)
 
@@ -255,20 +267,31 @@ class FancyTab(QObject):
         self._tabbar.update()
 
     def fadeIn(self):
-        animator = self._animator
-        animator.stop()
-        animator.setDuration(self.fadeInDelay)
-        animator.setEndValue(1.0)
-        animator.start()
+        self._fade(self.fadeInDelay, 1.0)
 
     def fadeOut(self):
+        self._fade(self.fadeOutDelay, 0.0)
+
+    def _fade(self, duration: int, value: float):
         animator = self._animator
         animator.stop()
-        animator.setDuration(self.fadeOutDelay)
-        animator.setEndValue(0.0)
+        if not AnimationClock.is_shown(self._tabbar):
+            # no frames for a tabbar, which can't be seen
+            self.fader = value
+            return
+        animator.setDuration(duration)
+        animator.setEndValue(value)
         animator.start()
 
+    def finishFade(self):
+        animator = self._animator
+        # the animator is deleted before the tabbar, when the window closes
+        if not sip.isdeleted(animator) and animator.state() == QPropertyAnimation.Running:
+            animator.stop()
+            self.fader = animator.endValue()
+
 
+@profiled()
 class FancyTabBar(QWidget):
     """QWidget of the tabbar part"""
 
@@ -418,6 +441,11 @@ class FancyTabBar(QWidget):
             tab.fadeOut()
         super().leaveEvent(event)
 
+    def hideEvent(self, event):
+        for tab in self._tabs:
+            tab.finishFade()
+        super().hideEvent(event)
+
     @property
     def _currentIndex(self) -> int:
         return self.__currentIndex
@@ -0,0 +1,99 @@
+from PyQt5.QtCore import (
+    Qt,
+    pyqtSignal,
+    pyqtSlot,
+)
+from PyQt5.QtWidgets import (
+    QCheckBox,
+    QHBoxLayout,
+    QLabel,
+    QLineEdit,
+    QStyle,
+    QToolButton,
+    QWidget,
+)
+
+
+class FindBar(QWidget):
+    """Text field and buttons for searching the log widgets.
+
+    Emits search_changed when the text or the mode is edited and
+    find_requested for the next (or previous with shift) match. The
+    receiver tells the result with set_status().
+    """
+    search_changed = pyqtSignal(str, bool) # text, regex
+    find_requested = pyqtSignal(str, bool, bool) # text, backward, regex
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        icon = self.style().standardIcon
+
+        self.edit = edit = QLineEdit()
+        edit.setPlaceholderText("Find in logs")
+        edit.setClearButtonEnabled(True)
+        edit.textEdited.connect(self._changed)
+
+        self.regex = regex = QCheckBox("Regex")
+        regex.toggled.connect(self._changed)
+
+        previous = QToolButton()
+        previous.setIcon(icon(QStyle.SP_ArrowUp))
+        previous.setToolTip("Previous match")
+        previous.clicked.connect(self.find_previous)
+        next_ = QToolButton()
+        next_.setIcon(icon(QStyle.SP_ArrowDown))
+        next_.setToolTip("Next match")
+        next_.clicked.connect(self.find_next)
+        close = QToolButton()
+        close.setIcon(icon(QStyle.SP_DialogCloseButton))
+        close.setAutoRaise(True)
+        close.clicked.connect(self.hide)
+
+        self.status = QLabel()
+
+        layout = QHBoxLayout()
+        layout.setContentsMargins(4, 2, 4, 2)
+        layout.addWidget(edit, 1)
+        layout.addWidget(regex)
+        layout.addWidget(previous)
+        layout.addWidget(next_)
+        layout.addWidget(self.status)
+        layout.addWidget(close)
+        self.setLayout(layout)
+
+    @property
+    def text(self):
+        return self.edit.text()
+
+    @pyqtSlot()
+    def activate(self):
+        self.show()
+        self.edit.setFocus()
+        self.edit.selectAll()
+
+    def set_status(self, text):
+        self.status.setText(text)
+
+    def _changed(self, *args):
+        self.search_changed.emit(self.text, self.regex.isChecked())
+
+    @pyqtSlot()
+    def find_next(self):
+        self.find_requested.emit(self.text, False, self.regex.isChecked())
+
+    @pyqtSlot()
+    def find_previous(self):
+        self.find_requested.emit(self.text, True, self.regex.isChecked())
+
+    def keyPressEvent(self, event):
+        key = event.key()
+        if key == Qt.Key_Escape:
+            self.hide()
+        elif key in (Qt.Key_Return, Qt.Key_Enter):
+            # the line edit passes return on to the bar
+            if event.modifiers() & Qt.ShiftModifier:
+                self.find_previous()
+            else:
+                self.find_next()
+        else:
+            super().keyPressEvent(event)
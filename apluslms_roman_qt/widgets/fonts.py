@@ -0,0 +1,64 @@
+"""
+Fonts of the log widgets.
+
+The bundled monospace font is registered once per process and the cell
+metrics are cached by font, so creating a log widget does not touch the
+font database.
+"""
+import os
+from collections import namedtuple
+
+from PyQt5.QtGui import (
+    QFont,
+    QFontDatabase,
+    QFontMetrics,
+)
+
+
+FONT_FILE = 'DejaVuSansMono.ttf'
+
+CellMetrics = namedtuple('CellMetrics', 'width height ascent')
+
+_family = None
+_metrics = {}
+
+
+def _font_data():
+    # read through the loader, so the font is found inside a zip too
+    path = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), FONT_FILE)
+    try:
+        return __loader__.get_data(path)
+    except (AttributeError, OSError):
+        return None
+
+
+def log_font_family() -> str:
+    """Return family of the log font, the bundled font is registered on the first call"""
+    global _family
+    if _family is None:
+        data = _font_data()
+        font_id = QFontDatabase.addApplicationFontFromData(data) if data else -1
+        families = QFontDatabase.applicationFontFamilies(font_id) if font_id >= 0 else []
+        if families:
+            _family = families[0]
+        else:
+            _family = QFontDatabase.systemFont(QFontDatabase.FixedFont).family()
+    return _family
+
+
+def log_font(base: QFont = None) -> QFont:
+    """Return copy of the base font with the log font family"""
+    font = QFont(base) if base is not None else QFont()
+    font.setFamily(log_font_family())
+    font.setStyleHint(QFont.TypeWriter)
+    return font
+
+
+def cell_metrics(font: QFont) -> CellMetrics:
+    """Return cached width, height and ascent of a character cell"""
+    key = font.key()
+    metrics = _metrics.get(key)
+    if metrics is None:
+        fm = QFontMetrics(font)
+        _metrics[key] = metrics = CellMetrics(fm.width('a'), fm.height(), fm.ascent())
+    return metrics
@@ -0,0 +1,189 @@
+from collections import deque
+from threading import Condition, Lock
+
+from PyQt5.QtCore import (
+    Qt,
+    QThread,
+    pyqtSignal,
+)
+
+try:
+    from .ansi import AnsiParser, Style, STYLES
+    from .logstore import LogFile
+except ImportError:
+    from ansi import AnsiParser, Style, STYLES
+    from logstore import LogFile
+
+
+SUMMARY_CODE = STYLES.code(Style(fg='#ffff00', bold=True))
+
+
+class LogIngestWorker(QThread):
+    """Decodes, parses and splits raw output of a step in a worker thread.
+
+    Raw chunks are given to feed() from any thread. Parsed lines are put to
+    a bounded queue in batches of (text, runs, transient) tuples and
+    batches_ready is emitted, when the queue stops being empty. The GUI
+    thread takes the batches with take().
+
+    When the queue is full, the worker switches to the summary mode: it
+    keeps only the last KEEP_LINES lines and counts the rest. When the GUI
+    has emptied the queue, a line telling the number of skipped lines and
+    the kept lines are queued as a single batch. An attached log takes
+    batches only, while it is not backlogged, so the lines queued in the
+    log are bounded too.
+
+    If path is given, the raw output is also written to a LogFile there,
+    which is created right away, so a log can map it before the step
+    starts. file_flushed is emitted, when written output is visible in the
+    file. Lines are parsed only for an attached log. bytes_read,
+    lines_parsed and lines_skipped count the whole output.
+    """
+    batches_ready = pyqtSignal()
+    file_flushed = pyqtSignal()
+
+    MAX_BATCHES = 64
+    BATCH_LINES = 1000
+    KEEP_LINES = 200
+
+    def __init__(self, parent=None, encoding='utf-8', path=None):
+        super().__init__(parent)
+        self.path = path
+        self._log_file = LogFile(path) if path else None
+        self._attached = False
+        self._reload_pending = False
+        self._encoding = encoding
+        self._parser = AnsiParser(encoding=encoding)
+        self._input = deque()
+        self._input_cond = Condition()
+        self._closed = False
+        self._output = deque()
+        self._output_lock = Lock()
+        self._tail = deque(maxlen=self.KEEP_LINES)
+        self._skipped = 0
+        self._done = False
+        self.bytes_read = 0
+        self.lines_parsed = 0
+        self.lines_skipped = 0
+
+    def feed(self, data):
+        with self._input_cond:
+            self._input.append(data)
+            self._input_cond.notify()
+
+    def close(self):
+        """Mark the end of the output, the thread exits after parsing it"""
+        with self._input_cond:
+            self._closed = True
+            self._input_cond.notify()
+
+    def run(self):
+        parser = self._parser
+        cond = self._input_cond
+        log_file = self._log_file
+        encoding = self._encoding
+        while True:
+            with cond:
+                while not self._input and not self._closed:
+                    cond.wait()
+                chunks = list(self._input)
+                self._input.clear()
+                closed = self._closed and not chunks
+            lines = []
+            for chunk in chunks:
+                self.bytes_read += len(chunk)
+                if self._attached:
+                    lines.extend(parser.feed(chunk))
+                if log_file:
+                    log_file.write(chunk if isinstance(chunk, bytes) else chunk.encode(encoding))
+            if closed and self._attached:
+                lines.extend(parser.flush())
+            if log_file and (chunks or closed):
+                if closed:
+                    log_file.close()
+                else:
+                    log_file.flush()
+                if not self._reload_pending:
+                    # a single reload at a time, it reads everything flushed
+                    self._reload_pending = True
+                    self.file_flushed.emit()
+            if lines:
+                self.lines_parsed += len(lines)
+                self._push(lines)
+            if closed:
+                break
+        self._done = True
+        self.batches_ready.emit()
+
+    def _push(self, lines):
+        size = self.BATCH_LINES
+        notify = False
+        with self._output_lock:
+            output = self._output
+            tail = self._tail
+            if output and not tail and len(output[-1]) < size:
+                # fill the last batch, which the GUI has not taken yet
+                room = size - len(output[-1])
+                output[-1].extend(lines[:room])
+                lines = lines[room:]
+            for i in range(0, len(lines), size):
+                batch = lines[i:i + size]
+                if tail or len(output) >= self.MAX_BATCHES:
+                    skipped = max(0, len(tail) + len(batch) - tail.maxlen)
+                    self._skipped += skipped
+                    self.lines_skipped += skipped
+                    tail.extend(batch)
+                else:
+                    notify = notify or not output
+                    output.append(batch)
+        if notify:
+            self.batches_ready.emit()
+
+    def take(self, count=None) -> list:
+        """Return count or all queued batches, called from the GUI thread"""
+        with self._output_lock:
+            output = self._output
+            if count is None or count >= len(output):
+                batches = list(output)
+                output.clear()
+            else:
+                batches = [output.popleft() for _ in range(count)]
+            if self._tail and not output:
+                # the queue is empty again, leave the summary mode
+                summary = "... %d lines skipped, the log view could not keep up ..." % (
+                    self._skipped,)
+                batches.append([(summary, ((0, SUMMARY_CODE),), False)] + list(self._tail))
+                self._tail.clear()
+                self._skipped = 0
+        return batches
+
+    def attach(self, log):
+        """Write batches to the log widget in the GUI thread.
+
+        Batches are taken one at a time, until the log is backlogged. The
+        rest stay in the queue and are taken, when the log emits
+        pending_drained.
+        """
+        attached = True
+        self._attached = True
+
+        def write_batches():
+            nonlocal attached
+            while not log.is_backlogged:
+                batches = self.take(1)
+                if not batches:
+                    break
+                for batch in batches:
+                    log.write_lines(batch)
+            if attached and self._done and not self._output and not self._tail:
+                attached = False
+                log.pending_drained.disconnect(write_batches)
+        self.batches_ready.connect(write_batches, Qt.QueuedConnection)
+        log.pending_drained.connect(write_batches)
+
+    def follow(self, log):
+        """Reload the log, which has opened the log file, as it is written"""
+        def reload():
+            self._reload_pending = False
+            log.reload()
+        self.file_flushed.connect(reload, Qt.QueuedConnection)
@@ -0,0 +1,576 @@
+import mmap
+import os
+import re
+from array import array
+from bisect import bisect_right
+from itertools import accumulate
+from tempfile import TemporaryFile
+from time import strftime
+
+try:
+    from .ansi import AnsiParser
+except ImportError:
+    from ansi import AnsiParser
+
+
+INDEX_SUFFIX = '.idx'
+
+
+def run_log_dir(course_dir, stamp=None):
+    """Create and return a new directory for step logs of a run.
+
+    The directory is in the course build directory and named by the time.
+    A run in the same second gets a suffix, so the files of an earlier
+    run, which may still be mapped, are never truncated.
+    """
+    if stamp is None:
+        stamp = strftime('%Y%m%d-%H%M%S')
+    base = os.path.join(course_dir, '_build', 'logs', stamp)
+    path = base
+    count = 1
+    while True:
+        try:
+            os.makedirs(path)
+            return path
+        except FileExistsError:
+            count += 1
+            path = '%s-%d' % (base, count)
+
+
+class LogSegment:
+    """Append only line storage in a temporary file.
+
+    Line text is kept on disk, only the line offsets and a style code per
+    line are kept in memory. Style is either a code or a tuple of
+    (column, code) runs, which are kept in a dict by line index.
+    Lines are read back by index.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        self._encoding = encoding
+        self._file = TemporaryFile()
+        self._offsets = array('Q', [0])
+        self._codes = array('I')
+        self._runs = {}
+        self._dirty = False
+
+    def __len__(self):
+        return len(self._codes)
+
+    def append(self, line: str, style=0):
+        data = line.encode(self._encoding, 'replace') + b'\n'
+        self._file.seek(self._offsets[-1])
+        self._file.write(data)
+        self._offsets.append(self._offsets[-1] + len(data))
+        if not isinstance(style, int):
+            self._runs[len(self._codes)] = style
+            style = style[0][1]
+        self._codes.append(style)
+        self._dirty = True
+
+    def pop(self):
+        """Remove the last line"""
+        self._offsets.pop()
+        self._codes.pop()
+        self._runs.pop(len(self._codes), None)
+
+    def extend(self, lines, style=0):
+        """Append many lines with the same style"""
+        if not isinstance(style, int):
+            for line in lines:
+                self.append(line, style)
+            return
+        if not lines:
+            return
+        encoding = self._encoding
+        data = [line.encode(encoding, 'replace') + b'\n' for line in lines]
+        offsets = self._offsets
+        offset = offsets[-1]
+        for line in data:
+            offset += len(line)
+            offsets.append(offset)
+        self._file.seek(offsets[-len(data) - 1])
+        self._file.write(b''.join(data))
+        self._codes.extend([style] * len(data))
+        self._dirty = True
+
+    def read(self, start: int, stop: int):
+        """Return list of (line, style) tuples for range start..stop"""
+        start = max(0, start)
+        stop = min(len(self), stop)
+        if start >= stop:
+            return []
+        file = self._file
+        if self._dirty:
+            file.flush()
+            self._dirty = False
+        offsets = self._offsets
+        file.seek(offsets[start])
+        data = file.read(offsets[stop] - offsets[start])
+        encoding = self._encoding
+        lines = data.decode(encoding, 'replace').split('\n')
+        runs = self._runs
+        styles = self._codes[start:stop]
+        if runs:
+            styles = [runs.get(i, code) for i, code in enumerate(styles, start)]
+        return list(zip(lines, styles))
+
+    def close(self):
+        self._file.close()
+
+
+class LineReader:
+    """Text access and search for line stores, which implement line()"""
+
+    def lines(self, start: int, stop: int):
+        """Return texts of lines in range start..stop"""
+        line = self.line
+        return [line(i) for i in range(max(0, start), min(len(self), stop))]
+
+    def text(self, start_line: int, start_col: int, end_line: int, end_col: int) -> str:
+        if start_line == end_line:
+            return self.line(start_line)[start_col:end_col]
+        parts = [self.line(start_line)[start_col:]]
+        parts.extend(self.line(i) for i in range(start_line + 1, end_line))
+        parts.append(self.line(end_line)[:end_col])
+        return '\n'.join(parts)
+
+    def find(self, pattern: str, line: int = 0, col: int = 0,
+             backward: bool = False, regex: bool = False):
+        """Return (line, column, length) of the next match or None.
+
+        Search starts from the position and does not wrap around.
+        """
+        if not pattern or not len(self):
+            return None
+        expr = re.compile(pattern if regex else re.escape(pattern))
+        if not backward:
+            for i in range(line, len(self)):
+                match = expr.search(self.line(i), col if i == line else 0)
+                if match:
+                    return i, match.start(), match.end() - match.start()
+        else:
+            for i in range(min(line, len(self) - 1), -1, -1):
+                text = self.line(i)
+                match = None
+                for match in expr.finditer(text, 0, col if i == line else len(text)):
+                    pass
+                if match:
+                    return i, match.start(), match.end() - match.start()
+        return None
+
+
+class LineStore(LineReader):
+    """Compact in memory line storage.
+
+    Text is kept as UTF-8 in a single bytearray with an array of line
+    offsets. Styles are kept as runs: an array of byte offsets where a run
+    starts and an array of style codes for the runs.
+    """
+
+    def __init__(self, encoding='utf-8'):
+        self._encoding = encoding
+        self._data = bytearray()
+        self._offsets = array('Q', [0])
+        self._run_starts = array('Q')
+        self._run_codes = array('I')
+        self.max_length = 0
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def append(self, line: str, code: int = 0, runs=None):
+        """Append line with a single style code or with runs.
+
+        Runs is a sequence of (column, code) tuples in column order.
+        """
+        encoding = self._encoding
+        start = self._offsets[-1]
+        if runs is None:
+            runs = ((0, code),) if isinstance(code, int) else code
+        run_starts = self._run_starts
+        run_codes = self._run_codes
+        for col, code in runs:
+            if run_codes and run_codes[-1] == code:
+                continue
+            offset = start + len(line[:col].encode(encoding, 'replace'))
+            if run_starts and run_starts[-1] == offset:
+                run_codes[-1] = code
+            else:
+                run_starts.append(offset)
+                run_codes.append(code)
+        data = self._data
+        data += line.encode(encoding, 'replace')
+        data += b'\n'
+        self._offsets.append(len(data))
+        if len(line) > self.max_length:
+            self.max_length = len(line)
+
+    def pop(self):
+        """Remove the last line"""
+        offsets = self._offsets
+        offsets.pop()
+        start = offsets[-1]
+        del self._data[start:]
+        run_starts = self._run_starts
+        run_codes = self._run_codes
+        while run_starts and run_starts[-1] >= start:
+            run_starts.pop()
+            run_codes.pop()
+
+    def line(self, index: int) -> str:
+        offsets = self._offsets
+        data = self._data[offsets[index]:offsets[index + 1] - 1]
+        return data.decode(self._encoding, 'replace')
+
+    def read(self, start: int, stop: int):
+        """Return list of (line, style) tuples for range start..stop"""
+        result = []
+        for i in range(max(0, start), min(len(self), stop)):
+            runs = self.runs(i)
+            result.append((self.line(i), runs[0][1] if len(runs) == 1 else tuple(runs)))
+        return result
+
+    def runs(self, index: int):
+        """Return list of (column, code) tuples for the line"""
+        offsets = self._offsets
+        start, end = offsets[index], offsets[index + 1] - 1
+        run_starts = self._run_starts
+        run_codes = self._run_codes
+        i = bisect_right(run_starts, start) - 1
+        runs = [(0, run_codes[i] if i >= 0 else 0)]
+        i += 1
+        data = self._data
+        encoding = self._encoding
+        while i < len(run_starts) and run_starts[i] < end:
+            col = len(data[start:run_starts[i]].decode(encoding, 'replace'))
+            runs.append((col, run_codes[i]))
+            i += 1
+        return runs
+
+
+class LogFile:
+    """Writes raw output of a step to a file with a line index next to it.
+
+    The index file has the length of the longest line and the end offset of
+    every line in an array('Q'). Both are written as the output arrives, so
+    a MappedLog can open the log while the step is still running.
+    """
+
+    def __init__(self, path):
+        directory = os.path.dirname(path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        self.path = path
+        self._file = open(path, 'wb')
+        self._index = open(path + INDEX_SUFFIX, 'wb')
+        self._index.write(bytes(8))
+        self._size = 0
+        self._line_start = 0
+        self.max_length = 0
+
+    def write(self, data: bytes):
+        self._file.write(data)
+        start = self._size
+        self._size += len(data)
+        if b'\n' not in data:
+            return
+        lengths = [len(part) + 1 for part in data.split(b'\n')[:-1]]
+        longest = max(max(lengths) - 1, start + lengths[0] - 1 - self._line_start)
+        if longest > self.max_length:
+            self.max_length = longest
+        lengths[0] += start
+        ends = array('Q', accumulate(lengths))
+        ends.tofile(self._index)
+        self._line_start = ends[-1]
+
+    def flush(self):
+        """Make the written output visible to readers"""
+        self._file.flush()
+        index = self._index
+        index.seek(0)
+        index.write(array('Q', [self.max_length]).tobytes())
+        index.seek(0, os.SEEK_END)
+        index.flush()
+
+    def close(self):
+        if self._line_start < self._size:
+            self.write(b'\n')
+        self.flush()
+        self._file.close()
+        self._index.close()
+
+
+class MappedLog(LineReader):
+    """Read only access to a log file written by LogFile.
+
+    The file is memory mapped and lines are located with the index next to
+    it, so opening a log does not read its text. A missing or broken index
+    is rebuilt by scanning the file. Escape sequences are parsed when a
+    line is read, every line starts with the default style. max_length is
+    in bytes of the raw lines, which is an upper bound for the columns.
+    """
+    CACHE_LINES = 4096
+    SCAN_CHUNK = 1 << 22
+
+    def __init__(self, path, encoding='utf-8'):
+        self.path = path
+        self._encoding = encoding
+        self._file = open(path, 'rb')
+        self._map = None
+        self._size = 0
+        self._offsets = array('Q', [0])
+        self._parser = AnsiParser(encoding=encoding)
+        self._cache = {}
+        self.max_length = 0
+        self._load_index()
+        self.refresh()
+
+    def __len__(self):
+        return len(self._offsets) - 1
+
+    def _load_index(self):
+        try:
+            with open(self.path + INDEX_SUFFIX, 'rb') as f:
+                data = f.read()
+        except OSError:
+            return
+        index = array('Q')
+        index.frombytes(data[:len(data) // 8 * 8])
+        if len(index) < 2:
+            return
+        size = os.fstat(self._file.fileno()).st_size
+        last = len(index) - 1
+        while last and index[last] > size:
+            # the writer was ahead of the log file
+            last -= 1
+        if last:
+            self._file.seek(index[last] - 1)
+            if self._file.read(1) != b'\n':
+                return
+        self.max_length = index[0]
+        self._offsets.extend(index[1:last + 1])
+
+    def refresh(self) -> bool:
+        """Map output written after the last call, return True on new lines"""
+        size = os.fstat(self._file.fileno()).st_size
+        if size == self._size:
+            return False
+        count = len(self)
+        if size < self._size:
+            # the file was written again
+            self._offsets = array('Q', [0])
+            self._cache.clear()
+            self.max_length = count = 0
+        if self._map is not None:
+            self._map.close()
+        self._map = mmap.mmap(self._file.fileno(), 0, access=mmap.ACCESS_READ) if size else None
+        self._size = size
+        self._scan(self._offsets[-1], size)
+        return len(self) > count
+
+    def _scan(self, pos, end):
+        # index complete lines in pos..end
+        offsets = self._offsets
+        while pos < end:
+            chunk = self._map[pos:min(end, pos + self.SCAN_CHUNK)]
+            lengths = [len(part) + 1 for part in chunk.split(b'\n')[:-1]]
+            if lengths:
+                longest = max(max(lengths) - 1, pos + lengths[0] - 1 - offsets[-1])
+                if longest > self.max_length:
+                    self.max_length = longest
+                lengths[0] += pos
+                offsets.extend(accumulate(lengths))
+            pos += len(chunk)
+
+    def _parse(self, index):
+        cache = self._cache
+        item = cache.get(index)
+        if item is None:
+            offsets = self._offsets
+            data = self._map[offsets[index]:offsets[index + 1] - 1]
+            text = data.decode(self._encoding, 'replace')
+            if '\r' in text:
+                # keep what was drawn last over the line
+                text = text.rstrip('\r').rpartition('\r')[2]
+            if '\x1b' in text:
+                item = self._parser.parse_line(text)
+            else:
+                item = (text, ((0, 0),))
+            if len(cache) >= self.CACHE_LINES:
+                cache.clear()
+            cache[index] = item
+        return item
+
+    def line(self, index: int) -> str:
+        return self._parse(index)[0]
+
+    def raw_line(self, index: int) -> bytes:
+        """Return the bytes of the line without parsing it"""
+        offsets = self._offsets
+        return self._map[offsets[index]:offsets[index + 1] - 1]
+
+    def runs(self, index: int):
+        """Return list of (column, code) tuples for the line"""
+        return list(self._parse(index)[1])
+
+    def read(self, start: int, stop: int):
+        """Return list of (line, style) tuples for range start..stop"""
+        result = []
+        for i in range(max(0, start), min(len(self), stop)):
+            text, runs = self._parse(i)
+            result.append((text, runs[0][1] if len(runs) == 1 else runs))
+        return result
+
+    def close(self):
+        if self._map is not None:
+            self._map.close()
+            self._map = None
+        self._file.close()
+
+
+class LayeredLog(LineReader):
+    """Lines of a log file, which is being written, and lines written to
+    the view, in the order they arrived.
+
+    The lines already in the view are kept in base, which is any store with
+    read() and pop(). After them, entries has the line number in the mapped
+    file of each line or, for a line written with append() or extend(),
+    -1 - its index in a LogSegment. refresh() maps lines appended to the
+    file and collapses their progress lines with the collapser, so the line
+    numbers of the view are not those of the file.
+    """
+
+    FLATTEN_LINES = 10000
+
+    def __init__(self, path, base=None, collapser=None, encoding='utf-8'):
+        self.file = MappedLog(path, encoding=encoding)
+        self.base = base
+        self._collapser = collapser
+        self._written = LogSegment(encoding=encoding)
+        self._written_length = 0
+        self._entries = array('q')
+        self._mapped = 0
+        self.refresh()
+
+    def __len__(self):
+        return (len(self.base) if self.base is not None else 0) + len(self._entries)
+
+    @property
+    def max_length(self):
+        return max(getattr(self.base, 'max_length', 0), self.file.max_length,
+                   self._written_length)
+
+    def refresh(self) -> int:
+        """Add lines appended to the file.
+
+        Returns the number of lines, which were in the log before and were
+        replaced by progress lines of the file.
+        """
+        file = self.file
+        file.refresh()
+        count = len(file)
+        if count <= self._mapped:
+            return 0
+        collapser = self._collapser
+        if collapser is None:
+            self._entries.extend(range(self._mapped, count))
+            self._mapped = count
+            return 0
+        size = len(self)
+        popped = 0
+        for number in range(self._mapped, count):
+            # only lines with a percent sign can be progress lines
+            raw = file.raw_line(number)
+            if collapser.replaces(file.line(number) if b'%' in raw else '') and len(self):
+                self.pop()
+                if len(self) < size:
+                    size -= 1
+                    popped += 1
+            self._entries.append(number)
+        self._mapped = count
+        return popped
+
+    def append(self, line: str, style=0, runs=None):
+        if runs is not None:
+            style = tuple(runs)
+        written = self._written
+        self._entries.append(-1 - len(written))
+        written.append(line, style)
+        if len(line) > self._written_length:
+            self._written_length = len(line)
+
+    def extend(self, lines, style=0):
+        if not lines:
+            return
+        written = self._written
+        start = len(written)
+        written.extend(lines, style)
+        self._entries.extend(range(-1 - start, -1 - len(written), -1))
+        self._written_length = max(self._written_length, max(map(len, lines)))
+
+    def pop(self):
+        """Remove the last line, a line of the file stays in the file"""
+        if not self._entries:
+            self.base.pop()
+            return
+        number = self._entries.pop()
+        if number == -len(self._written):
+            self._written.pop()
+
+    def read(self, start: int, stop: int):
+        """Return list of (line, style) tuples for range start..stop"""
+        start = max(0, start)
+        stop = min(len(self), stop)
+        result = []
+        base_len = len(self.base) if self.base is not None else 0
+        if start < base_len:
+            result.extend(self.base.read(start, min(stop, base_len)))
+            start = base_len
+        entries = self._entries
+        i = start - base_len
+        end = stop - base_len
+        while i < end:
+            # read consecutive lines of the same store at once
+            first = number = entries[i]
+            j = i + 1
+            step = 1 if number >= 0 else -1
+            while j < end and entries[j] == number + step:
+                number += step
+                j += 1
+            if first >= 0:
+                result.extend(self.file.read(first, number + 1))
+            else:
+                result.extend(self._written.read(-1 - first, -number))
+            i = j
+        return result
+
+    def line(self, index: int) -> str:
+        return self.read(index, index + 1)[0][0]
+
+    def runs(self, index: int):
+        """Return list of (column, code) tuples for the line"""
+        style = self.read(index, index + 1)[0][1]
+        return [(0, style)] if isinstance(style, int) else list(style)
+
+    def flatten(self):
+        """Copy the lines to base, close the file and return base.
+
+        Base is a LogSegment, when there was none.
+        """
+        base = self.base if self.base is not None else LogSegment()
+        size = self.FLATTEN_LINES
+        for start in range(len(base), len(self), size):
+            for line, style in self.read(start, start + size):
+                base.append(line, style)
+        self.base = None
+        self.file.close()
+        self._written.close()
+        return base
+
+    def close(self):
+        self.file.close()
+        self._written.close()
+        close = getattr(self.base, 'close', None)
+        if close is not None:
+            close()
@@ -0,0 +1,454 @@
+from PyQt5.QtCore import (
+    Qt,
+    QPoint,
+    QTimer,
+    pyqtSignal,
+    pyqtSlot,
+)
+from PyQt5.QtGui import (
+    QColor,
+    QFont,
+    QKeySequence,
+    QPainter,
+    QPalette,
+)
+from PyQt5.QtWidgets import (
+    QAbstractScrollArea,
+    QApplication,
+)
+
+try:
+    from .ansi import AnsiParser, STYLES
+    from .fonts import cell_metrics, log_font
+    from .logstore import LayeredLog, LineStore
+    from .paintprofile import profiled
+    from .progress import ProgressCollapser
+    from .search import SearchIndex
+    from .textlog import ColorPalette, TAG_CODES
+except ImportError:
+    from ansi import AnsiParser, STYLES
+    from fonts import cell_metrics, log_font
+    from logstore import LayeredLog, LineStore
+    from paintprofile import profiled
+    from progress import ProgressCollapser
+    from search import SearchIndex
+    from textlog import ColorPalette, TAG_CODES
+
+
+def expand_tabs(line, runs, size):
+    """Expand tabs in the line and move the run columns accordingly"""
+    if '\t' not in line:
+        return line, runs
+    parts = []
+    new_runs = []
+    col = 0
+    ends = [c for c, _ in runs[1:]] + [len(line)]
+    for (start, code), end in zip(runs, ends):
+        # pad the piece to keep tab stops aligned with the full line
+        pad = col % size
+        text = ('.' * pad + line[start:end]).expandtabs(size)[pad:]
+        new_runs.append((col, code))
+        parts.append(text)
+        col += len(text)
+    return ''.join(parts), new_runs
+
+
+@profiled()
+class LogView(QAbstractScrollArea):
+    """Read only log view, which paints only the visible lines.
+
+    Lines are kept in a LineStore, so the cost of appending and scrolling
+    does not depend on the length of the log. Provides the same write and
+    setSize interface as the TextLogWidget. A log file can be shown after
+    the written lines with open_log(), its text stays on the disk.
+    """
+    PALETTE = ColorPalette
+    TAB_SIZE = 4
+    INDEX_LINES = 4096
+
+    copyAvailable = pyqtSignal(bool)
+    lines_indexed = pyqtSignal(int, list) # first line, texts
+    lines_truncated = pyqtSignal(int) # line count
+    pending_drained = pyqtSignal()
+
+    def __init__(self, parent=None, store=None, collapse_progress=True):
+        super().__init__(parent)
+        self._store = store if store is not None else LineStore()
+        self._parser = None
+        self._progress = ProgressCollapser() if collapse_progress else None
+        self._styles = {}
+        # written lines are indexed right away, an opened log file in slices
+        self._search = SearchIndex()
+        self._index_timer = timer = QTimer(self)
+        timer.timeout.connect(self._index_step)
+        if len(self._store):
+            timer.start()
+        # selection as (line, column) positions
+        self._anchor = None
+        self._cursor = None
+
+        self.setFont(log_font(self.font()))
+
+        # Background color and default font color
+        palette = self.palette()
+        palette.setColor(QPalette.Base, ColorPalette.BLACK.value)
+        palette.setColor(QPalette.Text, ColorPalette.WHITE.value)
+        self.setPalette(palette)
+
+        self.setFocusPolicy(Qt.StrongFocus)
+        self.viewport().setCursor(Qt.IBeamCursor)
+
+    @property
+    def store(self):
+        return self._store
+
+    @property
+    def line_count(self):
+        return len(self._store)
+
+    @property
+    def is_backlogged(self):
+        # lines are written to the store at once
+        return False
+
+    def setFont(self, font: QFont):
+        super().setFont(font)
+        self._bold_font = bold = QFont(font)
+        bold.setBold(True)
+        self._char_width, self._line_height, self._ascent = cell_metrics(font)
+        self._update_scrollbars()
+
+    def setSize(self, cols, rows):
+        self.setFixedSize(self._char_width*cols, self._line_height*rows)
+
+    def write(self, line, tag=None, runs=None, transient=False):
+        """Append a line with a palette tag or with (column, code) runs.
+
+        Transient line is replaced by the next line in progress mode.
+        """
+        bar = self.verticalScrollBar()
+        following = bar.value() == bar.maximum()
+        store = self._store
+        line = str(line).rstrip()
+        if self._progress and self._progress.replaces(line, transient) and len(store):
+            store.pop()
+            if len(self._search) > len(store):
+                self._search.pop()
+                self.lines_truncated.emit(len(store))
+        if runs is None:
+            line = line.expandtabs(self.TAB_SIZE)
+            store.append(line, TAG_CODES[tag])
+        else:
+            line, runs = expand_tabs(line, runs, self.TAB_SIZE)
+            store.append(line, runs=runs)
+        if len(self._search) == len(store) - 1:
+            self._search.append(line)
+            self.lines_indexed.emit(len(store) - 1, [line])
+        self._update_scrollbars()
+        if following and bar.value() != bar.maximum():
+            bar.setValue(bar.maximum()) # repaints via scrollContentsBy
+        elif len(store) - bar.value() <= self._visible_rows():
+            self.viewport().update()
+
+    def feed(self, data, final=False):
+        """Write raw output, which may contain ANSI escape sequences"""
+        parser = self._parser
+        if parser is None:
+            self._parser = parser = AnsiParser()
+        self.write_lines(parser.feed(data))
+        if final:
+            self.write_lines(parser.flush())
+
+    def write_lines(self, lines):
+        """Write parsed (text, runs, transient) lines"""
+        write = self.write
+        for line, runs, transient in lines:
+            write(line, runs=runs, transient=transient)
+
+    def open_log(self, path):
+        """Show a log file written by LogFile after the written lines.
+
+        Lines appended to the file are shown by reload() and lines written
+        after opening go after the lines of the file loaded so far. A file
+        opened before is copied to the store and closed.
+        """
+        bar = self.verticalScrollBar()
+        following = bar.value() == bar.maximum()
+        store = self._store
+        if isinstance(store, LayeredLog):
+            store = store.flatten()
+        self._store = LayeredLog(path, base=store, collapser=self._progress)
+        self._index_timer.start()
+        self._update_scrollbars()
+        if following:
+            bar.setValue(bar.maximum())
+        self.viewport().update()
+
+    @pyqtSlot()
+    def reload(self):
+        """Show lines appended to the opened log file"""
+        store = self._store
+        if not isinstance(store, LayeredLog):
+            return
+        bar = self.verticalScrollBar()
+        following = bar.value() == bar.maximum()
+        count = len(store)
+        popped = store.refresh()
+        if popped and len(self._search) > count - popped:
+            while len(self._search) > count - popped:
+                self._search.pop()
+            self.lines_truncated.emit(len(self._search))
+        if popped or len(store) != count:
+            self._index_timer.start()
+            self._update_scrollbars()
+            if following:
+                bar.setValue(bar.maximum())
+            self.viewport().update()
+
+    def _style(self, code):
+        # cached (foreground, background, font) for the style code
+        style = self._styles.get(code)
+        if style is None:
+            s = STYLES[code]
+            fg = QColor(s.fg) if s.fg else ColorPalette.WHITE.value
+            bg = QColor(s.bg) if s.bg else None
+            if s.inverse:
+                fg, bg = bg or ColorPalette.BLACK.value, fg
+            if s.bold or s.italic or s.underline:
+                font = QFont(self._bold_font if s.bold else self.font())
+                font.setItalic(s.italic)
+                font.setUnderline(s.underline)
+            else:
+                font = None
+            self._styles[code] = style = (fg, bg, font)
+        return style
+
+    def _visible_rows(self):
+        return max(1, self.viewport().height() // self._line_height)
+
+    def _update_scrollbars(self):
+        viewport = self.viewport()
+        rows = self._visible_rows()
+        vbar = self.verticalScrollBar()
+        vbar.setRange(0, max(0, len(self._store) - rows))
+        vbar.setPageStep(rows)
+        width = viewport.width()
+        hbar = self.horizontalScrollBar()
+        hbar.setRange(0, max(0, self._store.max_length * self._char_width - width))
+        hbar.setPageStep(width)
+        hbar.setSingleStep(self._char_width)
+
+    def resizeEvent(self, event):
+        super().resizeEvent(event)
+        self._update_scrollbars()
+
+    def scrollContentsBy(self, dx, dy):
+        self.viewport().update()
+
+    def paintEvent(self, event):
+        painter = QPainter(self.viewport())
+        rect = event.rect()
+        store = self._store
+        lh, cw, ascent = self._line_height, self._char_width, self._ascent
+        first = self.verticalScrollBar().value()
+        x0 = -self.horizontalScrollBar().value()
+        get_style = self._style
+        font = self.font()
+        selection = self._selection()
+        highlight = self.palette().highlight()
+
+        last_row = min(rect.bottom() // lh + 1, len(store) - first)
+        for row in range(rect.top() // lh, last_row):
+            index = first + row
+            y = row * lh
+            text = store.line(index)
+            if selection:
+                (l1, c1), (l2, c2) = selection
+                if l1 <= index <= l2:
+                    start = c1 if index == l1 else 0
+                    end = c2 if index == l2 else len(text) + 1
+                    painter.fillRect(x0 + start*cw, y, (end - start)*cw, lh, highlight)
+            runs = store.runs(index)
+            ends = [col for col, _ in runs[1:]] + [len(text)]
+            for (col, code), end in zip(runs, ends):
+                if end > col:
+                    fg, bg, style_font = get_style(code)
+                    if bg is not None:
+                        painter.fillRect(x0 + col*cw, y, (end - col)*cw, lh, bg)
+                    painter.setFont(style_font or font)
+                    painter.setPen(fg)
+                    painter.drawText(x0 + col*cw, y + ascent, text[col:end])
+
+    ## Selection
+
+    def _selection(self):
+        anchor, cursor = self._anchor, self._cursor
+        if anchor is None or anchor == cursor:
+            return None
+        return (anchor, cursor) if anchor < cursor else (cursor, anchor)
+
+    def _set_selection(self, anchor, cursor):
+        had = self._selection() is not None
+        self._anchor, self._cursor = anchor, cursor
+        has = self._selection() is not None
+        if had != has:
+            self.copyAvailable.emit(has)
+        self.viewport().update()
+
+    def _position_at(self, pos: QPoint):
+        store = self._store
+        if not len(store):
+            return (0, 0)
+        line = self.verticalScrollBar().value() + pos.y() // self._line_height
+        line = max(0, min(line, len(store) - 1))
+        col = round((pos.x() + self.horizontalScrollBar().value()) / self._char_width)
+        col = max(0, min(col, len(store.line(line))))
+        return (line, col)
+
+    def mousePressEvent(self, event):
+        if event.button() == Qt.LeftButton:
+            position = self._position_at(event.pos())
+            self._set_selection(position, position)
+        else:
+            super().mousePressEvent(event)
+
+    def mouseMoveEvent(self, event):
+        if event.buttons() & Qt.LeftButton and self._anchor is not None:
+            pos = event.pos()
+            bar = self.verticalScrollBar()
+            if pos.y() < 0:
+                bar.setValue(bar.value() - 1)
+            elif pos.y() > self.viewport().height():
+                bar.setValue(bar.value() + 1)
+            self._set_selection(self._anchor, self._position_at(pos))
+        else:
+            super().mouseMoveEvent(event)
+
+    def mouseDoubleClickEvent(self, event):
+        if event.button() == Qt.LeftButton and len(self._store):
+            line, _ = self._position_at(event.pos())
+            self._set_selection((line, 0), (line, len(self._store.line(line))))
+        else:
+            super().mouseDoubleClickEvent(event)
+
+    def keyPressEvent(self, event):
+        if event.matches(QKeySequence.Copy):
+            self.copy()
+        elif event.matches(QKeySequence.SelectAll):
+            self.selectAll()
+        else:
+            super().keyPressEvent(event)
+
+    def selectedText(self) -> str:
+        selection = self._selection()
+        if not selection:
+            return ''
+        (l1, c1), (l2, c2) = selection
+        return self._store.text(l1, c1, l2, c2)
+
+    @pyqtSlot()
+    def copy(self):
+        text = self.selectedText()
+        if text:
+            QApplication.clipboard().setText(text)
+
+    @pyqtSlot()
+    def selectAll(self):
+        store = self._store
+        if len(store):
+            last = len(store) - 1
+            self._set_selection((0, 0), (last, len(store.line(last))))
+
+    @pyqtSlot()
+    def clearSelection(self):
+        self._set_selection(None, None)
+
+    ## Search
+
+    def _index_more(self, limit):
+        # index lines of a given store or a log file, True when all are done
+        store = self._store
+        start = len(self._search)
+        stop = min(len(store), start + limit)
+        if stop > start:
+            lines = store.lines(start, stop)
+            self._search.extend(lines)
+            self.lines_indexed.emit(start, lines)
+        return stop >= len(store)
+
+    @pyqtSlot()
+    def _index_step(self):
+        if self._index_more(self.INDEX_LINES):
+            self._index_timer.stop()
+
+    def search(self, pattern: str, regex: bool = False):
+        """Return SearchResult with all matches in the log.
+
+        Raises re.error on an invalid regex.
+        """
+        store = self._store
+        if len(self._search) < len(store):
+            self._index_more(len(store))
+            self._index_timer.stop()
+        return self._search.find_all(pattern, store.lines, regex=regex)
+
+    def find(self, text: str, backward: bool = False, regex: bool = False) -> bool:
+        """Select the next match after the selection or the first visible line"""
+        if not text:
+            return False
+        result = self.search(text, regex=regex)
+        selection = self._selection()
+        if selection:
+            line, col = selection[0] if backward else selection[1]
+        else:
+            line, col = self.verticalScrollBar().value(), 0
+        i = result.next(line, col, backward=backward)
+        if i is None:
+            return False
+        self.show_match(*result[i])
+        return True
+
+    def show_match(self, line: int, col: int, length: int):
+        """Select text on the line and scroll it visible"""
+        self._set_selection((line, col), (line, col + length))
+        self.ensureVisible(line, col)
+
+    def ensureVisible(self, line, col=0):
+        vbar = self.verticalScrollBar()
+        rows = self._visible_rows()
+        if line < vbar.value():
+            vbar.setValue(line)
+        elif line >= vbar.value() + rows:
+            vbar.setValue(line - rows + 1)
+        hbar = self.horizontalScrollBar()
+        x = col * self._char_width
+        if x < hbar.value() or x >= hbar.value() + self.viewport().width():
+            hbar.setValue(x - self.viewport().width() // 2)
+
+
+if __name__ == '__main__':
+    import sys, random
+    from time import perf_counter
+    
+    app = QApplication(sys.argv)
+
+    view = LogView()
+    view.setWindowTitle("Test for LogView")
+    view.setSize(80, 20)
+
+    start = perf_counter()
+    for i in range(1000000):
+        view.write("checking consistency... module%02d/chapter%02d line %d" % (
+            i % 97, i % 13, i),
+            ColorPalette.RED if i % 11 == 0 else None)
+    print("1M lines written in %.2fs" % (perf_counter() - start,))
+
+    def write():
+        view.write(random.choice(("Jotain sinistä", "Jotain punaista")),
+                   random.choice((ColorPalette.BLUE, ColorPalette.RED)))
+        view.feed(b"copying static files... \x1b[32mdone\x1b[39;49;00m\n")
+        QTimer.singleShot(200, write)
+    write()
+
+    view.show()
+    sys.exit(app.exec_())
@@ -0,0 +1,225 @@
+"""
+Profiling of paint methods of custom widgets.
+
+A class opts in with the profiled class decorator. When profiling is
+enabled, the paint methods of the registered classes are replaced with
+wrappers, which time each call into a ring buffer of the widget. When it
+is disabled, the original methods are in place, so there is no cost.
+
+Profiling is enabled at start with the environment variable
+ROMAN_PAINT_PROFILE=1 or later with enable(). sip remembers, that a class
+has no Python paintEvent, so a widget, which inherits the method from Qt
+and was created before enable(), is not timed.
+"""
+import json
+import os
+from collections import deque
+from functools import wraps
+from time import perf_counter
+
+from PyQt5.QtCore import (
+    Qt,
+    QTimer,
+)
+from PyQt5.QtWidgets import (
+    QFileDialog,
+    QHBoxLayout,
+    QPushButton,
+    QTableWidget,
+    QTableWidgetItem,
+    QVBoxLayout,
+    QWidget,
+)
+
+
+RING_SIZE = 240
+_registered = [] # (class, method name)
+_originals = {} # (class, method name): method in the class dict or None
+_buffers = {} # widget label: deque of seconds
+_enabled = False
+
+
+def profiled(*methods):
+    """Class decorator, which registers the paint methods of the class.
+
+    The default method is paintEvent.
+    """
+    def register(cls):
+        for name in methods or ('paintEvent',):
+            _registered.append((cls, name))
+            if _enabled:
+                _wrap(cls, name)
+        return cls
+    return register
+
+
+def _label(obj):
+    name = obj.objectName()
+    return '%s %s' % (type(obj).__name__, name or '@%x' % (id(obj),))
+
+
+def _wrap(cls, name):
+    key = (cls, name)
+    if key in _originals:
+        return
+    _originals[key] = cls.__dict__.get(name)
+    method = getattr(cls, name)
+
+    @wraps(method)
+    def timed(self, *args):
+        start = perf_counter()
+        try:
+            return method(self, *args)
+        finally:
+            label = _label(self)
+            buffer = _buffers.get(label)
+            if buffer is None:
+                buffer = _buffers[label] = deque(maxlen=RING_SIZE)
+            buffer.append(perf_counter() - start)
+    setattr(cls, name, timed)
+
+
+def enable():
+    global _enabled
+    _enabled = True
+    for cls, name in _registered:
+        _wrap(cls, name)
+
+
+def disable():
+    global _enabled
+    _enabled = False
+    for (cls, name), original in _originals.items():
+        if original is None:
+            delattr(cls, name)
+        else:
+            setattr(cls, name, original)
+    _originals.clear()
+
+
+def is_enabled():
+    return _enabled
+
+
+def reset():
+    _buffers.clear()
+
+
+def percentile(ordered, fraction):
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def stats():
+    """Return {widget label: {count, mean, p50, p95, p99, max}} in ms"""
+    result = {}
+    for label, buffer in list(_buffers.items()):
+        ordered = sorted(buffer)
+        if not ordered:
+            continue
+        result[label] = {
+            'count': len(ordered),
+            'mean': sum(ordered) / len(ordered) * 1000,
+            'p50': percentile(ordered, 0.50) * 1000,
+            'p95': percentile(ordered, 0.95) * 1000,
+            'p99': percentile(ordered, 0.99) * 1000,
+            'max': ordered[-1] * 1000,
+        }
+    return result
+
+
+def dump(path=None):
+    """Return the stats as JSON and write them to path, if given"""
+    data = json.dumps(stats(), indent=1, sort_keys=True)
+    if path:
+        with open(path, 'w', encoding='utf-8') as f:
+            f.write(data)
+    return data
+
+
+class PaintProfilerPanel(QWidget):
+    """Table of the paint times of the profiled widgets.
+
+    The table is refreshed every REFRESH_MS, while the panel is visible.
+    """
+    COLUMNS = ("Widget", "Paints", "Mean ms", "p50 ms", "p95 ms", "p99 ms", "Max ms")
+    FIELDS = ('count', 'mean', 'p50', 'p95', 'p99', 'max')
+    REFRESH_MS = 1000
+
+    def __init__(self, parent=None):
+        super().__init__(parent, Qt.Window)
+        self.setWindowTitle("Paint profile")
+        self.table = table = QTableWidget(0, len(self.COLUMNS))
+        table.setHorizontalHeaderLabels(self.COLUMNS)
+        table.setSortingEnabled(True)
+        table.verticalHeader().hide()
+
+        self._toggle = toggle = QPushButton()
+        toggle.setCheckable(True)
+        toggle.toggled.connect(self._set_enabled)
+        clear = QPushButton("Reset")
+        clear.clicked.connect(self._reset)
+        save = QPushButton("Save JSON...")
+        save.clicked.connect(self._save)
+
+        buttons = QHBoxLayout()
+        buttons.addWidget(toggle)
+        buttons.addWidget(clear)
+        buttons.addStretch(1)
+        buttons.addWidget(save)
+        layout = QVBoxLayout()
+        layout.addWidget(table)
+        layout.addLayout(buttons)
+        self.setLayout(layout)
+        toggle.setChecked(is_enabled())
+        self._update_toggle()
+
+        self._timer = QTimer(self)
+        self._timer.setInterval(self.REFRESH_MS)
+        self._timer.timeout.connect(self.refresh)
+
+    def showEvent(self, event):
+        super().showEvent(event)
+        self.refresh()
+        self._timer.start()
+
+    def hideEvent(self, event):
+        super().hideEvent(event)
+        self._timer.stop()
+
+    def _update_toggle(self):
+        self._toggle.setText("Profiling on" if is_enabled() else "Profiling off")
+
+    def _set_enabled(self, enabled):
+        if enabled:
+            enable()
+        else:
+            disable()
+        self._update_toggle()
+
+    def _reset(self):
+        reset()
+        self.refresh()
+
+    def _save(self):
+        path, _ = QFileDialog.getSaveFileName(self, "Save paint profile", "paint-profile.json",
+                                              "JSON (*.json)")
+        if path:
+            dump(path)
+
+    def refresh(self):
+        table = self.table
+        data = stats()
+        table.setSortingEnabled(False)
+        table.setRowCount(len(data))
+        for row, (label, values) in enumerate(sorted(data.items())):
+            table.setItem(row, 0, QTableWidgetItem(label))
+            for col, field in enumerate(self.FIELDS, 1):
+                item = QTableWidgetItem()
+                value = values[field]
+                item.setData(Qt.DisplayRole, value if field == 'count' else round(value, 3))
+                table.setItem(row, col, item)
+        table.setSortingEnabled(True)
+
+
+if os.environ.get('ROMAN_PAINT_PROFILE') not in (None, '', '0'):
+    enable()
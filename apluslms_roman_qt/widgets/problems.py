@@ -0,0 +1,273 @@
+"""
+Warnings and errors found in the step logs.
+
+Lines are matched as the log widgets index them, so the problems list
+grows with the output and every problem knows its line in the log.
+"""
+import re
+from collections import namedtuple
+from enum import IntEnum
+
+from PyQt5.QtCore import (
+    QAbstractTableModel,
+    QModelIndex,
+    QSortFilterProxyModel,
+    Qt,
+    pyqtSignal,
+)
+from PyQt5.QtWidgets import (
+    QComboBox,
+    QHBoxLayout,
+    QLabel,
+    QStyle,
+    QTreeView,
+    QVBoxLayout,
+    QWidget,
+)
+
+
+# e.g. "/src/course/index.rst:12: WARNING: Unknown target name"
+# or "/src/course/index.rst:12: (ERROR/3) Unexpected indentation."
+PROBLEM_RE = re.compile(
+    r'(?:(?P<path>[^\s:\[][^\s:]*(?::docstring of [^:]+)?)(?::(?P<line>\d*))?:\s+)?'
+    r'(?:\((?P<level>[A-Z]+)/\d\)|(?P<severity>CRITICAL|SEVERE|ERROR|WARNING)):?\s+'
+    r'(?P<message>\S.*)')
+# cheap test before the full pattern
+PROBLEM_HINT_RE = re.compile(r'WARNING|ERROR|SEVERE|CRITICAL')
+
+
+class Severity(IntEnum):
+    WARNING = 1
+    ERROR = 2
+
+    @classmethod
+    def from_name(cls, name):
+        return cls.WARNING if name == 'WARNING' else cls.ERROR
+
+
+Problem = namedtuple('Problem', 'step line length severity path source_line message')
+
+
+def match_problem(text: str):
+    """Return (severity, path, source line, message) or None"""
+    if not PROBLEM_HINT_RE.search(text):
+        return None
+    match = PROBLEM_RE.match(text)
+    if not match:
+        return None
+    name = match.group('severity') or match.group('level')
+    if name not in ('WARNING', 'ERROR', 'SEVERE', 'CRITICAL'):
+        return None
+    line = match.group('line')
+    return (Severity.from_name(name), match.group('path'),
+            int(line) if line else None, match.group('message'))
+
+
+class ProblemList:
+    """Problems of all steps with indexes by file, severity and step.
+
+    Problems are kept in the order they were found. Problems of a step
+    are removed with truncate(), when lines of its log are removed.
+    """
+
+    def __init__(self):
+        self.problems = []
+        self._by_file = {}
+        self._by_severity = {}
+        self._by_step = {}
+
+    def __len__(self):
+        return len(self.problems)
+
+    def __getitem__(self, i):
+        return self.problems[i]
+
+    def _add_to_indexes(self, i, problem):
+        self._by_file.setdefault(problem.path, []).append(i)
+        self._by_severity.setdefault(problem.severity, []).append(i)
+        self._by_step.setdefault(problem.step, []).append(i)
+
+    @staticmethod
+    def match_lines(step: int, start: int, lines):
+        """Return problems on lines start.. of the step log"""
+        found = []
+        for i, text in enumerate(lines, start):
+            match = match_problem(text)
+            if match:
+                found.append(Problem(step, i, len(text), *match))
+        return found
+
+    def extend(self, problems):
+        for problem in problems:
+            self._add_to_indexes(len(self.problems), problem)
+            self.problems.append(problem)
+
+    def truncate(self, step: int, count: int):
+        """Remove problems on lines count.. of the step log.
+
+        Returns the list of removed positions in ascending order.
+        """
+        positions = [i for i in self._by_step.get(step, ())
+                     if self.problems[i].line >= count]
+        if positions:
+            removed = set(positions)
+            self.problems = [p for i, p in enumerate(self.problems) if i not in removed]
+            self._by_file.clear()
+            self._by_severity.clear()
+            self._by_step.clear()
+            for i, problem in enumerate(self.problems):
+                self._add_to_indexes(i, problem)
+        return positions
+
+    def by_file(self, path):
+        return [self.problems[i] for i in self._by_file.get(path, ())]
+
+    def by_severity(self, severity: Severity):
+        return [self.problems[i] for i in self._by_severity.get(severity, ())]
+
+    def by_step(self, step: int):
+        return [self.problems[i] for i in self._by_step.get(step, ())]
+
+    def files(self):
+        return [path for path in self._by_file if path is not None]
+
+    def count(self, severity: Severity) -> int:
+        return len(self._by_severity.get(severity, ()))
+
+
+class ProblemsModel(QAbstractTableModel):
+    """Table model over a ProblemList"""
+    COLUMNS = ("Severity", "Step", "File", "Line", "Message")
+    ProblemRole = Qt.UserRole + 1
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.problems = ProblemList()
+        self.step_names = {}
+        style = parent.style() if parent is not None else None
+        self._icons = {
+            Severity.WARNING: style.standardIcon(QStyle.SP_MessageBoxWarning),
+            Severity.ERROR: style.standardIcon(QStyle.SP_MessageBoxCritical),
+        } if style else {}
+
+    def rowCount(self, parent=QModelIndex()):
+        return 0 if parent.isValid() else len(self.problems)
+
+    def columnCount(self, parent=QModelIndex()):
+        return len(self.COLUMNS)
+
+    def headerData(self, section, orientation, role=Qt.DisplayRole):
+        if orientation == Qt.Horizontal and role == Qt.DisplayRole:
+            return self.COLUMNS[section]
+        return None
+
+    def data(self, index, role=Qt.DisplayRole):
+        if not index.isValid():
+            return None
+        problem = self.problems[index.row()]
+        column = index.column()
+        if role == Qt.DisplayRole:
+            if column == 0:
+                return problem.severity.name.capitalize()
+            if column == 1:
+                return self.step_names.get(problem.step, str(problem.step + 1))
+            if column == 2:
+                return problem.path or ""
+            if column == 3:
+                return problem.source_line
+            return problem.message
+        if role == Qt.DecorationRole and column == 0:
+            return self._icons.get(problem.severity)
+        if role == Qt.ToolTipRole:
+            return problem.message
+        if role == self.ProblemRole:
+            return problem
+        return None
+
+    def add_lines(self, step, start, lines):
+        found = ProblemList.match_lines(step, start, lines)
+        if found:
+            first = len(self.problems)
+            self.beginInsertRows(QModelIndex(), first, first + len(found) - 1)
+            self.problems.extend(found)
+            self.endInsertRows()
+
+    def truncate(self, step, count):
+        if any(p.line >= count for p in self.problems.by_step(step)):
+            self.beginResetModel()
+            self.problems.truncate(step, count)
+            self.endResetModel()
+
+    def clear(self):
+        self.beginResetModel()
+        self.problems = ProblemList()
+        self.endResetModel()
+
+
+class ProblemsPanel(QWidget):
+    """List of problems in the step logs with a severity filter.
+
+    Emits problem_activated with the step and the log line of a clicked
+    problem.
+    """
+    problem_activated = pyqtSignal(int, int, int) # step, line, length
+
+    def __init__(self, parent=None):
+        super().__init__(parent)
+        self.model = model = ProblemsModel(self)
+        self._proxy = proxy = QSortFilterProxyModel(self)
+        proxy.setSourceModel(model)
+        proxy.setFilterKeyColumn(0)
+
+        self._filter = filter_ = QComboBox()
+        filter_.addItems(("All", "Errors", "Warnings"))
+        filter_.currentIndexChanged.connect(self._set_filter)
+        self._summary = QLabel()
+        model.rowsInserted.connect(self._update_summary)
+        model.modelReset.connect(self._update_summary)
+
+        self.view = view = QTreeView()
+        view.setModel(proxy)
+        view.setRootIsDecorated(False)
+        view.setUniformRowHeights(True)
+        view.setAlternatingRowColors(True)
+        view.setSortingEnabled(True)
+        view.sortByColumn(-1, Qt.AscendingOrder)
+        view.activated.connect(self._activated)
+        view.clicked.connect(self._activated)
+
+        top = QHBoxLayout()
+        top.setContentsMargins(0, 0, 0, 0)
+        top.addWidget(self._summary, 1)
+        top.addWidget(filter_)
+        layout = QVBoxLayout()
+        layout.setContentsMargins(0, 0, 0, 0)
+        layout.addLayout(top)
+        layout.addWidget(view)
+        self.setLayout(layout)
+        self._update_summary()
+
+    def attach(self, step, log):
+        """Match lines indexed by the log widget of the step"""
+        log.lines_indexed.connect(lambda start, lines: self.model.add_lines(step, start, lines))
+        log.lines_truncated.connect(lambda count: self.model.truncate(step, count))
+
+    def set_step_names(self, names):
+        self.model.step_names = dict(enumerate(names))
+
+    def clear(self):
+        self.model.clear()
+
+    def _set_filter(self, index):
+        pattern = ("", "Error", "Warning")[index]
+        self._proxy.setFilterFixedString(pattern)
+
+    def _update_summary(self, *args):
+        problems = self.model.problems
+        self._summary.setText("%d errors, %d warnings" % (
+            problems.count(Severity.ERROR), problems.count(Severity.WARNING)))
+
+    def _activated(self, index):
+        problem = self._proxy.data(index, ProblemsModel.ProblemRole)
+        if problem is not None:
+            self.problem_activated.emit(problem.step, problem.line, problem.length)
@@ -3,11 +3,13 @@ from time import perf_counter
 
 from PyQt5.QtCore import (
     Qt,
+    QEvent,
     QSize,
     pyqtSignal,
     pyqtSlot,
 
     QRect,
+    QRectF,
     QPointF,
     QVariantAnimation,
 )
@@ -19,8 +21,11 @@ from PyQt5.QtGui import (
     QPainterPath,
     QBrush,
     QColor,
+    QFont,
     QLinearGradient,
     QPen,
+    QPixmap,
+    QPolygonF,
     QRegion,
 
     QPaintEvent,
@@ -33,14 +38,17 @@ from PyQt5.QtWidgets import (
     QWidget,
     QStyle,
     QSizePolicy,
+    QToolTip,
 )
 
 try:
     from .fancytabbar import FancyTab
-    from .animations import Animation, RotatingIcon, LoadingDots
+    from .animations import Animation, AnimationClock, RotatingIcon, LoadingDots
+    from .paintprofile import profiled
 except ImportError:
     from fancytabbar import FancyTab
-    from animations import Animation, RotatingIcon, LoadingDots
+    from animations import Animation, AnimationClock, RotatingIcon, LoadingDots
+    from paintprofile import profiled
 
 
 def create_gradient(color, darker=300):
@@ -81,9 +89,17 @@ class ProcessTab(FancyTab):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self.state = State.UNKNOWN
+        # cpu use of the step, see set_step_usage
+        self.samples = ()
+        self.usage = None
+        # estimated part done of a running step
+        self.progress = None
 
     def update(self, *args):
-        self._tabbar.update(*args)
+        if args:
+            self._tabbar.update(*args)
+        else:
+            self._tabbar.update_tab(self)
 
     def setState(self, state):
         if state == State.ACTIVE:
@@ -98,8 +114,13 @@ class ProcessTab(FancyTab):
     def get_color(self, active):
         return self.state.get_color(active)
 
+@profiled()
 class ProcessTabBar(QWidget):
     ANIMATION_FRAMES = 30
+    # tab backgrounds and labels are drawn once to pixmaps, which are kept
+    # until the next resize, only the animated parts are painted each frame
+    PIXMAP_CACHE = True
+    PIXMAP_MARGIN = 2
 
     process_started = pyqtSignal()
     step_started = pyqtSignal(int) # index
@@ -118,20 +139,96 @@ class ProcessTabBar(QWidget):
         self.process_completed.connect(anim.stop)
         self.process_started.connect(anim.start)
         anim.tick.connect(self._update_active)
-        self._active_box = None
+
+        self.remaining = None
 
         self.setSizePolicy(QSizePolicy.MinimumExpanding, QSizePolicy.Maximum)
         self.setMinimumSize(64, 32)
         self.setMaximumHeight(64)
+        self.resizeEvent(None)
+
+    def _tab_rect(self, index):
+        # area of the tab including the arrow over the next tab,
+        # -1 is the first button, rects are computed in resizeEvent
+        return self._tab_rects[index + 1]
+
+    def _update_tabs(self, indexes):
+        region = QRegion()
+        for index in indexes:
+            region += self._tab_rect(index)
+        if not region.isEmpty():
+            self.update(region)
+
+    def update_tab(self, tab):
+        """Repaint only the area of the tab"""
+        try:
+            self._update_tabs((self.states.index(tab),))
+        except ValueError:
+            pass
 
     def _update_active(self):
-        if self._active_box:
-            self.update(self._active_box)
+        # several steps may run at the same time, the clock merges the
+        # updates of all animations of the frame
+        clock = AnimationClock.instance()
+        for i, state in enumerate(self.states[:self.num_tabs]):
+            if state.state == State.ACTIVE:
+                clock.request_update(self, self._tab_rect(i))
 
-    def set_tab_count(self, num):
+    def set_tab_count(self, num, names=None):
         self.num_tabs = num
-        names = ("Prepare", "apluslms/compile-ariel", "apluslms/compile-jsvee", "Validate", None, None, None)
+        if names is None:
+            names = ("Prepare", "apluslms/compile-ariel", "apluslms/compile-jsvee", "Validate")
+        names = list(names)[:num]
+        names += [None] * (num + 1 - len(names))
         self.states = [ProcessTab(self, text=names[i]) for i in range(num+1)]
+        self.resizeEvent(None)
+        self.update()
+
+    def set_step_usage(self, num, samples, summary):
+        """Show cpu use samples as a sparkline and the summary as a tooltip"""
+        if 0 <= num < self.num_tabs:
+            tab = self.states[num]
+            tab.samples = tuple(samples)
+            tab.usage = summary
+            self._update_tabs((num,))
+
+    def set_step_progress(self, num, progress):
+        """Fill the given part of the tab, None when there is no estimate"""
+        if 0 <= num < self.num_tabs and self.states[num].progress != progress:
+            self.states[num].progress = progress
+            self._update_tabs((num,))
+
+    def set_remaining(self, seconds):
+        """Show the estimated time left on the first button"""
+        if seconds is not None:
+            seconds = int(seconds + 0.5)
+        if seconds != self.remaining:
+            self.remaining = seconds
+            self._update_tabs((-1,))
+
+    def event(self, event):
+        if event.type() == QEvent.ToolTip:
+            index = self.item_at(event.pos())
+            tab = self.states[index] if 0 <= index < self.num_tabs else None
+            if tab is not None and tab.usage:
+                QToolTip.showText(event.globalPos(), tab.usage, self)
+            else:
+                QToolTip.hideText()
+                event.ignore()
+            return True
+        return super().event(event)
+
+    def _paint_sparkline(self, painter, samples, box):
+        # the scale is at least one full core
+        top = max(1.0, max(samples))
+        step = box.width() / max(1, len(samples) - 1)
+        points = [QPointF(box.left() + i * step, box.bottom() - box.height() * value / top)
+                  for i, value in enumerate(samples)]
+        painter.save()
+        painter.setPen(QPen(QColor(255, 255, 255, 200), 1))
+        painter.setBrush(Qt.NoBrush)
+        painter.drawPolyline(QPolygonF(points))
+        painter.restore()
 
     def item_at(self, position):
         arrow_width = self._arrow_width
@@ -155,11 +252,52 @@ class ProcessTabBar(QWidget):
         super().update(*args)
         print("update request for:", *args)
 
+    def _draw_cached(self, painter, key, size, paint):
+        """Draw what paint(painter) draws within size using a cached pixmap"""
+        if not self.PIXMAP_CACHE:
+            paint(painter)
+            return
+        dpr = self.devicePixelRatioF()
+        key += (size.width(), size.height(), dpr)
+        pixmap = self._pixmaps.get(key)
+        if pixmap is None:
+            # the outline is drawn half outside of the shape
+            margin = self.PIXMAP_MARGIN
+            full = QSize(size.width() + 2 * margin, size.height() + 2 * margin)
+            pixmap = QPixmap(full * dpr)
+            pixmap.setDevicePixelRatio(dpr)
+            pixmap.fill(Qt.transparent)
+            pixmap_painter = QPainter(pixmap)
+            pixmap_painter.translate(margin, margin)
+            paint(pixmap_painter)
+            pixmap_painter.end()
+            self._pixmaps[key] = pixmap
+        margin = self.PIXMAP_MARGIN
+        painter.drawPixmap(QPointF(-margin, -margin), pixmap)
+
+    def _draw_shape(self, key, size, path, brush):
+        def paint(painter):
+            painter.setPen(self._outline_pen)
+            painter.setBrush(brush)
+            painter.drawPath(path)
+        return key, size, paint
+
+    def _draw_label(self, text, box):
+        def paint(painter):
+            painter.setPen(self._outline_pen)
+            painter.setFont(self._title_font)
+            painter.drawText(box, Qt.AlignCenter | Qt.AlignVCenter, text)
+        return ('label', text), QSize(box.right() + 1, box.bottom() + 1), paint
+
     def resizeEvent(self, event):
+        self._pixmaps = {}
         height = self.height()
         self._arrow_width = arrow_width = height / 2
         self._first_button_width = first_width = height
         self._button_width = width = (self.width() - first_width) / (self.num_tabs + 1)
+        self._tab_rects = [QRect(0, 0, int(first_width + arrow_width) + 1, height)] + [
+            QRect(int(first_width + i * width), 0, int(width + arrow_width) + 1, height)
+            for i in range(self.num_tabs + 1)]
 
         self._first_button_path = fbutton = QPainterPath()
         fbutton.lineTo(first_width, 0)
@@ -181,9 +319,7 @@ class ProcessTabBar(QWidget):
         lbutton.lineTo(0, height)
         fbutton.closeSubpath()
 
-    _paint_times = None
     def paintEvent(self, event: QPaintEvent):
-        _start = perf_counter()
         num = self.num_tabs
         selected = self.selected
         arrow_width = self._arrow_width
@@ -191,11 +327,11 @@ class ProcessTabBar(QWidget):
         width = self._button_width
         first_width = self._first_button_width
         button = self._button_path
-        button_box = QRect(0, 0, width + arrow_width, height)
-        first_box = QRect(0, 0, first_width + arrow_width, height)
-        icon_area = QRect(arrow_width + 10, 0, max(48, width/2), height)
-        text_box = QRect(arrow_width, 0, width-arrow_width, height)
-        text_flags = Qt.AlignCenter | Qt.AlignVCenter
+        button_box = QRect(0, 0, int(width + arrow_width), height)
+        first_box = QRect(0, 0, int(first_width + arrow_width), height)
+        icon_area = QRect(int(arrow_width) + 10, 0, int(max(48, width/2)), height)
+        text_box = QRect(int(arrow_width), 0, int(width-arrow_width), height)
+        spark_box = QRect(int(arrow_width), height * 3 // 4, int(width - arrow_width * 1.5), height // 5)
         states = self.states
 
         painter = QPainter(self)
@@ -206,25 +342,43 @@ class ProcessTabBar(QWidget):
         #for rect in event.region().rects():
         #    print(" -  ", rect)
         #painter.setPen(Qt.NoPen)
-        painter.setPen(QPen(Qt.black, 2, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin))
-        titleFont = painter.font()
+        self._outline_pen = QPen(Qt.black, 2, Qt.SolidLine, Qt.RoundCap, Qt.RoundJoin)
+        painter.setPen(self._outline_pen)
+        self._title_font = titleFont = QFont(self.font())
         titleFont.setPointSizeF(14)
         titleFont.setBold(True)
         painter.setFont(titleFont)
+        draw_cached = self._draw_cached
+        draw_shape = self._draw_shape
+        box_size = QSize(int(width + arrow_width) + 1, height)
 
         painter.translate(num * width + first_width, 0)
 
         if region.intersects(painter.transform().mapRect(button_box)):
-            painter.setBrush(states[num].get_color(num == selected))
-            painter.drawPath(self._last_button_path)
+            state = states[num]
+            draw_cached(painter, *draw_shape(
+                ('last', state.state, num == selected), box_size,
+                self._last_button_path, state.get_color(num == selected)))
 
         for i in reversed(range(num)):
             painter.translate(-width, 0)
             if not region.intersects(painter.transform().mapRect(button_box)):
                 continue
 
-            painter.setBrush(states[i].get_color(i == selected))
-            painter.drawPath(button)
+            state = states[i]
+            draw_cached(painter, *draw_shape(
+                ('tab', state.state, i == selected), box_size,
+                button, state.get_color(i == selected)))
+
+            progress = states[i].progress
+            if progress is not None and states[i].state == State.ACTIVE:
+                painter.save()
+                painter.setPen(Qt.NoPen)
+                painter.setBrush(QColor(255, 255, 255, 60))
+                painter.setClipRect(QRectF(0, 0, (width + arrow_width) * progress, height),
+                                    Qt.IntersectClip)
+                painter.drawPath(button)
+                painter.restore()
 
             if states[i].state == State.ACTIVE:
                 painter.save()
@@ -243,41 +397,45 @@ class ProcessTabBar(QWidget):
                 #painter.drawPath(button)
                 #painter.setClipRect(0, height-gradient_height, width+self._arrow_width, gradient_height)
                 painter.drawPath(button)
-                self._active_box = painter.transform().mapRect(button_box)
                 painter.restore()
 
             #if states[i].icon:
             #    states[i].icon.paint(painter, icon_area)
 
+            if len(states[i].samples) > 1:
+                self._paint_sparkline(painter, states[i].samples, spark_box)
+
             text = states[i].text
             if text:
                 _, _, short = text.rpartition('-')
-                painter.drawText(text_box, text_flags, short.capitalize())
+                draw_cached(painter, *self._draw_label(short.capitalize(), text_box))
 
         if region.intersects(first_box):
             painter.resetTransform()
-            painter.setBrush(State.UNKNOWN.get_color(-1 == selected))
-            painter.drawPath(self._first_button_path)
+            draw_cached(painter, *draw_shape(
+                ('first', -1 == selected), QSize(int(first_width + arrow_width) + 1, height),
+                self._first_button_path, State.UNKNOWN.get_color(-1 == selected)))
 
             if self.is_running:
                 icon = self.style().standardIcon(QStyle.SP_MediaStop)
             else:
                 icon = self.style().standardIcon(QStyle.SP_MediaPlay)
 
-            size = min(self._first_button_width, self.height())*0.8
+            size = int(min(self._first_button_width, self.height())*0.8)
+            painter.save()
             painter.translate(5, (self.height()-size)/2)
             icon.paint(painter, QRect(0, 0, size, size))
-
-        _end = perf_counter()
-        if not self._paint_times:
-            self._paint_times = times = []
-        else:
-            times = self._paint_times
-        times.append(_end - _start)
-        if len(times) > 60:
-            avg = sum(times) / len(times) * 1000000
-            print("Average render time %.2fns" % (avg,))
-            self._paint_times = None
+            painter.restore()
+
+            if self.remaining is not None and self.is_running:
+                minutes, seconds = divmod(self.remaining, 60)
+                font = painter.font()
+                font.setPointSizeF(8)
+                painter.setFont(font)
+                painter.setPen(Qt.white)
+                painter.drawText(QRect(0, 0, int(first_width), height - 2),
+                                 Qt.AlignHCenter | Qt.AlignBottom,
+                                 "%d:%02d" % (minutes, seconds))
 
     def mousePressEvent(self, event):
         if event.button() == Qt.LeftButton:
@@ -292,20 +450,26 @@ class ProcessTabBar(QWidget):
                     self.start()
 
     def select_tab(self, index):
-        self.selected = index
-        self.update()
+        previous, self.selected = self.selected, index
+        self._update_tabs(i for i in (previous, index)
+                          if i is not None and -1 <= i <= self.num_tabs)
         self.tab_selected.emit(index)
 
     @property
     def is_running(self):
-        return self._icon._animator.loopCount() == -1
+        return self._icon.is_running
 
     def complete(self, stopped=False):
         self._icon.stop()
-        unknown = any(s.state == State.UNKNOWN for s in self.states[:-1])
-        success = not stopped and all(s == State.SUCCESS for s in self.states[:-1])
-        self.states[-1].setState(State.UNKNOWN if unknown else State.SUCCESS if success else State.FAILURE)
-        self.update()
+        states = [s.state for s in self.states[:-1]]
+        success = not stopped and all(s == State.SUCCESS for s in states)
+        if success or stopped or State.FAILURE in states:
+            state = State.SUCCESS if success else State.FAILURE
+        else:
+            state = State.UNKNOWN
+        self.states[-1].setState(state)
+        # the first button shows play again
+        self._update_tabs((-1, self.num_tabs))
         self.process_completed.emit(success)
 
     def stop(self):
@@ -314,14 +478,21 @@ class ProcessTabBar(QWidget):
         for i, state in enumerate(self.states):
             if state.state == State.ACTIVE:
                 self.states[i].setState(State.FAILURE)
+                self._update_tabs((i,))
 
     def start(self):
         self._icon.start()
 
-        # reset states
-        for state in self.states:
+        # reset states, only changed tabs and the first button are repainted
+        changed = [-1]
+        for i, state in enumerate(self.states):
+            if state.state != State.UNKNOWN or state.samples or state.progress is not None:
+                changed.append(i)
             state.setState(State.UNKNOWN)
-        self.update()
+            state.samples = ()
+            state.usage = None
+            state.progress = None
+        self._update_tabs(changed)
 
         # global
         self.process_started.emit()
@@ -329,7 +500,7 @@ class ProcessTabBar(QWidget):
     def start_step(self, num):
         if 0 <= num < self.num_tabs:
             self.states[num].setState(State.ACTIVE)
-            self.update()
+            self._update_tabs((num,))
             self.step_started.emit(num)
         elif num == self.num_tabs:
             self.complete()
@@ -337,12 +508,46 @@ class ProcessTabBar(QWidget):
     def complete_step(self, num, success=True):
         if 0 <= num < self.num_tabs:
             self.states[num].setState(State.SUCCESS if success else State.FAILURE)
-            self.update()
+            self._update_tabs((num,))
             #if num == self.num_tabs - 1:
             #    self.complete()
             self.step_completed.emit(num, success)
 
 
+def benchmark(tabs=30, frames=300):
+    """Print paint times of the bar without and with the pixmap cache.
+
+    Every third step is running, so each frame paints shimmers like an
+    animation tick. Run with QT_QPA_PLATFORM=offscreen for no window.
+    """
+    view = ProcessTabBar()
+    view.set_tab_count(tabs, ["apluslms/compile-step%d" % (i,) for i in range(tabs)])
+    view.resize(1600, 48)
+    view.start()
+    for i in range(tabs):
+        if i % 3 == 0:
+            view.start_step(i)
+        else:
+            view.complete_step(i, i % 7 != 0)
+    target = QPixmap(view.size() * view.devicePixelRatioF())
+    target.setDevicePixelRatio(view.devicePixelRatioF())
+    for cached in (False, True):
+        view.PIXMAP_CACHE = cached
+        view._pixmaps = {}
+        times = []
+        for frame in range(frames):
+            view._working_anim.value = frame / frames
+            start = perf_counter()
+            view.render(target)
+            times.append(perf_counter() - start)
+        times.sort()
+        print("%-10s mean %.3f ms, p50 %.3f ms, p95 %.3f ms" % (
+            "cached" if cached else "uncached",
+            sum(times) / len(times) * 1000,
+            times[len(times) // 2] * 1000,
+            times[int(len(times) * 0.95)] * 1000))
+
+
 if __name__ == '__main__':
     import sys, random
     from PyQt5.QtCore import QTimer
@@ -350,6 +555,10 @@ if __name__ == '__main__':
 
     app = QApplication(sys.argv)
 
+    if '--bench' in sys.argv:
+        benchmark()
+        sys.exit(0)
+
     view = ProcessTabBar()
     view.setWindowTitle("Test for ProgressTabWidget")
     view.setFixedSize(700, 48)
@@ -0,0 +1,27 @@
+import re
+
+
+# e.g. "reading sources... [ 42%] index" or "Downloading 42.5%"
+PROGRESS_RE = re.compile(r'(.*?)(?:\[\s*\d{1,3}%\]|\d{1,3}(?:\.\d+)?%)')
+
+
+class ProgressCollapser:
+    """Tells when a written line should replace the previous line.
+
+    A line replaces the previous line, if the previous line was transient,
+    i.e. ended with a carriage return, or if both lines are percent
+    progress lines with the same prefix.
+    """
+
+    def __init__(self, pattern=PROGRESS_RE):
+        self.pattern = pattern
+        self._transient = False
+        self._prefix = None
+
+    def replaces(self, line: str, transient: bool = False) -> bool:
+        match = self.pattern.match(line)
+        prefix = match.group(1) if match else None
+        replace = self._transient or (prefix is not None and prefix == self._prefix)
+        self._prefix = prefix
+        self._transient = transient
+        return replace
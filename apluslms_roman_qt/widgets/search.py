@@ -0,0 +1,265 @@
+"""
+Incremental full text search over log lines.
+
+Lines are grouped into chunks of CHUNK_LINES lines and the index keeps a
+list of chunks for every trigram in them. A search only scans the chunks,
+which contain all trigrams of the literal parts of the pattern. Results
+are kept per pattern and only lines written after the last search are
+scanned again.
+"""
+import re
+from array import array
+from bisect import bisect_left, bisect_right
+from collections import OrderedDict
+
+
+_REGEX_SPECIAL = set('.^$*+?{}[]\\|()')
+
+
+def regex_literals(pattern: str):
+    """Return list of substrings, which every match of the regex contains.
+
+    Only literal runs outside of groups and character classes are used.
+    An empty list means that nothing is known about the matches.
+    """
+    literals = []
+    run = []
+    depth = 0
+    i = 0
+    n = len(pattern)
+    while i < n:
+        c = pattern[i]
+        literal = None
+        if c == '\\':
+            escaped = pattern[i + 1:i + 2]
+            i += 2
+            if escaped and not escaped.isalnum():
+                literal = escaped
+        elif c == '[':
+            # skip the class, ']' right after '[' or '[^' is a member
+            i += 1
+            if pattern[i:i + 1] == '^':
+                i += 1
+            if pattern[i:i + 1] == ']':
+                i += 1
+            while i < n and pattern[i] != ']':
+                i += 2 if pattern[i] == '\\' else 1
+            i += 1
+        elif c == '(':
+            if depth == 0 and pattern[i + 1:i + 2] == '?' and \
+                    pattern[i + 2:i + 3] not in (':', '=', '!', '<', 'P'):
+                # inline flags may change what matches the literals
+                return []
+            depth += 1
+            i += 1
+        elif c == ')':
+            depth -= 1
+            i += 1
+        elif c == '|':
+            if depth == 0:
+                return []
+            i += 1
+        else:
+            i += 1
+            if c not in _REGEX_SPECIAL:
+                literal = c
+        if literal is not None and depth == 0:
+            quantifier = pattern[i:i + 1]
+            if quantifier not in ('?', '*', '{'):
+                run.append(literal)
+                if quantifier != '+':
+                    continue
+            # the run can not continue over a repeated character
+        if run:
+            literals.append(''.join(run))
+            run = []
+    if run:
+        literals.append(''.join(run))
+    return literals
+
+
+def trigrams(text: str):
+    return set(map(''.join, zip(text, text[1:], text[2:])))
+
+
+class SearchResult:
+    """Matches of a pattern as parallel arrays of line, column and length.
+
+    Lines before scanned have been searched, later lines are searched by
+    SearchIndex.find_all().
+    """
+
+    def __init__(self, expr, grams):
+        self.expr = expr
+        self.grams = grams
+        self.scanned = 0
+        self.lines = array('Q')
+        self.cols = array('I')
+        self.lengths = array('I')
+
+    def __len__(self):
+        return len(self.lines)
+
+    def __getitem__(self, i):
+        return self.lines[i], self.cols[i], self.lengths[i]
+
+    def truncate(self, count):
+        """Forget matches on lines count and after"""
+        if self.scanned > count:
+            i = bisect_left(self.lines, count)
+            del self.lines[i:], self.cols[i:], self.lengths[i:]
+            self.scanned = count
+
+    def next(self, line: int, col: int, backward: bool = False):
+        """Return index of the first match after (line, col) or None.
+
+        Backward search returns the last match before the position. The
+        search does not wrap around.
+        """
+        lines, cols = self.lines, self.cols
+        if not backward:
+            i = bisect_left(lines, line)
+            while i < len(lines) and lines[i] == line and cols[i] < col:
+                i += 1
+            return i if i < len(lines) else None
+        i = bisect_right(lines, line) - 1
+        while i >= 0 and lines[i] == line and cols[i] >= col:
+            i -= 1
+        return i if i >= 0 else None
+
+    def index_of(self, line: int, col: int):
+        """Return index of the match at (line, col) or None"""
+        i = self.next(line, col)
+        if i is not None and self.lines[i] == line and self.cols[i] == col:
+            return i
+        return None
+
+
+class SearchIndex:
+    """Trigram index from text to chunks of lines.
+
+    Lines are added with append() as they are written and the last line
+    can be removed with pop(). A removed line is not removed from the
+    index, a chunk may only be searched in vain.
+    """
+    CHUNK_LINES = 64
+    MAX_RESULTS = 8
+
+    def __init__(self):
+        self._postings = {}
+        self._count = 0
+        self._results = OrderedDict()
+
+    def __len__(self):
+        return self._count
+
+    def reset(self):
+        self._postings.clear()
+        self._count = 0
+        self._results.clear()
+
+    def append(self, line: str):
+        chunk = self._count // self.CHUNK_LINES
+        postings = self._postings
+        for gram in trigrams(line):
+            chunks = postings.get(gram)
+            if chunks is None:
+                postings[gram] = array('I', (chunk,))
+            elif chunks[-1] != chunk:
+                chunks.append(chunk)
+        self._count += 1
+
+    def extend(self, lines):
+        """Append many lines, which may cross chunk boundaries"""
+        size = self.CHUNK_LINES
+        postings = self._postings
+        lines = list(lines)
+        i = 0
+        while i < len(lines):
+            chunk = self._count // size
+            part = lines[i:i + size - self._count % size]
+            for gram in trigrams('\n'.join(part)):
+                if '\n' in gram:
+                    continue
+                chunks = postings.get(gram)
+                if chunks is None:
+                    postings[gram] = array('I', (chunk,))
+                elif chunks[-1] != chunk:
+                    chunks.append(chunk)
+            self._count += len(part)
+            i += len(part)
+
+    def pop(self):
+        """Remove the last line"""
+        if self._count:
+            self._count -= 1
+            for result in self._results.values():
+                result.truncate(self._count)
+
+    def _candidates(self, grams, start: int):
+        # chunks, which may have matches on lines start and after
+        first = start // self.CHUNK_LINES
+        last = (self._count - 1) // self.CHUNK_LINES
+        if not grams:
+            return range(first, last + 1)
+        postings = self._postings
+        lists = []
+        for gram in grams:
+            chunks = postings.get(gram)
+            if chunks is None:
+                return ()
+            lists.append(chunks)
+        lists.sort(key=len)
+        chunks = lists[0]
+        chunks = chunks[bisect_left(chunks, first):]
+        if len(lists) > 1:
+            common = set(chunks)
+            for other in lists[1:]:
+                common.intersection_update(other[bisect_left(other, first):])
+                if not common:
+                    return ()
+            chunks = sorted(common)
+        return chunks
+
+    def find_all(self, pattern: str, read, regex: bool = False) -> SearchResult:
+        """Return all matches of the pattern in lines given by read(start, stop).
+
+        Only lines added to the index are searched. Raises re.error on an
+        invalid regex.
+        """
+        key = (pattern, regex)
+        results = self._results
+        result = results.get(key)
+        if result is None:
+            if regex:
+                expr = re.compile(pattern)
+                literals = regex_literals(pattern)
+            else:
+                expr = re.compile(re.escape(pattern))
+                literals = [pattern]
+            grams = set()
+            for literal in literals:
+                grams.update(trigrams(literal))
+            results[key] = result = SearchResult(expr, grams)
+            if len(results) > self.MAX_RESULTS:
+                results.popitem(last=False)
+        else:
+            results.move_to_end(key)
+
+        start = result.scanned
+        count = self._count
+        if start >= count or not pattern:
+            return result
+        size = self.CHUNK_LINES
+        search = result.expr.finditer
+        lines, cols, lengths = result.lines, result.cols, result.lengths
+        for chunk in self._candidates(result.grams, start):
+            first = max(start, chunk * size)
+            for i, text in enumerate(read(first, min(count, first + size - first % size)), first):
+                for match in search(text):
+                    if match.end() > match.start():
+                        lines.append(i)
+                        cols.append(match.start())
+                        lengths.append(match.end() - match.start())
+        result.scanned = count
+        return result
@@ -1,4 +1,6 @@
+from collections import deque
 from enum import Enum
+from time import perf_counter
 from PyQt5.QtCore import (
     QFile,
     QFileInfo,
@@ -7,14 +9,18 @@ from PyQt5.QtCore import (
     QSize,
     Qt,
     QTextStream,
+    QTimer,
+    pyqtSignal,
+    pyqtSlot,
 )
 from PyQt5.QtGui import (
     QIcon,
     QKeySequence,
-    QFontMetrics,
-    QFontDatabase,
     QColor,
+    QFont,
     QPalette,
+    QTextCharFormat,
+    QTextCursor,
 )
 from PyQt5.QtWidgets import (
     QAction,
@@ -26,6 +32,21 @@ from PyQt5.QtWidgets import (
     QWidget,
 )
 
+try:
+    from .ansi import AnsiParser, Style, STYLES
+    from .fonts import cell_metrics, log_font
+    from .logstore import LayeredLog, LogSegment
+    from .paintprofile import profiled
+    from .progress import ProgressCollapser
+    from .search import SearchIndex
+except ImportError:
+    from ansi import AnsiParser, Style, STYLES
+    from fonts import cell_metrics, log_font
+    from logstore import LayeredLog, LogSegment
+    from paintprofile import profiled
+    from progress import ProgressCollapser
+    from search import SearchIndex
+
 
 class ColorPalette(Enum):
     BLACK = QColor("black")
@@ -33,27 +54,108 @@ class ColorPalette(Enum):
     BLUE = QColor("blue")
     RED = QColor("red")
 
+# lines are stored with style codes, see ansi.StyleTable
+TAG_CODES = {None: 0}
+TAG_CODES.update((tag, STYLES.code(Style(fg=tag.value.name()))) for tag in ColorPalette)
+
+
+def line_style(tag=None, runs=None):
+    """Return style code for a single style line or the tuple of runs"""
+    if runs is None:
+        return TAG_CODES[tag]
+    if len(runs) == 1 and runs[0][0] == 0:
+        return runs[0][1]
+    return tuple(runs)
+
+
+def iter_runs(line, style):
+    """Yield (text, code) pieces of the line"""
+    if isinstance(style, int):
+        yield line, style
+        return
+    ends = [col for col, _ in style[1:]] + [len(line)]
+    for (col, code), end in zip(style, ends):
+        if end > col:
+            yield line[col:end], code
+
+
+def style_format(code):
+    style = STYLES[code]
+    fg = QColor(style.fg) if style.fg else ColorPalette.WHITE.value
+    bg = QColor(style.bg) if style.bg else None
+    if style.inverse:
+        fg, bg = bg or ColorPalette.BLACK.value, fg
+    fmt = QTextCharFormat()
+    fmt.setForeground(fg)
+    if bg is not None:
+        fmt.setBackground(bg)
+    if style.bold:
+        fmt.setFontWeight(QFont.Bold)
+    fmt.setFontItalic(style.italic)
+    fmt.setFontUnderline(style.underline)
+    return fmt
+
 
+@profiled()
 class TextLogWidget(QTextEdit):
     PALETTE = ColorPalette
+    MAX_LINES = 10000
+    PAGE_LINES = 500
+    FRAME_MS = 16
+    FLUSH_TIME = 0.008
+    FLUSH_LINES = 256
+    INDEX_LINES = 4096
+    MAX_PENDING = 10000
 
-    def __init__(self, parent=None):
+    lines_indexed = pyqtSignal(int, list) # first line, texts
+    lines_truncated = pyqtSignal(int) # line count
+    pending_drained = pyqtSignal()
+
+    def __init__(self, parent=None, max_lines=None, collapse_progress=True):
         super().__init__(parent)
+        # Lines in the document are a window [_first, _first + len(_styles))
+        # of all _total written lines. Lines before the window are in the
+        # spill segment on disk. When the window is moved back, the whole
+        # log is in the spill segment until the window reaches the end.
+        self.max_lines = max_lines or self.MAX_LINES
+        self._spill = None
+        self._styles = deque()
+        self._first = 0
+        self._total = 0
+        self._updating = False
+
+        # Written lines are queued as [style, lines] and flushed to the
+        # document once per frame. Lines with a single style code are
+        # grouped, lines with runs have a list of their own.
+        self._pending = deque()
+        self._pending_count = 0
+        self._flush_timer = timer = QTimer(self)
+        timer.setSingleShot(True)
+        timer.setInterval(self.FRAME_MS)
+        timer.timeout.connect(self.flush)
+        self._formats = {}
+        self._parser = None
+        # Progress updates replace the previous line
+        self._progress = ProgressCollapser() if collapse_progress else None
+
+        # Flushed lines are added to the search index, lines of an opened
+        # log file are indexed in slices when the event loop is idle.
+        # Indexed lines are also told to the lines_indexed listeners.
+        self._search = SearchIndex()
+        self._index_timer = timer = QTimer(self)
+        timer.timeout.connect(self._index_step)
 
         # Lock textedit for readonly mode
         self.setReadOnly(True)
         #self.setAcceptRichText(False)
-        #self.setUndoRedoEnabled(False)
+        self.setUndoRedoEnabled(False)
 
-        # Add and set font
-        font_db = QFontDatabase()
-        font_db.addApplicationFont("/users/jkantoja/Develop/apluslms/roman-qt/apluslms_roman_qt/DejaVuSansMono.ttf")
-        font = self.currentFont()
-        font.setFamily("DejaVu Sans Mono")
+        # Set font, which is registered once per process
+        font = log_font(self.currentFont())
         self.setFont(font)
 
         # Calculate tab stop
-        ts = QFontMetrics(font).width('a') * 4
+        ts = cell_metrics(font).width * 4
         self.setTabStopWidth(ts);
 
         # Background color and default font color
@@ -63,27 +165,547 @@ class TextLogWidget(QTextEdit):
         self.setPalette(palette)
         self.setTextColor(ColorPalette.WHITE.value)
 
+        self.verticalScrollBar().valueChanged.connect(self._on_scroll)
+
     def setSize(self, cols, rows):
-        metrics = QFontMetrics(self.currentFont())
-        cw, ch = metrics.width('a'), metrics.height()
+        cw, ch, _ = cell_metrics(self.currentFont())
         self.setFixedSize(cw*cols, ch*rows)
 
-    def write(self, line, tag=None):
-        cur_color = None
-        if tag:
-            cur_color = self.textColor()
-            self.setTextColor(tag.value)
-        self.append(str(line).rstrip())
-        #self.insertPlainText(str(line).rstrip() + '\n')
-        if cur_color:
-            self.setTextColor(cur_color)
+    @property
+    def line_count(self):
+        return self._total
+
+    @property
+    def is_following(self):
+        return self._first + len(self._styles) == self._total
+
+    @property
+    def is_backlogged(self):
+        """True, when MAX_PENDING lines are queued. pending_drained is
+        emitted, when the queue is shorter again."""
+        return self._pending_count >= self.MAX_PENDING
+
+    def write(self, line, tag=None, runs=None, transient=False):
+        """Queue a line with a palette tag or with (column, code) runs.
+
+        Transient line is replaced by the next line in progress mode.
+        """
+        line = str(line).rstrip()
+        style = line_style(tag, runs)
+        if self._progress and self._progress.replaces(line, transient):
+            self._remove_last()
+        pending = self._pending
+        if isinstance(style, int) and pending and pending[-1][0] == style:
+            pending[-1][1].append(line)
+        else:
+            pending.append((style, [line]))
+        self._pending_count += 1
+        if not self._flush_timer.isActive():
+            self._flush_timer.start()
+
+    def feed(self, data, final=False):
+        """Write raw output, which may contain ANSI escape sequences"""
+        parser = self._parser
+        if parser is None:
+            self._parser = parser = AnsiParser()
+        self.write_lines(parser.feed(data))
+        if final:
+            self.write_lines(parser.flush())
+
+    def write_lines(self, lines):
+        """Write parsed (text, runs, transient) lines"""
+        write = self.write
+        for line, runs, transient in lines:
+            write(line, runs=runs, transient=transient)
+
+    def open_log(self, path):
+        """Show a log file written by LogFile after the written lines.
+
+        The file is memory mapped and becomes the scrollback after the
+        spill segment, so only the window of lines is in the document.
+        Lines appended to the file are shown by reload() and lines written
+        after opening go after the lines of the file loaded so far. A file
+        opened before is copied to the spill segment and closed.
+        """
+        following = self.is_following
+        self._spill_written()
+        spill = self._spill
+        if isinstance(spill, LayeredLog):
+            spill = spill.flatten()
+        self._spill = LayeredLog(path, base=spill, collapser=self._progress)
+        self._load_appended(following)
+
+    @pyqtSlot()
+    def reload(self):
+        """Show lines appended to the opened log file"""
+        spill = self._spill
+        if not isinstance(spill, LayeredLog):
+            return
+        following = self.is_following
+        self._spill_written()
+        popped = spill.refresh()
+        if popped:
+            self._truncate(self._total - popped)
+        if len(spill) != self._total:
+            self._load_appended(following)
+
+    def _spill_written(self):
+        # written lines go to the disk before the next lines of the file
+        if self._pending:
+            self._flush_timer.stop()
+            self._spill_pending(self._pending_count)
+        self._sync_spill()
+
+    def _truncate(self, count):
+        # remove lines after count, which are on the disk already
+        self._total = count
+        if len(self._search) > count:
+            while len(self._search) > count:
+                self._search.pop()
+            self.lines_truncated.emit(count)
+        styles = self._styles
+        keep = max(0, count - self._first)
+        if keep >= len(styles):
+            return
+        if not keep:
+            self.document().clear()
+            styles.clear()
+            self._first = count
+            return
+        block = self.document().findBlockByNumber(keep)
+        cursor = QTextCursor(block)
+        cursor.movePosition(QTextCursor.PreviousCharacter)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        for _ in range(len(styles) - keep):
+            styles.pop()
+
+    def _load_appended(self, following):
+        self._total = len(self._spill)
+        if len(self._search) < self._total:
+            self._index_timer.start()
+        if not following:
+            # window is in the scrollback, paging reaches the new lines
+            return
+        styles = self._styles
+        start = self._first + len(styles)
+        if self._total - start > self.max_lines:
+            self.document().clear()
+            styles.clear()
+            self._first = start = self._total - self.max_lines
+        lines = self._spill.read(start, self._total)
+        bar = self.verticalScrollBar()
+        self._updating = True
+        try:
+            cursor = QTextCursor(self.document())
+            cursor.movePosition(QTextCursor.End)
+            cursor.beginEditBlock()
+            for line, style in lines:
+                if styles:
+                    cursor.insertBlock()
+                for text, code in iter_runs(line, style):
+                    cursor.insertText(text, self._format(code))
+                styles.append(style)
+            cursor.endEditBlock()
+            self._trim_top()
+            bar.setValue(bar.maximum())
+        finally:
+            self._updating = False
+
+    def _remove_last(self):
+        pending = self._pending
+        if pending:
+            lines = pending[-1][1]
+            lines.pop()
+            if not lines:
+                pending.pop()
+            self._pending_count -= 1
+            return
+        if not self._total:
+            return
+        following = self.is_following
+        spill = self._spill
+        if spill is not None and len(spill) == self._total:
+            spill.pop()
+        self._total -= 1
+        if len(self._search) > self._total:
+            # lines of an opened log may not be indexed yet
+            self._search.pop()
+            self.lines_truncated.emit(self._total)
+        if not following:
+            # window is in the scrollback, the line was only on the disk
+            return
+        styles = self._styles
+        styles.pop()
+        if not styles:
+            self.document().clear()
+            return
+        cursor = QTextCursor(self.document().lastBlock())
+        cursor.movePosition(QTextCursor.PreviousCharacter)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+
+    def _format(self, code):
+        fmt = self._formats.get(code)
+        if fmt is None:
+            self._formats[code] = fmt = style_format(code)
+        return fmt
+
+    @pyqtSlot()
+    def flush(self):
+        """Write queued lines to the document in a single edit block.
+
+        Stops after FLUSH_TIME seconds and continues on the next frame, so
+        the event loop keeps handling input during large bursts.
+        """
+        pending = self._pending
+        if not pending:
+            return
+        backlogged = self.is_backlogged
+        if not self.is_following:
+            # window is in the scrollback, new lines go only to the disk
+            self._spill_pending(self._pending_count)
+        else:
+            self._updating = True
+            try:
+                self._flush_window()
+            finally:
+                self._updating = False
+            if pending:
+                self._flush_timer.start()
+        if backlogged and not self.is_backlogged:
+            self.pending_drained.emit()
+
+    def _flush_window(self):
+        pending = self._pending
+        if self._pending_count > self.max_lines:
+            # burst is larger than the window, skip directly to the disk
+            self._sync_spill()
+            self.document().clear()
+            self._styles.clear()
+            self._spill_pending(self._pending_count - self.max_lines)
+            self._first = self._total
+
+        bar = self.verticalScrollBar()
+        at_bottom = bar.value() == bar.maximum()
+        deadline = perf_counter() + self.FLUSH_TIME
+        styles = self._styles
+        chunk_size = self.FLUSH_LINES
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.End)
+        cursor.beginEditBlock()
+        while pending:
+            style, lines = pending[0]
+            chunk = lines[:chunk_size]
+            if len(lines) > chunk_size:
+                del lines[:chunk_size]
+            else:
+                pending.popleft()
+            # the empty document has a single block ready for the first line
+            if styles:
+                cursor.insertBlock()
+            if isinstance(style, int):
+                cursor.insertText('\n'.join(chunk), self._format(style))
+            else:
+                for text, code in iter_runs(chunk[0], style):
+                    cursor.insertText(text, self._format(code))
+            styles.extend([style] * len(chunk))
+            self._index_written(chunk)
+            self._total += len(chunk)
+            self._pending_count -= len(chunk)
+            if perf_counter() > deadline:
+                break
+        cursor.endEditBlock()
+        self._trim_top()
+        if at_bottom:
+            bar.setValue(bar.maximum())
+
+    def _spill_pending(self, count):
+        spill = self._spill_segment()
+        pending = self._pending
+        self._pending_count -= count
+        while count > 0:
+            style, lines = pending[0]
+            spill.extend(lines[:count], style)
+            self._index_written(lines[:count])
+            self._total += min(count, len(lines))
+            if len(lines) > count:
+                del lines[:count]
+                break
+            pending.popleft()
+            count -= len(lines)
+
+    def _spill_segment(self):
+        if self._spill is None:
+            self._spill = LogSegment()
+        return self._spill
+
+    def _sync_spill(self):
+        # write all document lines, which are not yet on the disk
+        spill = self._spill_segment()
+        styles = self._styles
+        start = len(spill) - self._first
+        block = self.document().findBlockByNumber(start)
+        for i in range(start, len(styles)):
+            spill.append(block.text(), styles[i])
+            block = block.next()
+
+    def _trim_top(self):
+        # every removal relayouts the document, so drop lines in large steps
+        excess = len(self._styles) - self.max_lines
+        if excess > 0:
+            self._drop_first(excess + self.max_lines // 4)
+
+    def _drop_first(self, count):
+        spill = self._spill_segment()
+        styles = self._styles
+        first = self._first
+        block = self.document().firstBlock()
+        for i in range(count):
+            if first + i >= len(spill):
+                spill.append(block.text(), styles[i])
+            block = block.next()
+        cursor = QTextCursor(block)
+        cursor.movePosition(QTextCursor.Start, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        for _ in range(count):
+            styles.popleft()
+        self._first += count
+
+    def _drop_last(self, count):
+        self._sync_spill()
+        styles = self._styles
+        block = self.document().findBlockByNumber(len(styles) - count)
+        cursor = QTextCursor(block)
+        cursor.movePosition(QTextCursor.PreviousCharacter)
+        cursor.movePosition(QTextCursor.End, QTextCursor.KeepAnchor)
+        cursor.removeSelectedText()
+        for _ in range(count):
+            styles.pop()
+
+    def _insert_lines(self, cursor, lines, at_end):
+        for line, style in lines:
+            if at_end:
+                cursor.insertBlock()
+            for text, code in iter_runs(line, style):
+                cursor.insertText(text, self._format(code))
+            if not at_end:
+                cursor.insertBlock()
+
+    def _block_top(self, number):
+        doc = self.document()
+        block = doc.findBlockByNumber(number)
+        return int(doc.documentLayout().blockBoundingRect(block).top())
+
+    def _page_up(self):
+        count = min(self.PAGE_LINES, self._first)
+        lines = self._spill.read(self._first - count, self._first)
+        excess = len(self._styles) + count - self.max_lines
+        if excess > 0:
+            self._drop_last(excess)
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.Start)
+        self._insert_lines(cursor, lines, at_end=False)
+        self._styles.extendleft(style for _, style in reversed(lines))
+        self._first -= count
+        # keep the previously first line at the top of the view
+        self.verticalScrollBar().setValue(self._block_top(count))
+
+    def _page_down(self):
+        end = self._first + len(self._styles)
+        count = min(self.PAGE_LINES, self._total - end)
+        lines = self._spill.read(end, end + count)
+        cursor = QTextCursor(self.document())
+        cursor.movePosition(QTextCursor.End)
+        self._insert_lines(cursor, lines, at_end=True)
+        self._styles.extend(style for _, style in lines)
+        self._trim_top()
+        # keep the previously last line at the bottom of the view
+        bottom = self._block_top(len(self._styles) - count)
+        self.verticalScrollBar().setValue(bottom - self.viewport().height())
+
+    def _show_line(self, index):
+        # move the window over the line, if it is not in the document
+        if self._first <= index < self._first + len(self._styles):
+            return
+        self._sync_spill()
+        styles = self._styles
+        self.document().clear()
+        styles.clear()
+        start = max(0, min(index - self.max_lines // 2, self._total - self.max_lines))
+        lines = self._spill.read(start, start + self.max_lines)
+        cursor = QTextCursor(self.document())
+        cursor.beginEditBlock()
+        for line, style in lines:
+            if styles:
+                cursor.insertBlock()
+            for text, code in iter_runs(line, style):
+                cursor.insertText(text, self._format(code))
+            styles.append(style)
+        cursor.endEditBlock()
+        self._first = start
+
+    def _on_scroll(self, value):
+        if self._updating:
+            return
+        bar = self.verticalScrollBar()
+        self._updating = True
+        try:
+            if value == bar.minimum() and self._first > 0:
+                self._page_up()
+            elif value == bar.maximum() and not self.is_following:
+                self._page_down()
+        finally:
+            self._updating = False
+
+    ## Search
+
+    def lines(self, start: int, stop: int):
+        """Return texts of written lines in range start..stop"""
+        start = max(0, start)
+        stop = min(self._total, stop)
+        first = self._first
+        end = first + len(self._styles)
+        result = []
+        if start < min(stop, first):
+            result.extend(line for line, _ in self._spill.read(start, min(stop, first)))
+        if max(start, first) < min(stop, end):
+            block = self.document().findBlockByNumber(max(start, first) - first)
+            for _ in range(max(start, first), min(stop, end)):
+                result.append(block.text())
+                block = block.next()
+        if max(start, end) < stop:
+            result.extend(line for line, _ in self._spill.read(max(start, end), stop))
+        return result
+
+    def _index(self, lines):
+        start = len(self._search)
+        self._search.extend(lines)
+        self.lines_indexed.emit(start, lines)
+
+    def _index_written(self, lines):
+        # lines are written at _total, the timer indexes the lines before
+        if len(self._search) == self._total:
+            self._index(lines)
+        else:
+            self._index_timer.start()
+
+    def _index_more(self, limit):
+        # index lines of an opened log file, returns True when all are done
+        start = len(self._search)
+        stop = min(self._total, start + limit)
+        if stop > start:
+            self._index(self.lines(start, stop))
+        return stop >= self._total
+
+    @pyqtSlot()
+    def _index_step(self):
+        if self._index_more(self.INDEX_LINES):
+            self._index_timer.stop()
+
+    def search(self, pattern: str, regex: bool = False):
+        """Return SearchResult with all matches in the log.
+
+        Raises re.error on an invalid regex.
+        """
+        while self._pending:
+            self.flush()
+        if len(self._search) < self._total:
+            self._index_more(self._total)
+            self._index_timer.stop()
+        return self._search.find_all(pattern, self.lines, regex=regex)
+
+    @pyqtSlot()
+    def clearSelection(self):
+        cursor = self.textCursor()
+        cursor.clearSelection()
+        self.setTextCursor(cursor)
+
+    def find(self, text: str, backward: bool = False, regex: bool = False) -> bool:
+        """Select the next match after the selection or the first visible line"""
+        if not text:
+            return False
+        result = self.search(text, regex=regex)
+        cursor = self.textCursor()
+        if cursor.hasSelection():
+            pos = cursor.selectionStart() if backward else cursor.selectionEnd()
+        else:
+            pos = self.cursorForPosition(QPoint(0, 0)).position()
+        block = self.document().findBlock(pos)
+        line = self._first + block.blockNumber()
+        col = pos - block.position()
+        i = result.next(line, col, backward=backward)
+        if i is None:
+            return False
+        self.show_match(*result[i])
+        return True
+
+    def show_match(self, line: int, col: int, length: int):
+        """Select text on the line and scroll it visible"""
+        self._updating = True
+        try:
+            self._show_line(line)
+            block = self.document().findBlockByNumber(line - self._first)
+            cursor = QTextCursor(block)
+            cursor.setPosition(block.position() + col)
+            cursor.setPosition(block.position() + col + length, QTextCursor.KeepAnchor)
+            self.setTextCursor(cursor)
+            self.ensureCursorVisible()
+        finally:
+            self._updating = False
+
+
+def benchmark(lines=1000000, step=100000, frame=1000, max_lines=None):
+    """Print append cost per line for every step lines.
+
+    Queued lines are flushed after every frame lines.
+    """
+    log = TextLogWidget(max_lines=max_lines, collapse_progress=False)
+    log.setSize(80, 20)
+    log.show()
+    start = perf_counter()
+    for i in range(1, lines + 1):
+        log.write("reading sources... [%3d%%] module%02d/chapter%02d" % (
+            i % 100, i % 97, i % 13))
+        if i % frame == 0:
+            while log._pending:
+                log.flush()
+        if i % step == 0:
+            QApplication.processEvents()
+            now = perf_counter()
+            print("%8d lines: %.2f us/line" % (i, (now - start) / step * 1e6))
+            start = now
+
+
+def benchmark_startup(count=50):
+    """Print cost of creating the log widgets of a pipeline with count steps"""
+    for _ in range(2):
+        start = perf_counter()
+        logs = []
+        for i in range(count):
+            log = TextLogWidget()
+            log.setSize(80, 20)
+            log.write("log %d" % (i,))
+            logs.append(log)
+        elapsed = perf_counter() - start
+        print("%d log widgets: %.1f ms, %.2f ms/widget" % (
+            count, elapsed * 1000, elapsed / count * 1000))
+        for log in logs:
+            log.deleteLater()
+        QApplication.processEvents()
 
 
 if __name__ == '__main__':
     import sys, time
-    from PyQt5.QtCore import QTimer
     app = QApplication(sys.argv)
 
+    if '--bench' in sys.argv:
+        benchmark()
+        sys.exit(0)
+    if '--bench-startup' in sys.argv:
+        benchmark_startup()
+        sys.exit(0)
+
     class TestData:
         def __init__(self, log):
             self.log = log
@@ -56,7 +56,7 @@ options = dict(
     packages=['apluslms_roman_qt'],
     include_package_data = True,
     package_data={
-        '': ['*.json'],
+        '': ['*.json', '*.ttf'],
     },
 
     install_requires=[